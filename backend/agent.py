@@ -1,49 +1,201 @@
 """NHS/LBS chat agent session management, tools, and deterministic flows."""
 
+import contextvars
 import json
 import os
 import re
 import time
-from typing import Any, Dict, List, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from threading import Event
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from dotenv import load_dotenv
 from openai import OpenAI, RateLimitError
 
+from answer_cache import ANSWER_CACHE
+from call_sites import CALL_SITE_REGISTRY
+from cassettes import CASSETTE
 from config import (
-    ACTION_KEYWORDS,
-    CANONICAL_LINKS,
+    LINK_TAG_RULES,
     ONBOARDING_QUESTIONS,
-    ONBOARDING_TRIGGER_PHRASES,
 )
 from extract import extract_profile, strip_profile_tag
+from history import ConversationHistory
+from intent import INTENT_ROUTER
+from keywords import KEYWORDS, scan_keywords
+from links import LINK_CATALOG
+from llm import create_response
+from profiles import validate_answer, with_postcode_fields
+from profiling import follow
 from prompts import intro_prompt, build_system_prompt
+from scheduler import turn_priority
+from streaming import ReplyStreamProcessor, reply_sink
 from tools import (
     emergency_response,
-    guided_search,
-    nhs_111_live_triage,
     safety_check,
-    tool_nearest_nhs_services,
-    tool_safety,
     tools,
 )
+from tool_registry import TOOL_REGISTRY, ToolTimeout
+from tracing import annotate, span
+from usage import BudgetExceeded, SessionUsage, session_usage
 
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+client = CASSETTE.wrap(OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None)
 
 
-# --- Tool Registry for Python-side Execution ---
+# --- Tool dispatch for Python-side execution ---
 def execute_tool(tool_name: str, arguments: Dict[str, Any]):
-    """Dispatch supported tool calls by name."""
-    if tool_name == "nearest_nhs_services":
-        return tool_nearest_nhs_services(arguments)
-    if tool_name == "trigger_safety_protocol":
-        return tool_safety(arguments)
-    if tool_name == "guided_search":
-        return guided_search(arguments)
-    if tool_name == "nhs_111_live_triage":
-        return nhs_111_live_triage(arguments)
-    return f"[Error: Unknown tool '{tool_name}']"
+    """Dispatch a tool call through the registry, which applies its policy."""
+    return TOOL_REGISTRY.execute(tool_name, arguments)
+
+
+TOOL_PREFETCH = os.getenv("TOOL_PREFETCH", "").strip().lower() in {"1", "true", "yes"}
+# One bounded pool for every session's parallel rounds and prefetches, sized
+# above what the per-tool concurrency limits can admit at once so a slot, not
+# a worker, is what a call waits for.
+TOOL_MAX_WORKERS = int(os.getenv("TOOL_MAX_WORKERS", "0")) or TOOL_REGISTRY.concurrency(unlimited=8) + 8
+_POSTCODE_IN_TEXT = re.compile(r"\b[A-Z]{1,2}\d[A-Z\d]?\s*\d[A-Z]{2}\b")
+_tool_executor = ThreadPoolExecutor(
+    max_workers=TOOL_MAX_WORKERS, thread_name_prefix="evi-tool"
+)
+
+
+def _tool_arguments(raw_args: Any) -> Dict[str, Any]:
+    if isinstance(raw_args, str):
+        try:
+            return json.loads(raw_args)
+        except Exception:
+            return {}
+    return raw_args or {}
+
+
+def _tool_failure(tool_name: str, reason: str) -> Dict[str, str]:
+    return {"error": f"{tool_name} failed: {reason}"}
+
+
+class _PendingTool:
+    """A tool call on a worker thread; its deadline starts when the worker starts it."""
+
+    __slots__ = ("name", "started", "started_at", "future")
+
+    def __init__(self, name: str, args: Dict[str, Any]):
+        self.name = name
+        self.started = Event()
+        self.started_at = 0.0
+        # Each task gets its own copy of the context so spans and usage attribution follow it.
+        self.future: Future = _tool_executor.submit(contextvars.copy_context().run, follow(self._run), args)
+
+    def _run(self, args: Dict[str, Any]) -> Any:
+        self.started_at = time.monotonic()
+        self.started.set()
+        return execute_tool(self.name, args)
+
+    def result(self) -> Any:
+        timeout = TOOL_REGISTRY.timeout(self.name)
+        # Waiting for a worker is bounded separately, so a full pool cannot hang the turn.
+        if not self.started.wait(timeout) and self.future.cancel():
+            TOOL_REGISTRY.record_timeout(self.name)
+            raise ToolTimeout(f"no free tool worker within {timeout:g}s")
+        self.started.wait()
+        try:
+            return self.future.result(timeout=max(0.0, self.started_at + timeout - time.monotonic()))
+        except FutureTimeout:
+            TOOL_REGISTRY.record_timeout(self.name)
+            raise ToolTimeout(f"timed out after {timeout:g}s") from None
+
+
+def run_tool(tool_name: str, args: Dict[str, Any]) -> Any:
+    """
+    Run one tool call on the calling thread; raises when it fails. A lone call
+    cannot be abandoned without leaving its thread behind, so it relies on the
+    handler's own timeouts and an overrun is only counted as a timeout.
+    """
+    started = time.monotonic()
+    result = execute_tool(tool_name, args)
+    if time.monotonic() - started > TOOL_REGISTRY.timeout(tool_name):
+        TOOL_REGISTRY.record_timeout(tool_name)
+    return result
+
+
+def prefetch_tool(tool_name: str, args: Dict[str, Any]) -> None:
+    """Start a speculative tool call whose result is left in the registry cache."""
+    if TOOL_REGISTRY.can_prefetch(tool_name):
+        _tool_executor.submit(contextvars.copy_context().run, follow(execute_tool), tool_name, args)
+
+
+def run_tool_calls(calls: List[Tuple[str, Dict[str, Any]]]) -> List[Any]:
+    """
+    Execute a round of tool calls and return their results in call order;
+    a call that raises or times out yields an error result instead of
+    failing the round. A lone call runs on the calling thread. Several calls
+    run concurrently on the shared bounded pool, each held to its tool's
+    timeout from when its handler starts.
+    """
+    if len(calls) == 1:
+        tool_name, args = calls[0]
+        try:
+            return [run_tool(tool_name, args)]
+        except Exception as exc:
+            return [_tool_failure(tool_name, str(exc) or type(exc).__name__)]
+    pending = [_PendingTool(tool_name, args) for tool_name, args in calls]
+    results: List[Any] = []
+    for call in pending:
+        try:
+            results.append(call.result())
+        except Exception as exc:
+            results.append(_tool_failure(call.name, str(exc) or type(exc).__name__))
+    return results
+
+
+def is_deterministic_message(user_input: str) -> bool:
+    """True when a message is answered without a model call whatever the session state."""
+    return "onboarding" in scan_keywords(user_input) or safety_check(user_input)
+
+
+class FinalReplyStream:
+    """
+    Push-side counterpart of ``AgentSession._process_final_reply``: model text
+    is fed as it arrives and clean text reaches ``sink`` once it is safe to show.
+    """
+
+    def __init__(self, session: "AgentSession", user_input: str, sink: Callable[[str], None]):
+        self._session = session
+        self._user_input = user_input
+        self._sink = sink
+        self.restart()
+
+    def restart(self) -> None:
+        """Start over for the next model call; the previous one asked for tools."""
+        self._processor = ReplyStreamProcessor(
+            select_links=lambda raw: self._session._select_useful_links(self._user_input, raw)
+        )
+        self._parts: List[str] = []
+
+    @property
+    def raw(self) -> str:
+        return self._processor.raw
+
+    def feed(self, chunk: str) -> None:
+        self._emit(self._processor.feed(chunk))
+
+    def finish(self) -> str:
+        """Flush the reply, apply the history/profile updates and return the clean text."""
+        with span("postprocess"):
+            self._emit(self._processor.finish())
+        self._session.last_useful_links = self._processor.links
+        clean = "".join(self._parts)
+        follow_up = self._session._record_final_reply(clean, self._processor.profile)
+        if follow_up:
+            self._emit("\n\n" + follow_up)
+            clean = clean + "\n\n" + follow_up
+        return clean
+
+    def _emit(self, text: str) -> None:
+        if text:
+            self._parts.append(text)
+            self._sink(text)
 
 
 class AgentSession:
@@ -52,11 +204,46 @@ class AgentSession:
     Maintains conversation + onboarding/triage state across turns.
     """
 
-    def __init__(self, client_override: Optional[OpenAI] = None):
+    # Slotted so idle sessions stay small; tuning constants live on the class.
+    __slots__ = (
+        "client",
+        "conversation_history",
+        "user_profile",
+        "system_prompt",
+        "onboarding_active",
+        "onboarding_state",
+        "triage_active",
+        "triage_known_answers",
+        "triage_asked_questions",
+        "triage_asked_topics",
+        "triage_round",
+        "triage_awaiting_answers",
+        "triage_presenting_issue",
+        "triage_answer_notes",
+        "prompt_suggestions",
+        "last_useful_links",
+        "usage",
+        "response_versions",
+        "last_triage_result",
+    )
+
+    HISTORY_WINDOW = 15
+    MAX_OUT = 250
+    MAX_TOOL_ROUNDS = 4
+    MAX_RETRIES = 2
+
+    def __init__(
+        self,
+        client_override: Optional[OpenAI] = None,
+        history_archive_path: Optional[str] = None,
+    ):
         if client_override is None and client is None:
             raise ValueError("OPENAI_API_KEY is not configured.")
         self.client = client_override or client
-        self.conversation_history: List[Dict[str, str]] = []
+        # Only the last HISTORY_WINDOW messages are ever sent to the model.
+        self.conversation_history = ConversationHistory(
+            self.HISTORY_WINDOW, archive_path=history_archive_path
+        )
         self.user_profile: Dict[str, Any] = {}
         self.system_prompt = build_system_prompt(self.user_profile)
 
@@ -74,20 +261,20 @@ class AgentSession:
 
         self.prompt_suggestions: List[str] = []
         self.last_useful_links: List[Dict[str, str]] = []
-
-        self.HISTORY_WINDOW = 15
-        self.MAX_OUT = 250
-        self.MAX_TOOL_ROUNDS = 4
-        self.MAX_RETRIES = 2
+        self.usage = SessionUsage()
+        # field -> (version, value last sent), for delta-encoded API responses
+        self.response_versions: Dict[str, Tuple[int, Any]] = {}
+        # final routing of the latest triage, read by the offline evaluator
+        self.last_triage_result: Optional[Dict[str, Any]] = None
 
     # -----------------------------
     # SAFE MODEL CALL (TPM-aware)
     # -----------------------------
-    def safe_create(self, **kwargs):
+    def safe_create(self, call_site: str, **kwargs):
         """Call OpenAI with retries and trimmed history if rate limited."""
         for attempt in range(self.MAX_RETRIES + 1):
             try:
-                return self.client.responses.create(**kwargs)
+                return create_response(self.client, call_site, attempt=attempt, **kwargs)
             except RateLimitError:
                 if "input" in kwargs and isinstance(kwargs["input"], list):
                     sys_and_pins = [
@@ -95,22 +282,14 @@ class AgentSession:
                     ]
                     others = [x for x in kwargs["input"] if x.get("role") != "system"]
                     kwargs["input"] = sys_and_pins + others[-3:]
-                kwargs["max_output_tokens"] = min(
-                    kwargs.get("max_output_tokens", self.MAX_OUT), 150
-                )
+                budget = CALL_SITE_REGISTRY.output_budget(call_site) or self.MAX_OUT
+                kwargs["max_output_tokens"] = min(kwargs.get("max_output_tokens", budget), 150)
                 time.sleep(0.2)
         raise
 
     def set_user_profile(self, profile: Dict[str, Any]) -> None:
         """Set the profile from the UI and rebuild system prompt."""
-        postcode_full, postcode_area = self._derive_postcode_fields(
-            str(profile.get("postcode") or "")
-        )
-        if postcode_full:
-            profile["postcode_full"] = postcode_full
-        if postcode_area:
-            profile["postcode_area"] = postcode_area
-        self.user_profile = profile
+        self.user_profile = with_postcode_fields(profile)
         self.system_prompt = build_system_prompt(self.user_profile)
         self.conversation_history.append(
             {
@@ -119,6 +298,13 @@ class AgentSession:
             }
         )
 
+    def submit_onboarding_profile(self, profile: Dict[str, Any]) -> str:
+        """Save a validated profile submitted in one go and close onboarding."""
+        self.set_user_profile(profile)
+        self.onboarding_active = False
+        self.onboarding_state = None
+        return self._eligibility_summary_from_profile(self.user_profile)
+
     def _update_state_from_tool(self, tool_name: str, tool_result: Any):
         """Integrate tool outputs into triage state tracking."""
         parsed = None
@@ -255,12 +441,11 @@ class AgentSession:
         )
         try:
             resp = self.safe_create(
-                model="gpt-4o-mini",
+                "triage.questions",
                 store=True,
                 input=[{"role": "system", "content": prompt}],
                 tools=[],
                 tool_choice="none",
-                max_output_tokens=160,
             )
             raw = resp.output_text or "[]"
             cleaned = raw.strip()
@@ -350,7 +535,7 @@ class AgentSession:
             "postcode_full": postcode_full,
             "known_answers": known_answers,
         }
-        tool_result = execute_tool("nhs_111_live_triage", tool_args)
+        tool_result = run_tool_calls([("nhs_111_live_triage", tool_args)])[0]
         parsed_tool = None
         try:
             parsed_tool = (
@@ -378,12 +563,13 @@ class AgentSession:
             and parsed_tool.get("suggested_service") in {"GP", "A&E"}
         ):
             try:
-                nearest_services = tool_nearest_nhs_services(
+                nearest_services = run_tool(
+                    "nearest_nhs_services",
                     {
                         "postcode_full": parsed_tool.get("postcode_full", ""),
                         "service_type": parsed_tool.get("suggested_service"),
                         "n": 3,
-                    }
+                    },
                 )
             except Exception:
                 nearest_services = None
@@ -424,108 +610,11 @@ class AgentSession:
         self.onboarding_state["reprompted"] = False
         return str(question.get("question", "")).strip()
 
-    def _normalize_onboarding_answer(self, raw: str):
-        """Normalize onboarding input (strip, lowercase skip tokens)."""
-        text = (raw or "").strip()
-        if text == "":
-            return "", True
-        lowered = text.lower()
-        if lowered in {"skip", "prefer not to say", "n/a", "na"}:
-            return "", False
-        return text, False
-
-    def _validate_age_range(self, text: str) -> Optional[str]:
-        if re.match(r"^\d{1,3}$", text):
-            return text
-        if re.match(r"^\d{1,2}\s*-\s*\d{1,2}$", text):
-            return text.replace(" ", "")
-        if re.match(r"^\d{1,2}\+$", text):
-            return text
-        return None
-
-    def _validate_yes_no(self, text: str) -> Optional[str]:
-        lowered = text.lower()
-        if lowered in {"yes", "y"}:
-            return "Yes"
-        if lowered in {"no", "n"}:
-            return "No"
-        return None
-
-    def _validate_postcode(self, text: str) -> Optional[str]:
-        cleaned = re.sub(r"\s+", "", text.upper())
-        if re.match(r"^[A-Z]{1,2}\d[A-Z\d]?\d[A-Z]{2}$", cleaned):
-            return f"{cleaned[:-3]} {cleaned[-3:]}"
-        if re.match(r"^[A-Z]{1,2}\d[A-Z\d]?$", cleaned):
-            return cleaned
-        return None
-
-    def _validate_required_text(self, text: str) -> Optional[str]:
-        return text.strip() or None
-
-    def _validate_optional_text(self, text: str) -> Optional[str]:
-        return text.strip() or None
-
     def _validate_onboarding_answer(
         self, question: Dict[str, Any], raw: str
     ) -> Tuple[Optional[str], Optional[str]]:
         """Validate a single onboarding answer and return (value, error_message)."""
-        key = str(question.get("key", "")).strip()
-        optional = bool(question.get("optional", False))
-        text, was_empty = self._normalize_onboarding_answer(raw)
-
-        if was_empty:
-            return None, "Please enter a response."
-
-        if text == "":
-            if optional:
-                return None, None
-            return None, "This question is required."
-
-        validators = {
-            "name": self._validate_optional_text,
-            "age_range": self._validate_age_range,
-            "stay_length": self._validate_required_text,
-            "postcode": self._validate_postcode,
-            "visa_status": self._validate_required_text,
-            "gp_registered": self._validate_yes_no,
-            "conditions": self._validate_optional_text,
-            "medications": self._validate_optional_text,
-            "lifestyle_focus": self._validate_required_text,
-            "mental_wellbeing": self._validate_optional_text,
-        }
-
-        validator = validators.get(key, self._validate_optional_text)
-        normalized = validator(text)
-        if normalized is None and not optional:
-            if key == "gp_registered":
-                return None, "Please answer with yes or no."
-            if key == "age_range":
-                return None, "Please enter your age or an age range like 18-24 or 25+."
-            if key == "postcode":
-                return (
-                    None,
-                    "Please enter a UK postcode or area (e.g., NW8 or NW8 9HU).",
-                )
-            return None, "Please enter a valid response."
-
-        return normalized, None
-
-    def _derive_postcode_fields(
-        self, postcode_raw: str
-    ) -> Tuple[Optional[str], Optional[str]]:
-        text = (postcode_raw or "").strip().upper()
-        if not text:
-            return None, None
-
-        compact = text.replace(" ", "")
-        full_match = re.match(r"^[A-Z]{1,2}\d[A-Z\d]?\d[A-Z]{2}$", compact)
-        if full_match:
-            full = f"{compact[:-3]} {compact[-3:]}"
-            area = full.split(" ")[0]
-            return full, area
-
-        area = text.split(" ")[0]
-        return None, area
+        return validate_answer(question, raw)
 
     def _build_onboarding_profile(self) -> Dict[str, Any]:
         questions = (
@@ -533,15 +622,7 @@ class AgentSession:
         )
         answers = self.onboarding_state.get("answers") if self.onboarding_state else {}
         profile = {q.get("key"): answers.get(q.get("key")) for q in (questions or [])}
-
-        postcode_full, postcode_area = self._derive_postcode_fields(
-            str(profile.get("postcode") or "")
-        )
-        if postcode_full:
-            profile["postcode_full"] = postcode_full
-        if postcode_area:
-            profile["postcode_area"] = postcode_area
-        return profile
+        return with_postcode_fields(profile)
 
     def _format_profile_review(self, profile: Dict[str, Any]) -> str:
         questions = (
@@ -775,14 +856,16 @@ class AgentSession:
             "Use the profile context to tailor guidance without inventing missing data.\n\n"
             f"Summary:\n{summary}"
         )
-        resp = self.safe_create(
-            model="gpt-4o-mini",
-            store=True,
-            input=[{"role": "system", "content": prompt}],
-            tools=[],
-            tool_choice="none",
-            max_output_tokens=200,
-        )
+        try:
+            resp = self.safe_create(
+                "triage.summary",
+                store=True,
+                input=[{"role": "system", "content": prompt}],
+                tools=[],
+                tool_choice="none",
+            )
+        except BudgetExceeded:
+            return summary
         text = resp.output_text or ""
         if len(text.strip()) < 20:
             return summary
@@ -795,55 +878,39 @@ class AgentSession:
         nearest_services: Optional[Any],
         profile: Optional[Dict[str, Any]] = None,
     ) -> str:
+        self.last_triage_result = triage_result
         summary = self._build_triage_summary(
             triage_result, presenting_issue, nearest_services
         )
         return self._format_triage_smart_response(summary, profile)
 
     def _contains_action(self, text: str) -> bool:
-        lowered = (text or "").lower()
-        return any(keyword in lowered for keyword in ACTION_KEYWORDS)
+        return "action" in scan_keywords(text)
 
     def _select_useful_links(
         self, user_input: str, agent_reply: str
     ) -> List[Dict[str, str]]:
-        lowered = f"{user_input}\n{agent_reply}".lower()
+        # No keyword spans a newline, so checking the (already scanned) input
+        # and the reply separately matches checking the joined text.
+        hits = scan_keywords(user_input)
+        rules = {f"link:{name}": rule["tags"] for name, rule in LINK_TAG_RULES.items()}
+        matched = {category for category in rules if category in hits}
+        matched |= KEYWORDS.present(
+            agent_reply, [category for category in rules if category not in matched]
+        )
         tags = set()
-
-        if "gp" in lowered or "register" in lowered:
-            tags.update(["gp", "register"])
-        if "111" in lowered or "urgent" in lowered or "triage" in lowered:
-            tags.add("111")
-        if "a&e" in lowered or "a and e" in lowered or "emergency" in lowered:
-            tags.update(["111", "services"])
-        if "mental" in lowered or "wellbeing" in lowered:
-            tags.update(["mental", "wellbeing", "lbs"])
-        if "eligib" in lowered or "visa" in lowered:
-            tags.update(["eligibility", "services"])
-        if "nhs" in lowered:
-            tags.add("services")
-
-        if not tags and not self._contains_action(lowered):
+        for category in matched:
+            tags.update(rules[category])
+
+        catalog = LINK_CATALOG.current()
+        selected = catalog.top_k(tags, user_input, agent_reply, k=4)
+        if selected:
+            return selected
+        if not self._contains_action(user_input) and not KEYWORDS.present(
+            agent_reply, ["action"]
+        ):
             return []
-
-        selected = []
-        for link in CANONICAL_LINKS:
-            if tags.intersection(link.get("tags", [])):
-                selected.append({"title": link["title"], "url": link["url"]})
-
-        if not selected:
-            selected = [
-                {
-                    "title": "NHS services guide",
-                    "url": "https://www.nhs.uk/using-the-nhs/nhs-services/",
-                },
-                {
-                    "title": "LBS health and wellbeing",
-                    "url": "https://www.london.edu/masters-experience/student-support",
-                },
-            ]
-
-        return selected[:4]
+        return [dict(link) for link in catalog.fallback[:4]]
 
     def _strip_useful_links(self, agent_reply: str) -> str:
         lines = agent_reply.splitlines()
@@ -861,30 +928,45 @@ class AgentSession:
         return "\n".join(rebuilt).strip()
 
     def _process_final_reply(self, user_input: str, agent_reply: str) -> str:
-        useful_links = self._select_useful_links(user_input, agent_reply)
-        self.last_useful_links = useful_links
+        with span("postprocess"):
+            self.last_useful_links = self._select_useful_links(user_input, agent_reply)
+            clean_reply = self._strip_useful_links(strip_profile_tag(agent_reply))
+            maybe_profile = extract_profile(agent_reply)
+        follow_up = self._record_final_reply(clean_reply, maybe_profile)
+        if follow_up:
+            clean_reply = clean_reply + "\n\n" + follow_up
+        return clean_reply
 
-        clean_reply = self._strip_useful_links(strip_profile_tag(agent_reply))
-        self.conversation_history.append({"role": "assistant", "content": clean_reply})
+    def stream_final_reply(
+        self, user_input: str, sink: Callable[[str], None]
+    ) -> FinalReplyStream:
+        """
+        Streaming counterpart of _process_final_reply. Everything passed to
+        ``sink`` joins up to what ``finish`` returns, which equals
+        _process_final_reply's return value for the same raw reply.
+        """
+        return FinalReplyStream(self, user_input, sink)
 
-        maybe_profile = extract_profile(agent_reply)
-        if maybe_profile:
-            self.set_user_profile(maybe_profile)
+    def _record_final_reply(
+        self, clean_reply: str, maybe_profile: Optional[Dict[str, Any]]
+    ) -> str:
+        """Append the reply to history and apply any profile it carried."""
+        self.conversation_history.append({"role": "assistant", "content": clean_reply})
+        if not maybe_profile:
+            return ""
 
-            # reset modes
-            self.onboarding_active = False
-            self.onboarding_state = None
-            self.triage_active = False
-            self.triage_known_answers = {}
+        self.set_user_profile(maybe_profile)
 
-            follow_up = self._profile_followups()
-            if follow_up:
-                self.conversation_history.append(
-                    {"role": "assistant", "content": follow_up}
-                )
-                clean_reply = clean_reply + "\n\n" + follow_up
+        # reset modes
+        self.onboarding_active = False
+        self.onboarding_state = None
+        self.triage_active = False
+        self.triage_known_answers = {}
 
-        return clean_reply
+        follow_up = self._profile_followups()
+        if follow_up:
+            self.conversation_history.append({"role": "assistant", "content": follow_up})
+        return follow_up
 
     def _profile_followups(self) -> str:
         if not self.user_profile:
@@ -899,10 +981,10 @@ class AgentSession:
         )
 
         try:
-            resp = self.client.responses.create(
-                model="gpt-4o-mini",
+            resp = create_response(
+                self.client,
+                "profile.followups",
                 input=prompt,
-                max_output_tokens=220,
             )
             return resp.output_text or ""
         except Exception:
@@ -941,10 +1023,10 @@ class AgentSession:
             f"Last assistant reply: {last_reply}"
         )
         try:
-            resp = self.client.responses.create(
-                model="gpt-4o-mini",
+            resp = create_response(
+                self.client,
+                "prompt_suggestions",
                 input=prompt,
-                max_output_tokens=120,
             )
             raw = resp.output_text or "[]"
             parsed = json.loads(raw)
@@ -963,25 +1045,75 @@ class AgentSession:
         ]
         return fallback
 
+    def _prefetch_nearby_services(self, user_input: str) -> None:
+        """Start the service lookup the model is about to ask for while it decides."""
+        if not TOOL_PREFETCH or not isinstance(self.user_profile, dict):
+            return
+        postcode_full = self.user_profile.get("postcode_full")
+        text = user_input.lower()
+        if "a&e" in text or "accident and emergency" in text:
+            service_type = "A&E"
+        elif re.search(r"\bgps?\b", text):
+            service_type = "GP"
+        else:
+            return
+        # A postcode in the message will be the one the model looks up instead.
+        if not postcode_full or _POSTCODE_IN_TEXT.search(user_input.upper()):
+            return
+        prefetch_tool(
+            "nearest_nhs_services",
+            {"postcode_full": postcode_full, "service_type": service_type, "n": 3},
+        )
+
     def _is_onboarding_request(self, user_input: str) -> bool:
-        lowered = user_input.lower()
-        return any(phrase in lowered for phrase in ONBOARDING_TRIGGER_PHRASES)
+        return "onboarding" in scan_keywords(user_input)
 
     def _is_search_request(self, user_input: str) -> bool:
-        lowered = user_input.lower()
-        return (
-            "search" in lowered
-            or "find info" in lowered
-            or "find information" in lowered
-        )
+        return "search" in scan_keywords(user_input)
+
+    def _is_eligibility_request(self, user_input: str) -> bool:
+        return "eligibility" in scan_keywords(user_input)
+
+    def _route_taken(self, called_tools: set[str]) -> str:
+        """Label a model-routed turn with the intent route it ended up taking."""
+        if "nhs_111_live_triage" in called_tools:
+            return "triage"
+        if "nearest_nhs_services" in called_tools:
+            return "nearby_services"
+        if "guided_search" in called_tools:
+            return "search"
+        return "qa"
+
+    def _is_opening_question(self) -> bool:
+        """True when the message being answered is the first the user has sent."""
+        history = self.conversation_history
+        if history.total != len(history):
+            return False
+        return sum(1 for message in history if message.get("role") == "user") == 1
+
+    def is_deterministic_turn(self, user_input: str) -> bool:
+        """True for turns normally answered without a model call (onboarding, safety notice)."""
+        return self.onboarding_active or is_deterministic_message(user_input)
 
     def step(self, user_input: str) -> str:
         """
         Process a single user turn and return the assistant reply (profile tags stripped).
         """
+        # Turns inside an active triage queue ahead of Q&A when calls are saturated.
+        with session_usage(self.usage), turn_priority("triage" if self.triage_active else None):
+            return self._step(user_input)
+
+    def _step(self, user_input: str) -> str:
         self.conversation_history.append({"role": "user", "content": user_input})
 
         if safety_check(user_input):
+            annotate(branch="safety")
+            self.last_triage_result = {
+                "status": "final",
+                "severity_level": "emergency",
+                "suggested_service": "A&E",
+                "source": "safety_check",
+            }
             reply = emergency_response()
             self.last_useful_links = []
             self.conversation_history.append({"role": "assistant", "content": reply})
@@ -991,6 +1123,7 @@ class AgentSession:
         # SHORT-CIRCUIT: ONBOARDING TRIGGER
         # -------------------------------
         if self._is_onboarding_request(user_input) and not self.onboarding_active:
+            annotate(branch="onboarding.start")
             self._start_onboarding()
             reply = self._prompt_next_onboarding_question()
             return self._process_final_reply(user_input, reply)
@@ -999,6 +1132,7 @@ class AgentSession:
         # SHORT-CIRCUIT: ACTIVE ONBOARDING
         # -------------------------------
         if self.onboarding_active and self.onboarding_state:
+            annotate(branch="onboarding")
             if self.onboarding_state.get("review_pending", False):
                 reply = self._handle_onboarding_review(user_input)
                 return self._process_final_reply(user_input, reply)
@@ -1015,8 +1149,8 @@ class AgentSession:
         # -------------------------------
         # SHORT-CIRCUIT: ELIGIBILITY QUERY
         # -------------------------------
-        lower_input = user_input.lower()
-        if "eligible" in lower_input or "eligibility" in lower_input:
+        if self._is_eligibility_request(user_input):
+            annotate(branch="eligibility")
             reply = self._eligibility_response()
             return self._process_final_reply(user_input, reply)
 
@@ -1024,6 +1158,7 @@ class AgentSession:
         # SHORT-CIRCUIT: ACTIVE TRIAGE
         # -------------------------------
         if self.triage_active and self.triage_awaiting_answers:
+            annotate(branch=f"triage.round{self.triage_round}")
             self._append_triage_answer(user_input)
             self.triage_awaiting_answers = False
             if self.triage_round == 1:
@@ -1052,15 +1187,53 @@ class AgentSession:
         # -------------------------------
         pinned = []
 
+        # -------------------------------
+        # SEMANTIC ANSWER CACHE (non-personalised opening questions only)
+        # -------------------------------
+        cacheable = ANSWER_CACHE.enabled and not self.user_profile and self._is_opening_question()
+        if cacheable:
+            cached = ANSWER_CACHE.lookup(user_input)
+            if cached is not None:
+                annotate(branch="answer_cache")
+                clean = self._process_final_reply(user_input, cached["reply"])
+                self.prompt_suggestions = list(cached["prompt_suggestions"])
+                return clean
+
+        # -------------------------------
+        # LOCAL INTENT ROUTING (optional)
+        # -------------------------------
+        prediction = INTENT_ROUTER.predict(user_input)
+        local_route = INTENT_ROUTER.confident(prediction)
+        if local_route == "nearby_services":
+            self._prefetch_nearby_services(user_input)
+        if local_route == "triage":
+            annotate(branch="intent.triage")
+            INTENT_ROUTER.record(user_input, prediction, "triage", acted=True)
+            self._reset_triage_state()
+            reply = self._start_triage_flow(user_input)
+            return self._process_final_reply(user_input, reply)
+
         # -------------------------------
         # FIRST MODEL CALL
         # -------------------------------
         toolset = tools
         if not self._is_search_request(user_input):
             toolset = [tool for tool in tools if tool.get("name") != "guided_search"]
+        if local_route is not None:
+            toolset = INTENT_ROUTER.narrow_tools(local_route, toolset)
+
+        # Under streaming_reply(), calls whose text may be the final reply stream it.
+        sink = reply_sink()
+        reply_stream = self.stream_final_reply(user_input, sink) if sink else None
+
+        def streamed() -> Dict[str, Any]:
+            if reply_stream is None:
+                return {}
+            reply_stream.restart()
+            return {"on_text": reply_stream.feed}
 
         resp = self.safe_create(
-            model="gpt-4o-mini",
+            "step.first",
             store=True,
             input=[
                 {"role": "system", "content": self.system_prompt},
@@ -1069,9 +1242,10 @@ class AgentSession:
             ],
             tools=toolset,
             tool_choice="auto",
-            max_output_tokens=self.MAX_OUT,
+            **streamed(),
         )
 
+        annotate(branch="model")
         final_response = resp
         tool_rounds = 0
         bailed_with_unresolved_calls = False
@@ -1079,6 +1253,7 @@ class AgentSession:
         triage_result: Optional[Dict[str, Any]] = None
         nearest_services_result: Optional[Any] = None
         triage_start_args: Optional[Dict[str, Any]] = None
+        called_tools: set[str] = set()
 
         # -------------------------------
         # BATCH TOOL HANDLING LOOP
@@ -1094,38 +1269,27 @@ class AgentSession:
             ]
             if not tool_calls:
                 break
+            called_tools.update(call.name for call in tool_calls)
 
             triage_call = next(
                 (call for call in tool_calls if call.name == "nhs_111_live_triage"),
                 None,
             )
             if triage_call is not None:
-                raw_args = triage_call.arguments
-                if isinstance(raw_args, str):
-                    try:
-                        triage_start_args = json.loads(raw_args)
-                    except Exception:
-                        triage_start_args = {}
-                else:
-                    triage_start_args = raw_args or {}
+                triage_start_args = _tool_arguments(triage_call.arguments)
                 break
 
             outputs = [{"role": "system", "content": self.system_prompt}]
 
-            for call in tool_calls:
+            # Independent calls run concurrently; results are handled in call order.
+            call_args = [_tool_arguments(call.arguments) for call in tool_calls]
+            results = run_tool_calls(
+                [(call.name, args) for call, args in zip(tool_calls, call_args)]
+            )
+
+            for call, args, tool_result in zip(tool_calls, call_args, results):
                 tool_name = call.name
                 call_id = call.call_id
-                raw_args = call.arguments
-
-                if isinstance(raw_args, str):
-                    try:
-                        args = json.loads(raw_args)
-                    except Exception:
-                        args = {}
-                else:
-                    args = raw_args or {}
-
-                tool_result = execute_tool(tool_name, args)
 
                 parsed_tool = self._update_state_from_tool(tool_name, tool_result)
 
@@ -1168,12 +1332,13 @@ class AgentSession:
                     and parsed_tool.get("suggested_service") in {"GP", "A&E"}
                 ):
                     try:
-                        lookup = tool_nearest_nhs_services(
+                        lookup = run_tool(
+                            "nearest_nhs_services",
                             {
                                 "postcode_full": parsed_tool.get("postcode_full", ""),
                                 "service_type": parsed_tool.get("suggested_service"),
                                 "n": 3,
-                            }
+                            },
                         )
                         outputs.append(
                             {
@@ -1189,19 +1354,29 @@ class AgentSession:
                     except Exception:
                         pass
 
+            # A final triage result replaces the model's text with the routing response.
+            triage_final = isinstance(triage_result, dict) and triage_result.get("status") == "final"
             final_response = self.safe_create(
-                model="gpt-4o-mini",
+                "step.tool_round",
                 previous_response_id=final_response.id,
                 input=outputs,
                 tools=toolset,
                 tool_choice="auto",
-                max_output_tokens=self.MAX_OUT,
+                **({} if triage_final else streamed()),
             )
 
         # -------------------------------
         # FINAL TEXT RESPONSE
         # -------------------------------
         agent_reply = final_response.output_text or ""
+        annotate(tool_rounds=tool_rounds - 1, tools=",".join(sorted(called_tools)))
+
+        INTENT_ROUTER.record(
+            user_input,
+            prediction,
+            self._route_taken(called_tools),
+            acted=local_route is not None,
+        )
 
         if triage_start_args is not None:
             presenting_issue = triage_start_args.get("presenting_issue") or user_input
@@ -1221,7 +1396,7 @@ class AgentSession:
         # If unresolved tool calls, force text-only reply
         if bailed_with_unresolved_calls:
             forced = self.safe_create(
-                model="gpt-4o-mini",
+                "step.forced_reply",
                 store=True,
                 input=[
                     {"role": "system", "content": self.system_prompt},
@@ -1239,14 +1414,14 @@ class AgentSession:
                 ],
                 tools=toolset,
                 tool_choice="none",
-                max_output_tokens=200,
+                **streamed(),
             )
             agent_reply = forced.output_text or ""
 
         # Blank-response fix
         elif agent_reply.strip() == "":
             forced = self.safe_create(
-                model="gpt-4o-mini",
+                "step.blank_reply",
                 previous_response_id=final_response.id,
                 input=[
                     {
@@ -1262,12 +1437,26 @@ class AgentSession:
                 ],
                 tools=toolset,
                 tool_choice="none",
-                max_output_tokens=200,
+                **streamed(),
             )
             agent_reply = forced.output_text or ""
 
-        clean = self._process_final_reply(user_input, agent_reply)
+        if reply_stream is not None and reply_stream.raw == agent_reply:
+            clean = reply_stream.finish()
+        else:
+            clean = self._process_final_reply(user_input, agent_reply)
         self.prompt_suggestions = self._generate_prompt_suggestions(clean)
+        if (
+            cacheable
+            and not called_tools
+            and not bailed_with_unresolved_calls
+            and not self.user_profile
+            and clean.strip()
+        ):
+            ANSWER_CACHE.store(
+                user_input,
+                {"reply": clean, "prompt_suggestions": list(self.prompt_suggestions)},
+            )
         return clean
 
 
@@ -0,0 +1,229 @@
+"""Semantic cache for non-personalised Q&A replies.
+
+Queries are embedded locally (signed feature hashing of words and character
+trigrams), L2-normalised and quantised to int8. Lookups probe an inverted
+index over each vector's strongest coordinates and score the candidates
+exactly, so only near-duplicate questions ("what is NHS 111?" / "what's NHS
+111") are served from cache. One changed word barely moves the score of a
+long question, so a hit also needs the same content words, numbers and
+negation ("GP" / "dentist", "call 111" / "call 999", "with alcohol" /
+"without alcohol"). Entries expire
+after a TTL and the least recently used entry is evicted once the cache is
+full.
+
+Only ``AgentSession`` decides what is cacheable: the opening question of a
+session without a profile, never safety, onboarding or triage turns. Later
+turns ("yes", "tell me more") depend on the conversation, which the key does
+not capture.
+"""
+
+import math
+import os
+import re
+import time
+import zlib
+from array import array
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+_WORD_RE = re.compile(r"[a-z0-9&']+")
+_NEGATIONS = frozenset({"no", "not", "never", "without", "none", "nor", "cannot", "cant", "dont"})
+
+
+_STOPWORDS = frozenset(
+    """a about am an and any are as at be been being but by can could did do does doing for from get
+    got had has have how i i'm i've if in into is it it's its me my of on or our should so some that
+    the their them then there these they this to too us was we were what what's when where which who
+    why will with would you your""".split()
+)
+
+
+def _content_word(word: str) -> str:
+    word = word.replace("'", "")
+    return word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+
+
+def guard_terms(text: str) -> frozenset:
+    """
+    Content words, numbers and a "not" marker for any negation; a hit needs
+    the same set. Hashed features barely move the cosine when one word of a
+    long question changes ("GP" / "dentist"), so the score alone cannot
+    tell those questions apart.
+    """
+    words = _WORD_RE.findall((text or "").lower())
+    terms = {
+        _content_word(word)
+        for word in words
+        if word not in _STOPWORDS and word not in _NEGATIONS and not word.endswith("n't")
+    }
+    if any(word in _NEGATIONS or word.endswith("n't") for word in words):
+        terms.add("not")
+    return frozenset(terms)
+
+
+def _hashed_features(text: str) -> Iterable[Tuple[str, float]]:
+    words = _WORD_RE.findall((text or "").lower())
+    for word in words:
+        yield f"w:{word}", 1.0
+    joined = f" {' '.join(words)} "
+    for idx in range(len(joined) - 2):
+        yield f"c:{joined[idx : idx + 3]}", 0.5
+
+
+def embed(text: str, dimensions: int = 256) -> List[float]:
+    """Signed feature-hashing embedding, L2-normalised."""
+    vector = [0.0] * dimensions
+    for feature, weight in _hashed_features(text):
+        digest = zlib.crc32(feature.encode("utf-8"))
+        sign = 1.0 if digest & 1 else -1.0
+        vector[(digest >> 1) % dimensions] += sign * weight
+    norm = math.sqrt(sum(value * value for value in vector))
+    if norm:
+        vector = [value / norm for value in vector]
+    return vector
+
+
+def quantize(vector: List[float]) -> array:
+    return array("b", (max(-127, min(127, round(value * 127))) for value in vector))
+
+
+def _similarity(a: array, b: array) -> float:
+    return sum(x * y for x, y in zip(a, b)) / (127.0 * 127.0)
+
+
+def _probe_keys(vector: array, probes: int) -> List[Tuple[int, bool]]:
+    strongest = sorted(range(len(vector)), key=lambda i: abs(vector[i]), reverse=True)
+    return [(idx, vector[idx] > 0) for idx in strongest[:probes]]
+
+
+class _Entry:
+    __slots__ = ("vector", "keys", "guard", "payload", "expires_at")
+
+    def __init__(self, vector: array, keys, guard: frozenset, payload: Dict[str, Any], expires_at: float):
+        self.vector = vector
+        self.keys = keys
+        self.guard = guard
+        self.payload = payload
+        self.expires_at = expires_at
+
+
+class SemanticAnswerCache:
+    """Thread-safe LRU/TTL cache keyed by query similarity."""
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        threshold: float = 0.92,
+        ttl_seconds: float = 24 * 3600,
+        max_entries: int = 2048,
+        dimensions: int = 256,
+        probes: int = 4,
+    ):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.dimensions = dimensions
+        self.probes = probes
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._index: Dict[Tuple[int, bool], Set[int]] = {}
+        self._next_id = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls) -> "SemanticAnswerCache":
+        return cls(
+            enabled=os.getenv("ANSWER_CACHE_ENABLED", "").strip().lower() in {"1", "true", "yes"},
+            threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92")),
+            ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(24 * 3600))),
+            max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2048")),
+        )
+
+    def _vector(self, query: str) -> array:
+        return quantize(embed(query, self.dimensions))
+
+    def lookup(self, query: str) -> Optional[Dict[str, Any]]:
+        """Return the cached payload for the closest fresh query above threshold."""
+        if not self.enabled:
+            return None
+        vector = self._vector(query)
+        keys = _probe_keys(vector, self.probes)
+        guard = guard_terms(query)
+        now = time.monotonic()
+        with self._lock:
+            candidates: Set[int] = set()
+            for key in keys:
+                candidates.update(self._index.get(key, ()))
+            best_id, best_score = None, self.threshold
+            for entry_id in candidates:
+                entry = self._entries[entry_id]
+                if entry.expires_at <= now:
+                    self._remove(entry_id)
+                    continue
+                if entry.guard != guard:
+                    continue
+                score = _similarity(vector, entry.vector)
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            return dict(self._entries[best_id].payload)
+
+    def store(self, query: str, payload: Dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+        vector = self._vector(query)
+        keys = _probe_keys(vector, self.probes)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = _Entry(
+                vector, keys, guard_terms(query), dict(payload), time.monotonic() + self.ttl_seconds
+            )
+            for key in keys:
+                self._index.setdefault(key, set()).add(entry_id)
+            self.stores += 1
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        for key in entry.keys:
+            bucket = self._index.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._index[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "stores": self.stores,
+                "evictions": self.evictions,
+            }
+
+
+ANSWER_CACHE = SemanticAnswerCache.from_env()
@@ -0,0 +1,169 @@
+"""Benchmark the single-pass keyword matcher against the per-list substring loops.
+
+Run from ``backend/``::
+
+    python -m benchmarks.bench_keywords --messages 20000
+
+On a dev container the exact matcher runs level with the legacy loops (about
+8-12 us/turn each, timings vary run to run). Typo tolerance is not free: when a
+message has no exact red flag, tokenising it and looking up near words adds
+roughly 4-10 us/turn, which the legacy loops never paid because they caught no typos.
+"""
+
+import argparse
+import random
+import time
+from typing import Callable, List, Tuple
+
+from config import (
+    ACTION_KEYWORDS,
+    ELIGIBILITY_KEYWORDS,
+    LINK_TAG_RULES,
+    ONBOARDING_TRIGGER_PHRASES,
+    RED_FLAG_KEYWORDS,
+)
+from keywords import KeywordMatcher, _default_categories
+
+OPENERS = [
+    "hi evi,",
+    "quick question:",
+    "hello, I'm new in London and",
+    "sorry to bother you but",
+    "",
+]
+BODIES = [
+    "how do I register with a GP near my flat?",
+    "what is NHS 111 and when should I use it?",
+    "I have had a sore throat for three days and a mild fever",
+    "can you search for information about dentists for students?",
+    "am I eligible for free NHS care on a student visa?",
+    "I twisted my ankle playing football and it is swollen",
+    "where can I get support for stress and low mood?",
+    "I have chest pian and my left arm feels heavy",
+    "please start onboarding so you know my details",
+    "do I need to book an appointment for a vaccination?",
+    "my friend collapsed and is not responding",
+    "what should I bring when I sign up at a surgery?",
+]
+REPLY = (
+    "To register with a GP, search for practices that cover your postcode and "
+    "contact them to ask if they are accepting new patients. You will usually "
+    "need ID and proof of address. If you need medical help before you are "
+    "registered, use NHS 111 online or call 111 for urgent advice. In an "
+    "emergency go to A&E or call 999. LBS also offers wellbeing support."
+)
+
+
+def build_corpus(count: int, seed: int = 7) -> List[Tuple[str, str]]:
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(count):
+        message = f"{rng.choice(OPENERS)} {rng.choice(BODIES)}".strip()
+        reply = REPLY[: rng.randint(120, len(REPLY))]
+        corpus.append((message, reply))
+    return corpus
+
+
+def legacy_turn(message: str, reply: str) -> None:
+    """Keyword work done per turn before the matcher: one loop per list."""
+    msg = message.lower()
+    any(k in msg for k in RED_FLAG_KEYWORDS)
+    lowered = message.lower()
+    any(phrase in lowered for phrase in ONBOARDING_TRIGGER_PHRASES)
+    lower_input = message.lower()
+    any(k in lower_input for k in ELIGIBILITY_KEYWORDS)
+    lowered = message.lower()
+    "search" in lowered or "find info" in lowered or "find information" in lowered
+
+    lowered = f"{message}\n{reply}".lower()
+    tags = set()
+    if "gp" in lowered or "register" in lowered:
+        tags.update(["gp", "register"])
+    if "111" in lowered or "urgent" in lowered or "triage" in lowered:
+        tags.add("111")
+    if "a&e" in lowered or "a and e" in lowered or "emergency" in lowered:
+        tags.update(["111", "services"])
+    if "mental" in lowered or "wellbeing" in lowered:
+        tags.update(["mental", "wellbeing", "lbs"])
+    if "eligib" in lowered or "visa" in lowered:
+        tags.update(["eligibility", "services"])
+    if "nhs" in lowered:
+        tags.add("services")
+    if not tags:
+        any(keyword in lowered for keyword in ACTION_KEYWORDS)
+
+
+def matcher_turn(matcher: KeywordMatcher) -> Callable[[str, str], None]:
+    """Keyword work done per turn by ``AgentSession`` with the shared matcher."""
+    rules = {f"link:{name}": rule["tags"] for name, rule in LINK_TAG_RULES.items()}
+
+    def run(message: str, reply: str) -> None:
+        hits = matcher.scan(message)
+        "red_flag" in hits
+        "onboarding" in hits
+        "eligibility" in hits
+        "search" in hits
+
+        hits = matcher.scan(message)
+        matched = {category for category in rules if category in hits}
+        matched |= matcher.present(
+            reply, [category for category in rules if category not in matched]
+        )
+        tags = set()
+        for category in matched:
+            tags.update(rules[category])
+        if not tags and "action" not in hits:
+            matcher.present(reply, ["action"])
+
+    return run
+
+
+def _time(fn: Callable[[str, str], None], corpus, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for message, reply in corpus:
+            fn(message, reply)
+        best = min(best, time.perf_counter() - start)
+    return best / len(corpus) * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.messages)
+    inputs_only = [(message, "") for message, _ in corpus]
+    categories = _default_categories()
+    exact = KeywordMatcher(categories)
+    fuzzy = KeywordMatcher(categories, fuzzy_categories=["red_flag"])
+
+    rows = [
+        ("legacy loops, input only", _time(legacy_turn, inputs_only, args.repeat)),
+        ("matcher, input only", _time(matcher_turn(exact), inputs_only, args.repeat)),
+        ("matcher + typo tolerance, input only", _time(matcher_turn(fuzzy), inputs_only, args.repeat)),
+        ("legacy loops, input + reply", _time(legacy_turn, corpus, args.repeat)),
+        ("matcher, input + reply", _time(matcher_turn(exact), corpus, args.repeat)),
+        ("matcher + typo tolerance, input + reply", _time(matcher_turn(fuzzy), corpus, args.repeat)),
+    ]
+    print(f"{len(corpus)} synthetic turns, best of {args.repeat} runs")
+    for label, micros in rows:
+        print(f"{label:<42} {micros:8.2f} us/turn")
+
+    missed = sum(
+        1
+        for message, _ in corpus
+        if "pian" in message and "red_flag" not in exact.scan(message)
+    )
+    caught = sum(
+        1
+        for message, _ in corpus
+        if "pian" in message and "red_flag" in fuzzy.scan(message)
+    )
+    print(f"typo'd red flags: exact matcher missed {missed}, typo tolerance caught {caught}")
+
+
+if __name__ == "__main__":
+    main()
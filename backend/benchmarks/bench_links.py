@@ -0,0 +1,83 @@
+"""Benchmark link catalog top-k against a linear tag scan at catalog sizes.
+
+Run from ``backend/``::
+
+    python -m benchmarks.bench_links --links 500 --queries 5000
+"""
+
+import argparse
+import json
+import random
+import time
+from typing import Any, Dict, List
+
+from benchmarks.bench_keywords import BODIES, REPLY
+from benchmarks.simulated import percentile
+from links import DEFAULT_LINKS_PATH, LinkCatalog
+
+TAG_SETS = [["gp", "register"], ["111"], ["mental", "wellbeing", "lbs"], ["eligibility", "services"], []]
+
+
+def synthetic_catalog(size: int, seed: int = 7) -> Dict[str, Any]:
+    """The shipped catalog padded with generated links that reuse its terms."""
+    with open(DEFAULT_LINKS_PATH, "r", encoding="utf-8") as handle:
+        data = json.load(handle)
+    base = data["links"]
+    rng = random.Random(seed)
+    tags = sorted({tag for link in base for tag in link.get("tags", [])})
+    keywords = sorted({kw for link in base for kw in link.get("keywords", [])})
+    links = list(base)
+    while len(links) < size:
+        n = len(links)
+        links.append(
+            {
+                "title": f"Resource {n}",
+                "url": f"https://www.example.nhs.uk/resources/{n}",
+                "tags": rng.sample(tags, 2),
+                "keywords": rng.sample(keywords, 3) + [f"topic {n}"],
+            }
+        )
+    return {**data, "links": links}
+
+
+def linear_scan(links: List[Dict[str, Any]], tags: List[str]) -> List[Dict[str, str]]:
+    selected = []
+    for link in links:
+        if set(tags).intersection(link.get("tags", [])):
+            selected.append({"title": link["title"], "url": link["url"]})
+    return selected[:4]
+
+
+def time_calls(fn, queries) -> List[float]:
+    timings = []
+    for args in queries:
+        start = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--links", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=5000)
+    args = parser.parse_args()
+
+    data = synthetic_catalog(args.links)
+    start = time.perf_counter()
+    catalog = LinkCatalog(data)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    rng = random.Random(11)
+    queries = [(rng.choice(TAG_SETS), rng.choice(BODIES), REPLY) for _ in range(args.queries)]
+    indexed = time_calls(lambda tags, user, reply: catalog.top_k(tags, user, reply), queries)
+    linear = time_calls(lambda tags, _user, _reply: linear_scan(data["links"], tags), queries)
+
+    print(f"{len(catalog.links)} links, index built in {build_ms:.1f} ms")
+    print(f"{'method':<16}{'p50 us':>10}{'p99 us':>10}")
+    for name, timings in (("top_k (scored)", indexed), ("linear tag scan", linear)):
+        print(f"{name:<16}{percentile(timings, 50) * 1e6:>10.1f}{percentile(timings, 99) * 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Measure the per-session memory cost of AgentSession with tracemalloc.
+
+Run from ``backend/``::
+
+    python -m benchmarks.bench_memory --sessions 5000
+"""
+
+import argparse
+import gc
+import tracemalloc
+from types import SimpleNamespace
+from typing import Callable, List
+
+from agent import AgentSession
+
+PROFILE = {
+    "name": None,
+    "age_range": "25-34",
+    "stay_length": "1 year",
+    "postcode": "NW1 4SA",
+    "visa_status": "student",
+    "gp_registered": "No",
+    "conditions": None,
+    "medications": None,
+    "lifestyle_focus": "sleep",
+    "mental_wellbeing": None,
+}
+
+
+class _IdleResponses:
+    def create(self, **_kwargs):
+        return SimpleNamespace(output_text="[]", output=[], id="idle")
+
+
+class IdleClient:
+    """Stand-in client; the benchmark never reaches a model call."""
+
+    def __init__(self):
+        self.responses = _IdleResponses()
+
+
+def empty_session(client) -> AgentSession:
+    return AgentSession(client_override=client)
+
+
+def onboarded_session(client) -> AgentSession:
+    session = AgentSession(client_override=client)
+    session.set_user_profile(dict(PROFILE))
+    return session
+
+
+def mid_triage_session(client) -> AgentSession:
+    session = AgentSession(client_override=client)
+    session.conversation_history.append({"role": "user", "content": "my ankle hurts"})
+    session._reset_triage_state()
+    session.triage_active = True
+    session.triage_presenting_issue = "my ankle hurts after football"
+    session.triage_round = 1
+    session.triage_awaiting_answers = True
+    for question in (
+        "How severe is it on a 0 to 10 scale?",
+        "When did this start, and is it getting better or worse?",
+        "Can you function normally (walk/eat/breathe) right now?",
+    ):
+        session._record_triage_question(question)
+    session._append_triage_answer("about 6, since yesterday, can walk a little")
+    return session
+
+
+def measure(factory: Callable[[object], AgentSession], count: int) -> float:
+    client = IdleClient()
+    factory(client)  # warm caches (shared prompts, imports) outside the measurement
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    sessions: List[AgentSession] = [factory(client) for _ in range(count)]
+    gc.collect()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    per_session = (after - before) / count
+    del sessions
+    return per_session
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=5000)
+    parser.add_argument("--target", type=int, default=50000, help="idle sessions per worker")
+    args = parser.parse_args()
+
+    print(f"{args.sessions} sessions per scenario")
+    for label, factory in (
+        ("empty", empty_session),
+        ("onboarded", onboarded_session),
+        ("mid-triage", mid_triage_session),
+    ):
+        per_session = measure(factory, args.sessions)
+        total_mb = per_session * args.target / (1024 * 1024)
+        print(
+            f"{label:<11} {per_session:10.0f} bytes/session"
+            f"  ({args.target} sessions ~ {total_mb:8.1f} MiB)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Benchmark AgentSession.step over scripted conversations with simulated model latency.
+
+Every model and tool call goes to ``benchmarks.simulated.SimulatedClient``,
+which sleeps for a log-normal latency per model (scaled by ``--time-scale``)
+and reports usage. Each flow is replayed ``--repeat`` times and the report
+gives turns/sec, p50/p95/p99 turn latency and model calls per flow.
+
+Run from ``backend/``::
+
+    python -m benchmarks.bench_step --time-scale 0.01 --output step.json
+    python -m benchmarks.bench_step --baseline benchmarks/bench_step_baseline.json
+
+With ``--baseline`` the run fails (exit 1) when a flow makes a different set
+of model calls than the baseline, or when its p95 grows by more than
+``--tolerance``.
+"""
+
+import argparse
+import json
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+import agent
+import tools
+from agent import AgentSession
+from answer_cache import SemanticAnswerCache
+from benchmarks.simulated import (
+    FLOWS,
+    SimulatedClient,
+    model_call_counts,
+    percentile,
+    simulated_seconds,
+)
+from intent import IntentRouter
+from tool_registry import TOOL_REGISTRY
+
+
+@contextmanager
+def simulated_backend(client: SimulatedClient) -> Iterator[None]:
+    """Point tools at the simulated client and pin optional features off."""
+    saved = (tools.client, agent.ANSWER_CACHE, agent.INTENT_ROUTER, TOOL_REGISTRY.cache_enabled)
+    tools.client = client
+    agent.ANSWER_CACHE = SemanticAnswerCache(enabled=False)
+    agent.INTENT_ROUTER = IntentRouter(mode="off")
+    TOOL_REGISTRY.cache_enabled = False
+    try:
+        yield
+    finally:
+        tools.client, agent.ANSWER_CACHE, agent.INTENT_ROUTER, TOOL_REGISTRY.cache_enabled = saved
+
+
+def run_flow(turns: List[str], repeat: int, client: SimulatedClient) -> Dict[str, Any]:
+    latencies: List[float] = []
+    client.reset_calls()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        session = AgentSession(client_override=client)
+        for message in turns:
+            turn_start = time.perf_counter()
+            session.step(message)
+            latencies.append(time.perf_counter() - turn_start)
+    elapsed = time.perf_counter() - started
+    calls = client.reset_calls()
+    return {
+        "turns": len(latencies),
+        "turns_per_sec": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "model_calls_per_flow": len(calls) / repeat,
+        "model_calls_by_model": {
+            model: calls_count / repeat
+            for model, calls_count in model_call_counts(calls).items()
+        },
+        "simulated_seconds_per_flow": round(simulated_seconds(calls) / repeat, 2),
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    problems = []
+    for name, expected in baseline.get("flows", {}).items():
+        actual = results["flows"].get(name)
+        if actual is None:
+            problems.append(f"{name}: flow missing from this run")
+            continue
+        if actual["model_calls_by_model"] != expected["model_calls_by_model"]:
+            problems.append(
+                f"{name}: model calls changed {expected['model_calls_by_model']} -> "
+                f"{actual['model_calls_by_model']}"
+            )
+        same_scale = results["time_scale"] == baseline.get("time_scale")
+        if same_scale and actual["p95_ms"] > expected["p95_ms"] * (1 + tolerance):
+            problems.append(f"{name}: p95 {expected['p95_ms']} ms -> {actual['p95_ms']} ms")
+    return problems
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--time-scale", type=float, default=0.01, help="fraction of simulated latency to sleep")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--flows", nargs="*", default=list(FLOWS))
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--baseline", help="compare against a previous results JSON")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p95 growth")
+    args = parser.parse_args()
+
+    client = SimulatedClient(time_scale=args.time_scale, seed=args.seed)
+    results: Dict[str, Any] = {
+        "time_scale": args.time_scale,
+        "repeat": args.repeat,
+        "seed": args.seed,
+        "flows": {},
+    }
+    with simulated_backend(client):
+        for name in args.flows:
+            results["flows"][name] = run_flow(FLOWS[name], args.repeat, client)
+
+    print(f"{'flow':<12}{'turns/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'calls':>8}")
+    for name, row in results["flows"].items():
+        print(
+            f"{name:<12}{row['turns_per_sec']:>10}{row['p50_ms']:>10}{row['p95_ms']:>10}"
+            f"{row['p99_ms']:>10}{row['model_calls_per_flow']:>8g}"
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, indent=2, sort_keys=True)
+            handle.write("\n")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as handle:
+            problems = compare(results, json.load(handle), args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""Evaluate triage routing accuracy, model calls and turn latency offline.
+
+The dataset is JSONL, one scripted conversation per line::
+
+    {"id": "sore-throat-mild", "turns": ["I've had a sore throat ...", "..."], "expected_service": "PHARMACY_SELFCARE"}
+
+An optional ``profile`` object is set on the session before the first turn.
+Each conversation runs through a fresh ``AgentSession``. The routed service
+is the ``suggested_service`` of the session's last triage result, and
+red-flag replies count as ``A&E``. Model calls are taken from the session's
+usage, so tool calls are included.
+
+Three backends are available:
+
+- Default: ``benchmarks.simulated.SimulatedClient`` in process, with
+  latency scaled by ``--time-scale``.
+- ``--cassette``: replay a recorded cassette; misses count as errors.
+- ``--base-url``: a local mock server (``python -m benchmarks.mock_openai``).
+
+Conversations are split into chunks. Each chunk runs on a process pool of
+``--workers`` processes, with ``--threads`` conversations at a time per
+process, so I/O-bound backends overlap their waits. Run from ``backend/``::
+
+    python -m benchmarks.eval_triage benchmarks/triage_eval.jsonl --repeat 200 --workers 4
+    python -m benchmarks.eval_triage data.jsonl --base-url http://127.0.0.1:8010/v1 --threads 32 --min-accuracy 0.95
+
+With ``--min-accuracy`` the run fails (exit 1) when routing accuracy drops
+below it, so a latency change can be gated on routing quality. Conversations
+routed to a lower-acuity service than expected are also listed as
+under-triaged; that count should stay at zero. The local pathway graphs follow
+``TRIAGE_PATHWAYS_MODE`` as in the app (set it to ``on`` to evaluate them).
+"""
+
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional
+
+import tools
+from agent import AgentSession
+from benchmarks.simulated import SimulatedClient, percentile
+from cassettes import Cassette
+
+DEFAULT_DATASET = "benchmarks/triage_eval.jsonl"
+REPORTED_MISMATCHES = 20
+# Higher is more urgent; routing below the expected level is under-triage.
+SERVICE_ACUITY = {"PHARMACY_SELFCARE": 0, "GP": 1, "NHS_111": 2, "A&E": 3, "MENTAL_HEALTH_CRISIS": 3}
+
+Conversation = Dict[str, Any]
+Result = Dict[str, Any]
+
+_client: Any = None
+
+
+def load_dataset(path: str) -> List[Conversation]:
+    conversations = []
+    with open(path, "r", encoding="utf-8") as handle:
+        for number, line in enumerate(handle, start=1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if not item.get("turns"):
+                raise ValueError(f"{path}:{number}: conversation has no turns.")
+            item.setdefault("id", f"line-{number}")
+            conversations.append(item)
+    return conversations
+
+
+def make_client(backend: Dict[str, Any]) -> Any:
+    if backend.get("cassette"):
+        cassette = Cassette(mode="replay", path=backend["cassette"], latency_scale=backend["time_scale"])
+        return cassette.wrap(None)
+    if backend.get("base_url"):
+        from openai import OpenAI
+
+        return OpenAI(api_key="mock", base_url=backend["base_url"], max_retries=5)
+    return SimulatedClient(time_scale=backend["time_scale"], seed=backend["seed"])
+
+
+def init_worker(backend: Dict[str, Any]) -> None:
+    """Build this process's client and point the tools at it."""
+    global _client
+    _client = make_client(backend)
+    tools.client = _client
+
+
+def run_conversation(conversation: Conversation) -> Result:
+    session = AgentSession(client_override=_client)
+    if conversation.get("profile"):
+        session.set_user_profile(conversation["profile"])
+    latencies: List[float] = []
+    error = None
+    for message in conversation["turns"]:
+        started = time.perf_counter()
+        try:
+            session.step(message)
+        except Exception as exc:
+            error = f"{type(exc).__name__}: {exc}"
+            break
+        finally:
+            latencies.append(time.perf_counter() - started)
+    routed = session.last_triage_result or {}
+    return {
+        "id": conversation["id"],
+        "expected": conversation.get("expected_service"),
+        "actual": routed.get("suggested_service"),
+        "calls": session.usage.calls,
+        "latencies": latencies,
+        "error": error,
+    }
+
+
+def run_chunk(chunk: List[Conversation], threads: int) -> List[Result]:
+    if threads <= 1:
+        return [run_conversation(conversation) for conversation in chunk]
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return list(pool.map(run_conversation, chunk))
+
+
+def _chunks(items: List[Conversation], size: int) -> Iterator[List[Conversation]]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def evaluate(
+    conversations: List[Conversation],
+    backend: Dict[str, Any],
+    workers: int = 1,
+    threads: int = 1,
+    chunk_size: int = 50,
+) -> List[Result]:
+    """Run every conversation; in process when ``workers <= 1``."""
+    if workers <= 1:
+        init_worker(backend)
+        results: List[Result] = []
+        for chunk in _chunks(conversations, chunk_size):
+            results.extend(run_chunk(chunk, threads))
+        return results
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=context, initializer=init_worker, initargs=(backend,)
+    ) as pool:
+        pending: Deque[Future] = deque()
+        for chunk in _chunks(conversations, chunk_size):
+            pending.append(pool.submit(run_chunk, chunk, threads))
+            if len(pending) >= workers * 2:
+                results.extend(pending.popleft().result())
+        while pending:
+            results.extend(pending.popleft().result())
+    return results
+
+
+def summarize(results: Iterable[Result], seconds: float) -> Dict[str, Any]:
+    results = list(results)
+    scored = [row for row in results if row["expected"] and not row["error"]]
+    correct = sum(1 for row in scored if row["actual"] == row["expected"])
+    confusion: Dict[str, Dict[str, int]] = {}
+    for row in scored:
+        actual = row["actual"] or "none"
+        by_actual = confusion.setdefault(row["expected"], {})
+        by_actual[actual] = by_actual.get(actual, 0) + 1
+    calls = [row["calls"] for row in results]
+    latencies = [latency for row in results for latency in row["latencies"]]
+    mismatches = [
+        {key: row[key] for key in ("id", "expected", "actual")}
+        for row in scored
+        if row["actual"] != row["expected"]
+    ]
+    under_triaged = [
+        row for row in mismatches
+        if SERVICE_ACUITY.get(row["actual"] or "", -1) < SERVICE_ACUITY.get(row["expected"], -1)
+    ]
+    errors = [{"id": row["id"], "error": row["error"]} for row in results if row["error"]]
+    return {
+        "conversations": len(results),
+        "turns": len(latencies),
+        "seconds": round(seconds, 2),
+        "conversations_per_sec": round(len(results) / seconds, 1) if seconds else None,
+        "routing": {
+            "scored": len(scored),
+            "correct": correct,
+            "accuracy": round(correct / len(scored), 4) if scored else None,
+            "confusion": {expected: dict(sorted(row.items())) for expected, row in sorted(confusion.items())},
+            "mismatches": mismatches[:REPORTED_MISMATCHES],
+            "under_triaged": len(under_triaged),
+            "under_triaged_samples": under_triaged[:REPORTED_MISMATCHES],
+        },
+        "model_calls": {
+            "mean": round(sum(calls) / len(calls), 2) if calls else 0.0,
+            "p50": percentile(calls, 50),
+            "p95": percentile(calls, 95),
+            "max": max(calls, default=0),
+        },
+        "turn_latency_ms": {
+            f"p{pct}": round(percentile(latencies, pct) * 1000, 2) for pct in (50, 95, 99)
+        },
+        "errors": len(errors),
+        "error_samples": errors[:REPORTED_MISMATCHES],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("dataset", nargs="?", default=DEFAULT_DATASET, help="JSONL of scripted conversations")
+    parser.add_argument("--repeat", type=int, default=1, help="run the dataset this many times")
+    parser.add_argument("--workers", type=int, default=1, help="processes")
+    parser.add_argument("--threads", type=int, default=4, help="concurrent conversations per process")
+    parser.add_argument("--chunk-size", type=int, default=50)
+    parser.add_argument("--cassette", help="replay this cassette instead of simulating")
+    parser.add_argument("--base-url", help="call a mock OpenAI server at this base URL")
+    parser.add_argument("--time-scale", type=float, default=0.0, help="simulated / replayed latency scale")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="write the report JSON here")
+    parser.add_argument("--min-accuracy", type=float, help="exit 1 below this routing accuracy")
+    args = parser.parse_args()
+
+    conversations = load_dataset(args.dataset) * args.repeat
+    backend = {
+        "cassette": args.cassette,
+        "base_url": args.base_url,
+        "time_scale": args.time_scale,
+        "seed": args.seed,
+    }
+    started = time.perf_counter()
+    results = evaluate(conversations, backend, args.workers, args.threads, args.chunk_size)
+    report = summarize(results, time.perf_counter() - started)
+
+    routing = report["routing"]
+    print(
+        f"{report['conversations']} conversations, {report['turns']} turns in {report['seconds']} s "
+        f"({report['conversations_per_sec']} conversations/sec)"
+    )
+    print(
+        f"routing accuracy {routing['accuracy']} ({routing['correct']}/{routing['scored']}), "
+        f"under-triaged {routing['under_triaged']}, errors {report['errors']}"
+    )
+    print(
+        "model calls per conversation mean {mean} p50 {p50} p95 {p95} max {max}".format(**report["model_calls"])
+    )
+    print("turn latency ms p50 {p50} p95 {p95} p99 {p99}".format(**report["turn_latency_ms"]))
+    for row in routing["mismatches"]:
+        print(f"  MISMATCH {row['id']}: expected {row['expected']}, got {row['actual']}")
+    for row in report["error_samples"]:
+        print(f"  ERROR {row['id']}: {row['error']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, indent=2, sort_keys=True)
+            handle.write("\n")
+
+    accuracy: Optional[float] = routing["accuracy"]
+    if args.min_accuracy is not None and (accuracy is None or accuracy < args.min_accuracy):
+        print(f"REGRESSION routing accuracy {accuracy} < {args.min_accuracy}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
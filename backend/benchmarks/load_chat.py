@@ -0,0 +1,146 @@
+"""HTTP load generator for ``POST /api/chat``.
+
+Each synthetic student picks a scripted conversation (onboarding, triage,
+Q&A with tools or search, weighted by ``--mix``), keeps its ``session_id``
+across turns and pauses ``--think`` seconds between turns. ``--concurrency``
+students run at once until ``--students`` have finished. The report gives
+throughput, the tail-latency curve per flow and overall, and failures by
+status.
+
+Run from ``backend/`` against the mock Responses API::
+
+    python -m benchmarks.mock_openai --port 8010 &
+    OPENAI_API_KEY=mock OPENAI_BASE_URL=http://127.0.0.1:8010/v1 uvicorn main:app --port 8000 &
+    python -m benchmarks.load_chat --url http://127.0.0.1:8000 --students 200 --concurrency 50
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from benchmarks.simulated import FLOWS, percentile
+
+DEFAULT_MIX = "onboarding=2,triage=3,qa_tools=4,search=1"
+CURVE = (50, 75, 90, 95, 99, 99.9)
+
+
+def parse_mix(spec: str) -> List[Tuple[str, float]]:
+    mix = []
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in FLOWS:
+            raise SystemExit(f"Unknown flow '{name}'. Choose from: {', '.join(FLOWS)}")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+def post_chat(url: str, message: str, session_id: Optional[str], timeout: float) -> Tuple[int, Dict[str, Any]]:
+    payload = json.dumps({"message": message, "session_id": session_id}).encode("utf-8")
+    request = urllib.request.Request(
+        f"{url.rstrip('/')}/api/chat",
+        data=payload,
+        headers={"content-type": "application/json"},
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, json.loads(response.read() or b"{}")
+    except urllib.error.HTTPError as exc:
+        return exc.code, {}
+    except (urllib.error.URLError, TimeoutError, ConnectionError):
+        return 0, {}
+
+
+class LoadRun:
+    def __init__(self, url: str, mix: List[Tuple[str, float]], think: float, timeout: float, seed: int):
+        self.url = url
+        self.mix = mix
+        self.think = think
+        self.timeout = timeout
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {name: [] for name in FLOWS}
+        self.statuses: Counter = Counter()
+
+    def _pick(self) -> str:
+        names, weights = zip(*self.mix)
+        with self._lock:
+            return self._rng.choices(names, weights)[0]
+
+    def student(self, _index: int) -> None:
+        flow = self._pick()
+        session_id = None
+        for turn, message in enumerate(FLOWS[flow]):
+            if turn and self.think > 0:
+                time.sleep(self.think)
+            started = time.perf_counter()
+            status, body = post_chat(self.url, message, session_id, self.timeout)
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.statuses[status] += 1
+                if status == 200:
+                    self.latencies[flow].append(elapsed)
+            if status != 200:
+                return
+            session_id = body.get("session_id", session_id)
+
+
+def curve(values: List[float]) -> Dict[str, float]:
+    row = {f"p{pct:g}_ms": round(percentile(values, pct) * 1000, 1) for pct in CURVE}
+    row["max_ms"] = round(max(values) * 1000, 1) if values else 0.0
+    return row
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--students", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="flow=weight pairs")
+    parser.add_argument("--think", type=float, default=0.0, help="seconds between a student's turns")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="write results JSON here")
+    args = parser.parse_args()
+
+    run = LoadRun(args.url, parse_mix(args.mix), args.think, args.timeout, args.seed)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(run.student, range(args.students)))
+    elapsed = time.perf_counter() - started
+
+    everything = [value for values in run.latencies.values() for value in values]
+    results = {
+        "students": args.students,
+        "concurrency": args.concurrency,
+        "elapsed_s": round(elapsed, 2),
+        "turns_ok": len(everything),
+        "turns_per_sec": round(len(everything) / elapsed, 2) if elapsed else None,
+        "statuses": {str(status): count for status, count in sorted(run.statuses.items())},
+        "overall": curve(everything),
+        "flows": {name: curve(values) for name, values in run.latencies.items() if values},
+    }
+
+    print(f"{results['turns_ok']} turns in {results['elapsed_s']} s ({results['turns_per_sec']} turns/s)")
+    print(f"statuses: {results['statuses']}")
+    header = "".join(f"{key:>10}" for key in results["overall"])
+    print(f"{'flow':<12}{header}")
+    for name, row in [("overall", results["overall"]), *results["flows"].items()]:
+        print(f"{name:<12}" + "".join(f"{value:>10}" for value in row.values()))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, indent=2)
+            handle.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""Local HTTP server imitating the parts of the OpenAI Responses API the agent uses.
+
+Point the backend at it through the OpenAI SDK's base URL setting::
+
+    python -m benchmarks.mock_openai --port 8010 --time-scale 1.0 --rpm 600
+    OPENAI_API_KEY=mock OPENAI_BASE_URL=http://127.0.0.1:8010/v1 uvicorn main:app
+
+``POST /v1/responses`` answers with the scripted replies from
+``benchmarks.simulated.respond``, returned as ``message`` (``output_text``)
+and ``function_call`` output items with a ``usage`` block. Responses are kept
+so ``previous_response_id`` must name an earlier response, as with the real
+API. Latency follows the per-model log-normal distribution, scaled by
+``--time-scale``. Errors are injected at ``--error-rate`` (HTTP 500), and
+``--rpm`` / ``--tpm`` limits return 429 with ``retry-after`` and
+``x-ratelimit-*`` headers once a minute's budget is spent. Requests with
+``"stream": true`` get the same response as server-sent events: one
+``response.output_text.delta`` per word, then ``response.completed``.
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from benchmarks.simulated import estimate_tokens, respond, sample_latency, uses_web_search
+
+STORED_RESPONSES = 10000
+
+
+class RateWindow:
+    """Fixed one-minute windows for requests and tokens, like the API's limits."""
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._lock = threading.Lock()
+        self._window = 0
+        self._requests = 0
+        self._tokens = 0
+
+    def admit(self, tokens: int) -> Tuple[bool, Dict[str, str]]:
+        now = time.time()
+        with self._lock:
+            window = int(now // 60)
+            if window != self._window:
+                self._window, self._requests, self._tokens = window, 0, 0
+            reset = max(0.0, (window + 1) * 60 - now)
+            over_requests = self.rpm and self._requests >= self.rpm
+            over_tokens = self.tpm and self._tokens + tokens > self.tpm
+            if not (over_requests or over_tokens):
+                self._requests += 1
+                self._tokens += tokens
+            headers = {
+                "x-ratelimit-limit-requests": str(self.rpm or 0),
+                "x-ratelimit-remaining-requests": str(max(0, self.rpm - self._requests) if self.rpm else 0),
+                "x-ratelimit-reset-requests": f"{reset:.3f}s",
+                "x-ratelimit-limit-tokens": str(self.tpm or 0),
+                "x-ratelimit-remaining-tokens": str(max(0, self.tpm - self._tokens) if self.tpm else 0),
+                "x-ratelimit-reset-tokens": f"{reset:.3f}s",
+            }
+            if over_requests or over_tokens:
+                headers["retry-after"] = str(max(1, round(reset)))
+                return False, headers
+            return True, headers
+
+
+class MockResponsesAPI:
+    def __init__(
+        self,
+        time_scale: float = 1.0,
+        error_rate: float = 0.0,
+        rpm: int = 0,
+        tpm: int = 0,
+        seed: int = 7,
+    ):
+        self.time_scale = time_scale
+        self.error_rate = error_rate
+        self.limits = RateWindow(rpm, tpm)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._responses: "OrderedDict[str, bool]" = OrderedDict()
+        self.counters = {"requests": 0, "ok": 0, "rate_limited": 0, "errors": 0}
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self.counters[key] += 1
+
+    def handle(self, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any], Dict[str, str]]:
+        self._count("requests")
+        previous = body.get("previous_response_id")
+        if previous and previous not in self._responses:
+            self._count("errors")
+            message = f"Previous response with id '{previous}' not found."
+            return 400, _error(message, "invalid_request_error", "previous_response_not_found"), {}
+
+        prompt_tokens = estimate_tokens(json.dumps(body.get("input", "")))
+        admitted, headers = self.limits.admit(prompt_tokens + int(body.get("max_output_tokens") or 0))
+        if not admitted:
+            self._count("rate_limited")
+            return 429, _error("Rate limit reached for requests.", "requests", "rate_limit_exceeded"), headers
+
+        model = body.get("model", "gpt-4o-mini")
+        with self._lock:
+            latency = sample_latency(self._rng, model, uses_web_search(body))
+            failed = self._rng.random() < self.error_rate
+        if self.time_scale > 0:
+            time.sleep(latency * self.time_scale)
+        if failed:
+            self._count("errors")
+            message = "The server had an error while processing your request."
+            return 500, _error(message, "server_error", None), headers
+
+        reply = respond(body)
+        response_id = f"resp_{uuid.uuid4().hex}"
+        with self._lock:
+            self._responses[response_id] = True
+            while len(self._responses) > STORED_RESPONSES:
+                self._responses.popitem(last=False)
+        self._count("ok")
+        return 200, _response_body(response_id, model, body, reply, prompt_tokens), headers
+
+
+def _error(message: str, kind: str, code: Optional[str]) -> Dict[str, Any]:
+    return {"error": {"message": message, "type": kind, "param": None, "code": code}}
+
+
+def _response_body(
+    response_id: str, model: str, body: Dict[str, Any], reply: Dict[str, Any], prompt_tokens: int
+) -> Dict[str, Any]:
+    output: List[Dict[str, Any]] = []
+    for idx, (name, arguments) in enumerate(reply["calls"]):
+        output.append(
+            {
+                "type": "function_call",
+                "id": f"fc_{response_id}_{idx}",
+                "call_id": f"call_{response_id}_{idx}",
+                "name": name,
+                "arguments": json.dumps(arguments),
+                "status": "completed",
+            }
+        )
+    if reply["text"]:
+        output.append(
+            {
+                "type": "message",
+                "id": f"msg_{response_id}",
+                "role": "assistant",
+                "status": "completed",
+                "content": [{"type": "output_text", "text": reply["text"], "annotations": []}],
+            }
+        )
+    output_tokens = estimate_tokens(reply["text"]) + 20 * len(reply["calls"])
+    return {
+        "id": response_id,
+        "object": "response",
+        "created_at": int(time.time()),
+        "status": "completed",
+        "model": model,
+        "output": output,
+        "previous_response_id": body.get("previous_response_id"),
+        "parallel_tool_calls": True,
+        "tool_choice": body.get("tool_choice", "auto"),
+        "tools": body.get("tools") or [],
+        "max_output_tokens": body.get("max_output_tokens"),
+        "store": body.get("store", True),
+        "usage": {
+            "input_tokens": prompt_tokens,
+            "input_tokens_details": {"cached_tokens": 0},
+            "output_tokens": output_tokens,
+            "output_tokens_details": {"reasoning_tokens": 0},
+            "total_tokens": prompt_tokens + output_tokens,
+        },
+    }
+
+
+def _stream_events(response: Dict[str, Any]) -> List[Dict[str, Any]]:
+    events: List[Dict[str, Any]] = [
+        {"type": "response.created", "response": {**response, "status": "in_progress", "output": []}}
+    ]
+    for index, item in enumerate(response["output"]):
+        if item["type"] != "message":
+            continue
+        for chunk in re.findall(r"\s*\S+", item["content"][0]["text"]):
+            events.append(
+                {
+                    "type": "response.output_text.delta",
+                    "item_id": item["id"],
+                    "output_index": index,
+                    "content_index": 0,
+                    "delta": chunk,
+                    "logprobs": [],
+                }
+            )
+    events.append({"type": "response.completed", "response": response})
+    for number, event in enumerate(events):
+        event["sequence_number"] = number
+    return events
+
+
+def make_handler(api: MockResponsesAPI):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status: int, payload: Dict[str, Any], headers: Dict[str, str]) -> None:
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(data)))
+            self.send_header("x-request-id", f"req_{uuid.uuid4().hex[:16]}")
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_stream(self, payload: Dict[str, Any], headers: Dict[str, str]) -> None:
+            self.send_response(200)
+            self.send_header("content-type", "text/event-stream")
+            self.send_header("connection", "close")
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.close_connection = True
+            for event in _stream_events(payload):
+                self.wfile.write(f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+        def do_GET(self) -> None:
+            if self.path.rstrip("/") == "/stats":
+                self._send(200, dict(api.counters), {})
+            else:
+                self._send(404, _error("Not found.", "invalid_request_error", None), {})
+
+        def do_POST(self) -> None:
+            length = int(self.headers.get("content-length") or 0)
+            raw = self.rfile.read(length) if length else b""
+            if self.path.rstrip("/") not in {"/v1/responses", "/responses"}:
+                self._send(404, _error("Not found.", "invalid_request_error", None), {})
+                return
+            try:
+                body = json.loads(raw or b"{}")
+            except json.JSONDecodeError:
+                self._send(400, _error("Invalid JSON body.", "invalid_request_error", None), {})
+                return
+            status, payload, headers = api.handle(body)
+            if status == 200 and body.get("stream"):
+                self._send_stream(payload, headers)
+            else:
+                self._send(status, payload, headers)
+
+        def log_message(self, *_args) -> None:
+            pass
+
+    return Handler
+
+
+def serve(api: MockResponsesAPI, host: str = "127.0.0.1", port: int = 8010) -> ThreadingHTTPServer:
+    """Start the server on a background thread and return it (``shutdown()`` to stop)."""
+    server = ThreadingHTTPServer((host, port), make_handler(api))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8010)
+    parser.add_argument("--time-scale", type=float, default=1.0, help="fraction of simulated latency to sleep")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with HTTP 500")
+    parser.add_argument("--rpm", type=int, default=0, help="requests per minute before 429 (0 = unlimited)")
+    parser.add_argument("--tpm", type=int, default=0, help="tokens per minute before 429 (0 = unlimited)")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    api = MockResponsesAPI(args.time_scale, args.error_rate, args.rpm, args.tpm, args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(api))
+    server.daemon_threads = True
+    print(f"Mock Responses API on http://{args.host}:{args.port}/v1 (stats at /stats)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
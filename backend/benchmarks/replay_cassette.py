@@ -0,0 +1,72 @@
+"""Replay recorded traffic from a cassette through AgentSession, offline.
+
+Record a cassette from the API (``CASSETTE_MODE=record CASSETTE_PATH=...``),
+then run from ``backend/``::
+
+    python -m benchmarks.replay_cassette traffic.cassette.json.gz --latency-scale 0
+    python -m benchmarks.replay_cassette traffic.cassette.json.gz --latency-scale 1 --profile out.prof
+
+Turns are replayed in their recorded order, one ``AgentSession`` per recorded
+session id. Every model and tool call is answered from the cassette. The
+report gives turns/sec, p50/p95/p99 turn latency and cassette misses. A miss
+means the agent now sends a request that was never recorded, i.e. the call
+graph or a prompt changed.
+"""
+
+import argparse
+import cProfile
+import time
+from typing import Dict, List
+
+import tools
+from agent import AgentSession
+from benchmarks.simulated import percentile
+from cassettes import Cassette
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="cassette written in record mode")
+    parser.add_argument("--latency-scale", type=float, default=0.0, help="1 replays original latencies")
+    parser.add_argument("--profile", help="write cProfile stats for the replay to this file")
+    args = parser.parse_args()
+
+    cassette = Cassette(mode="replay", path=args.path, latency_scale=args.latency_scale)
+    client = cassette.wrap(None)
+    tools.client = client
+    turns = cassette.turns()
+    if not turns:
+        raise SystemExit("Cassette has no recorded turns (record through the API to capture them).")
+
+    sessions: Dict[str, AgentSession] = {}
+    latencies: List[float] = []
+    failures = 0
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    started = time.perf_counter()
+    for session_id, message in turns:
+        session = sessions.get(session_id)
+        if session is None:
+            session = sessions[session_id] = AgentSession(client_override=client)
+        turn_start = time.perf_counter()
+        try:
+            session.step(message)
+        except Exception:
+            failures += 1
+        latencies.append(time.perf_counter() - turn_start)
+    elapsed = time.perf_counter() - started
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+
+    stats = cassette.stats()
+    print(f"{len(turns)} turns over {len(sessions)} sessions in {elapsed:.2f} s")
+    print(f"turns/sec {len(turns) / elapsed:.1f}" if elapsed else "turns/sec n/a")
+    for pct in (50, 95, 99):
+        print(f"p{pct} {percentile(latencies, pct) * 1000:.2f} ms")
+    print(f"replayed {stats['replayed']} calls, misses {stats['misses']}, failed turns {failures}")
+
+
+if __name__ == "__main__":
+    main()
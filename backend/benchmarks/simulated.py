@@ -0,0 +1,278 @@
+"""Scripted stand-in for the OpenAI Responses API used by the offline benchmarks.
+
+``respond`` inspects the keyword arguments of a ``responses.create`` call the
+way the real model would see them (system prompt, last user message, offered
+tools) and returns a plausible reply: JSON question lists for triage, a final
+routing decision for ``nhs_111_live_triage``, ``function_call`` items when the
+conversation asks for services or a search, and plain text otherwise.
+
+``SimulatedClient`` wraps it with per-model latency drawn from a log-normal
+distribution and a ``usage`` block estimated from prompt and reply sizes.
+"""
+
+import json
+import math
+import random
+import threading
+import time
+from itertools import count
+from types import SimpleNamespace
+from typing import Any, Dict, List, Tuple
+
+# Median seconds and log-normal sigma per model, before web search.
+MODEL_LATENCY: Dict[str, Tuple[float, float]] = {
+    "gpt-4o-mini": (0.7, 0.35),
+    "gpt-4o": (1.6, 0.4),
+}
+WEB_SEARCH_FACTOR = 2.5
+CHARS_PER_TOKEN = 4
+
+TRIAGE_TRIGGERS = (
+    "sore throat", "temperature", "pain", "twisted", "swollen", "rash", "fever", "feeling low", "when i pee",
+)
+SERVICE_TRIGGERS = ("nearest", "near me", "closest")
+
+QUESTION_SETS = [
+    [
+        "How severe is it on a 0 to 10 scale?",
+        "When did this start, and is it getting better or worse?",
+        "Can you eat, drink and breathe normally right now?",
+    ],
+    [
+        "Have you taken anything for it so far?",
+        "Do you have any other worrying symptoms like a rash or stiff neck?",
+        "Have you been in contact with anyone who is unwell?",
+    ],
+]
+TRIAGE_RESULT = {
+    "status": "final",
+    "severity_level": "medium",
+    "suggested_service": "GP",
+    "rationale": "Symptoms are persistent but stable, so a GP appointment within a few days is appropriate.",
+    "postcode_full": "",
+    "should_lookup": False,
+}
+SERVICES = [
+    {"name": "Regent's Park Practice", "distance": "0.4 miles", "address": "1 Euston Rd, NW1 2BU", "phone": "020 7000 0001"},
+    {"name": "Camden Health Centre", "distance": "0.9 miles", "address": "20 Camden St, NW1 0LT", "phone": "020 7000 0002"},
+    {"name": "Marylebone Surgery", "distance": "1.2 miles", "address": "5 Marylebone Rd, NW1 5LS", "phone": "020 7000 0003"},
+]
+SEARCH_CONTEXT = (
+    "Students on a visa who have paid the immigration health surcharge can use NHS "
+    "dental services, but most dental treatment carries a charge (https://www.nhs.uk/nhs-services/dentists/). "
+    "Find a dentist accepting NHS patients near your term-time address and ask about "
+    "charges before booking (https://www.gov.uk/government/publications/nhs-dental-charges)."
+)
+ANSWER = (
+    "NHS 111 is a free service you can call or use online when you need medical help "
+    "quickly but it is not an emergency. It can tell you where to go, book you in at an "
+    "urgent treatment centre or arrange a call back from a nurse.\n\n"
+    "Useful links:\n- https://111.nhs.uk/"
+)
+TOOL_ANSWER = (
+    "Here are the closest options I found. If your symptoms get worse while you "
+    "wait, call 111, or 999 in an emergency."
+)
+SUGGESTIONS = ["How do I register with a GP?", "What does NHS 111 cover?", "Where is my nearest A&E?"]
+FOLLOW_UPS = (
+    "1. Register with a GP near your postcode.\n"
+    "2. Check which vaccinations you may be due.\n"
+    "3. Look at wellbeing support for sleep and stress.\n"
+    "Ask me if you want help finding local services."
+)
+
+# Scripted student conversations shared by bench_step and the load generator.
+FLOWS: Dict[str, List[str]] = {
+    "onboarding": [
+        "onboarding",
+        "skip",
+        "25-34",
+        "1 year",
+        "NW1 2BU",
+        "student visa",
+        "No",
+        "skip",
+        "skip",
+        "sleep and stress",
+        "skip",
+        "yes",
+    ],
+    "triage": [
+        "I've had a sore throat and a temperature for three days",
+        "about 5 out of 10, it started on Monday and is about the same, yes I can eat",
+        "just paracetamol, nothing else unusual, not that I know of",
+    ],
+    "qa_tools": [
+        "What is NHS 111?",
+        "Where is the nearest A&E to me?",
+    ],
+    "search": [
+        "Can you search for information about NHS dentists for students?",
+    ],
+}
+
+
+def _text_of(value: Any) -> str:
+    if isinstance(value, str):
+        return value
+    if isinstance(value, list):
+        parts = []
+        for item in value:
+            if isinstance(item, dict):
+                parts.append(str(item.get("content") or item.get("output") or ""))
+        return "\n".join(parts)
+    return ""
+
+
+def _last_user_message(value: Any) -> str:
+    if isinstance(value, list):
+        for item in reversed(value):
+            if isinstance(item, dict) and item.get("role") == "user":
+                return str(item.get("content") or "").lower()
+    return ""
+
+
+def _function_names(kwargs: Dict[str, Any]) -> List[str]:
+    return [
+        tool.get("name", "")
+        for tool in kwargs.get("tools") or []
+        if isinstance(tool, dict) and tool.get("type") == "function"
+    ]
+
+
+def respond(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build the reply for one ``responses.create`` call.
+    Returns ``{"text": str, "calls": [(name, arguments)]}``. Replies depend only
+    on the request, so any number of sessions can share one responder.
+    """
+    prompt = _text_of(kwargs.get("input"))
+    if "triage question generator" in prompt:
+        first_round = "Asked questions: []" in prompt
+        return {"text": json.dumps(QUESTION_SETS[0 if first_round else 1]), "calls": []}
+    if "NHS 101, a lightweight triage router" in prompt:
+        return {"text": json.dumps(TRIAGE_RESULT), "calls": []}
+    if "Open the NHS results page" in prompt:
+        return {"text": json.dumps(SERVICES), "calls": []}
+    if "site:nhs.uk" in prompt or "relevant results with citations" in prompt:
+        return {"text": SEARCH_CONTEXT, "calls": []}
+    if "NHS navigation coach" in prompt:
+        return {
+            "text": (
+                "**Recommendation:** Book a GP appointment in the next few days.\n"
+                "**Why:** Your symptoms are persistent but stable.\n"
+                "**Next steps:** Call 111 if you get worse before then.\n"
+                "**What to say:** \"I've had a sore throat and temperature for three days.\""
+            ),
+            "calls": [],
+        }
+    if "follow-up prompts the user might want to ask next" in prompt:
+        return {"text": json.dumps(SUGGESTIONS), "calls": []}
+    if "propose 3-5 concise follow-up suggestions" in prompt:
+        return {"text": FOLLOW_UPS, "calls": []}
+
+    offered = _function_names(kwargs)
+    if kwargs.get("previous_response_id"):
+        return {"text": TOOL_ANSWER, "calls": []}
+    if kwargs.get("tool_choice") == "none" or not offered:
+        return {"text": ANSWER, "calls": []}
+
+    message = _last_user_message(kwargs.get("input"))
+    if "guided_search" in offered and "search" in message:
+        return {"text": "", "calls": [("guided_search", {"query": message, "max_results": 5})]}
+    if "nearest_nhs_services" in offered and any(word in message for word in SERVICE_TRIGGERS):
+        service = "A&E" if "a&e" in message else "GP"
+        return {
+            "text": "",
+            "calls": [("nearest_nhs_services", {"postcode_full": "NW1 2BU", "service_type": service, "n": 3})],
+        }
+    if "nhs_111_live_triage" in offered and any(word in message for word in TRIAGE_TRIGGERS):
+        return {"text": "", "calls": [("nhs_111_live_triage", {"presenting_issue": message})]}
+    return {"text": ANSWER, "calls": []}
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, math.ceil(len(text) / CHARS_PER_TOKEN)) if text else 0
+
+
+def sample_latency(rng: random.Random, model: str, web_search: bool) -> float:
+    median, sigma = MODEL_LATENCY.get(model, MODEL_LATENCY["gpt-4o-mini"])
+    seconds = rng.lognormvariate(math.log(median), sigma)
+    return seconds * (WEB_SEARCH_FACTOR if web_search else 1.0)
+
+
+def uses_web_search(kwargs: Dict[str, Any]) -> bool:
+    return any(
+        isinstance(tool, dict) and tool.get("type") == "web_search_preview"
+        for tool in kwargs.get("tools") or []
+    )
+
+
+class SimulatedResponses:
+    def __init__(self, time_scale: float, seed: int):
+        self.time_scale = time_scale
+        self._rng = random.Random(seed)
+        self._ids = count(1)
+        self._lock = threading.Lock()
+        self.calls: List[Dict[str, Any]] = []
+
+    def create(self, **kwargs):
+        model = kwargs.get("model", "gpt-4o-mini")
+        web_search = uses_web_search(kwargs)
+        with self._lock:
+            reply = respond(kwargs)
+            latency = sample_latency(self._rng, model, web_search)
+            response_id = f"resp_sim_{next(self._ids)}"
+            self.calls.append({"model": model, "web_search": web_search, "latency": latency})
+        if self.time_scale > 0:
+            time.sleep(latency * self.time_scale)
+
+        output = [
+            SimpleNamespace(
+                type="function_call",
+                name=name,
+                call_id=f"call_{response_id}_{idx}",
+                arguments=json.dumps(arguments),
+            )
+            for idx, (name, arguments) in enumerate(reply["calls"])
+        ]
+        if reply["text"]:
+            output.append(SimpleNamespace(type="message", role="assistant", content=[]))
+        usage = SimpleNamespace(
+            input_tokens=estimate_tokens(_text_of(kwargs.get("input"))),
+            output_tokens=estimate_tokens(reply["text"]) + 20 * len(reply["calls"]),
+            input_tokens_details=SimpleNamespace(cached_tokens=0),
+        )
+        return SimpleNamespace(id=response_id, output_text=reply["text"], output=output, usage=usage)
+
+
+class SimulatedClient:
+    """Drop-in for ``OpenAI()`` exposing ``responses.create`` only."""
+
+    def __init__(self, time_scale: float = 0.0, seed: int = 7):
+        self.responses = SimulatedResponses(time_scale, seed)
+
+    def reset_calls(self) -> List[Dict[str, Any]]:
+        calls, self.responses.calls = self.responses.calls, []
+        return calls
+
+
+def simulated_seconds(calls: List[Dict[str, Any]]) -> float:
+    """Total unscaled latency of a list of recorded calls."""
+    return sum(call["latency"] for call in calls)
+
+
+def model_call_counts(calls: List[Dict[str, Any]]) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for call in calls:
+        key = call["model"] + ("+web_search" if call["web_search"] else "")
+        counts[key] = counts.get(key, 0) + 1
+    return dict(sorted(counts.items()))
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[rank]
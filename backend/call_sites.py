@@ -0,0 +1,135 @@
+"""Model routing per call site: model, fallback, timeout, output budget and priority.
+
+Defaults live in ``config.CALL_SITES``. ``CALL_SITE_CONFIG_PATH`` may point at
+a JSON file of the same shape; its entries are merged over the defaults key by
+key, so a call site can move to another model without a code change.
+``llm.create_response`` fills in whatever its caller did not pass explicitly.
+
+With ``OUTPUT_BUDGET_MODE=adaptive`` (the default) a call site's output budget
+follows what it actually uses. After ``MIN_SAMPLES`` responses the budget is
+the 95th percentile of recent output tokens plus ``HEADROOM``, kept between
+``min_output_tokens`` (default a quarter of the cap) and the configured
+``max_output_tokens``. Function-call decisions and text replies are sampled
+separately and the budget covers the larger of the two, so a site such as
+``step.first`` whose replies are mostly short tool calls does not squeeze its
+occasional text reply; a kind seen fewer than ``MIN_SAMPLES`` times gets the
+cap. A response cut off at its budget is counted at the configured cap, so the
+budget grows back, and ``llm.create_response`` retries it once at the cap. Smaller
+budgets matter because the API counts ``max_output_tokens`` against the
+tokens-per-minute limit when admitting a request. ``fixed`` always sends the
+configured value.
+"""
+
+import json
+import math
+import os
+from collections import deque
+from threading import Lock
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from config import CALL_SITES
+
+MIN_SAMPLES = 20
+WINDOW = 200
+PERCENTILE = 95
+HEADROOM = 1.3
+SETTING_KEYS = {"model", "fallback", "timeout", "max_output_tokens", "min_output_tokens", "priority"}
+
+
+class CallSiteSettings:
+    __slots__ = ("name", "model", "fallback", "timeout", "max_output_tokens", "min_output_tokens", "priority")
+
+    def __init__(self, name: str, entry: Dict[str, Any]):
+        self.name = name
+        self.model: Optional[str] = entry.get("model")
+        self.fallback: Optional[str] = entry.get("fallback")
+        self.timeout: Optional[float] = entry.get("timeout")
+        self.max_output_tokens: Optional[int] = entry.get("max_output_tokens")
+        floor = entry.get("min_output_tokens")
+        if floor is None and self.max_output_tokens:
+            floor = max(16, self.max_output_tokens // 4)
+        self.min_output_tokens: Optional[int] = floor
+        self.priority: str = entry.get("priority") or "qa"
+
+
+class CallSiteRegistry:
+    """Resolves call-site settings and tracks observed output tokens."""
+
+    def __init__(self, entries: Dict[str, Dict[str, Any]], adaptive: bool = True):
+        self.adaptive = adaptive
+        self._sites: Dict[str, CallSiteSettings] = {}
+        for name, entry in entries.items():
+            unknown = set(entry) - SETTING_KEYS
+            if unknown:
+                raise ValueError(f"Unknown settings for call site {name!r}: {', '.join(sorted(unknown))}.")
+            self._sites[name] = CallSiteSettings(name, entry)
+        self._observed: Dict[Tuple[str, str], Deque[int]] = {}
+        self._truncated: Dict[str, int] = {}
+        self._lock = Lock()
+
+    @classmethod
+    def from_env(cls) -> "CallSiteRegistry":
+        entries = {name: dict(entry) for name, entry in CALL_SITES.items()}
+        path = os.getenv("CALL_SITE_CONFIG_PATH")
+        if path:
+            with open(path, "r", encoding="utf-8") as handle:
+                for name, overrides in json.load(handle).items():
+                    entries[name] = {**entries.get(name, {}), **overrides}
+        mode = os.getenv("OUTPUT_BUDGET_MODE", "adaptive").strip().lower()
+        return cls(entries, adaptive=mode != "fixed")
+
+    def get(self, call_site: str) -> Optional[CallSiteSettings]:
+        return self._sites.get(call_site)
+
+    def output_budget(self, call_site: str) -> Optional[int]:
+        site = self._sites.get(call_site)
+        if site is None or not site.max_output_tokens:
+            return None
+        if not self.adaptive:
+            return site.max_output_tokens
+        with self._lock:
+            by_kind = [
+                sorted(samples)
+                for (name, _kind), samples in self._observed.items()
+                if name == call_site
+            ]
+        if not by_kind or any(len(observed) < MIN_SAMPLES for observed in by_kind):
+            return site.max_output_tokens
+        budget = 0
+        for observed in by_kind:
+            rank = min(len(observed) - 1, math.ceil(PERCENTILE / 100 * len(observed)) - 1)
+            budget = max(budget, math.ceil(observed[rank] * HEADROOM))
+        return max(site.min_output_tokens or 1, min(site.max_output_tokens, budget))
+
+    def observe(self, call_site: str, output_tokens: int, truncated: bool = False, kind: str = "text") -> None:
+        """Record one response's output tokens; ``kind`` is ``"text"`` or ``"tool_call"``."""
+        site = self._sites.get(call_site)
+        if site is None or not site.max_output_tokens:
+            return
+        with self._lock:
+            samples = self._observed.setdefault((call_site, kind), deque(maxlen=WINDOW))
+            if truncated:
+                self._truncated[call_site] = self._truncated.get(call_site, 0) + 1
+                samples.append(max(output_tokens, site.max_output_tokens))
+            else:
+                samples.append(output_tokens)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        report = {}
+        for name, site in self._sites.items():
+            with self._lock:
+                samples = sum(len(observed) for (site_name, _kind), observed in self._observed.items() if site_name == name)
+                truncated = self._truncated.get(name, 0)
+            report[name] = {
+                "model": site.model,
+                "fallback": site.fallback,
+                "priority": site.priority,
+                "max_output_tokens": site.max_output_tokens,
+                "output_budget": self.output_budget(name),
+                "samples": samples,
+                "truncated": truncated,
+            }
+        return report
+
+
+CALL_SITE_REGISTRY = CallSiteRegistry.from_env()
@@ -0,0 +1,321 @@
+"""Record/replay of ``responses.create`` calls for offline regression and profiling.
+
+With ``CASSETTE_MODE=record`` every call made through the shared OpenAI
+clients (``AgentSession.safe_create``, the direct calls in ``agent`` and the
+tool functions) is captured into the cassette at ``CASSETTE_PATH``. With
+``CASSETTE_MODE=replay`` the same calls are answered from the cassette and
+no API key or network access is needed.
+
+The API layer also logs each incoming ``(session_id, message)`` turn, so
+``benchmarks/replay_cassette.py`` can push the recorded traffic back through
+``AgentSession`` offline.
+
+Cassettes are content addressed. A request is keyed by the SHA-256 of its
+canonical JSON. Each distinct response body is stored once under its own hash,
+so repeated prompts (question generators, prompt suggestions) cost one entry.
+Only the fields the agent reads are kept: id, output_text, output items and
+usage. Identical requests replay their recorded responses in order, including
+API errors, timeouts and connection failures, so retries and fallbacks replay
+too. ``CASSETTE_LATENCY_SCALE`` replays the original latencies (1.0), scaled,
+or not at all (0, the default). Streamed calls are recorded and replayed as
+whole responses, so under a cassette a reply arrives as one text delta.
+
+The file is a journal: gzip-compressed JSON lines, one per turn, body or
+interaction, appended in batches of ``SAVE_EVERY`` calls as new gzip members,
+so recording costs the same per call however long it runs. Version 2
+cassettes (one JSON document) still load.
+"""
+
+import atexit
+import gzip
+import hashlib
+import json
+import os
+import time
+from threading import Lock
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from openai import APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
+
+CASSETTE_VERSION = 3
+SAVE_EVERY = 25
+
+
+class CassetteMiss(LookupError):
+    """Raised in replay mode when a request was never recorded."""
+
+
+# Limits rather than content: a cassette still replays after call-site
+# timeouts or (adaptive) output budgets change.
+UNKEYED_FIELDS = {"timeout", "max_output_tokens"}
+
+
+def request_key(kwargs: Dict[str, Any]) -> str:
+    keyed = {key: value for key, value in kwargs.items() if key not in UNKEYED_FIELDS}
+    canonical = json.dumps(keyed, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _plain(value: Any) -> Any:
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json", exclude_none=True)
+    if isinstance(value, SimpleNamespace):
+        return {key: _plain(item) for key, item in vars(value).items()}
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    return value
+
+
+def _compact_item(item: Any) -> Dict[str, Any]:
+    data = _plain(item)
+    if not isinstance(data, dict):
+        return {"type": str(data)}
+    if data.get("type") == "function_call":
+        return {key: data.get(key) for key in ("type", "name", "call_id", "arguments")}
+    # Message text is already in output_text; keep only what identifies the item.
+    return {key: data[key] for key in ("type", "role") if key in data}
+
+
+def compact_response(response: Any) -> Dict[str, Any]:
+    usage = _plain(getattr(response, "usage", None)) or {}
+    return {
+        "id": getattr(response, "id", None),
+        "output_text": getattr(response, "output_text", "") or "",
+        "output": [_compact_item(item) for item in getattr(response, "output", None) or []],
+        "usage": {
+            "input_tokens": usage.get("input_tokens", 0),
+            "cached_tokens": (usage.get("input_tokens_details") or {}).get("cached_tokens", 0),
+            "output_tokens": usage.get("output_tokens", 0),
+        },
+    }
+
+
+def restore_response(data: Dict[str, Any]) -> SimpleNamespace:
+    usage = data.get("usage") or {}
+    return SimpleNamespace(
+        id=data.get("id"),
+        output_text=data.get("output_text", ""),
+        output=[SimpleNamespace(**item) for item in data.get("output", [])],
+        usage=SimpleNamespace(
+            input_tokens=usage.get("input_tokens", 0),
+            output_tokens=usage.get("output_tokens", 0),
+            input_tokens_details=SimpleNamespace(cached_tokens=usage.get("cached_tokens", 0)),
+        ),
+    )
+
+
+def _error_record(exc: Exception) -> Optional[Dict[str, Any]]:
+    if isinstance(exc, APIStatusError):
+        return {"status": exc.status_code, "message": exc.message}
+    if isinstance(exc, APITimeoutError):
+        return {"kind": "timeout"}
+    if isinstance(exc, APIConnectionError):
+        return {"kind": "connection", "message": exc.message}
+    return None
+
+
+def _raise_recorded(error: Dict[str, Any]) -> None:
+    if error.get("kind") == "timeout":
+        raise APITimeoutError(request=None)
+    if error.get("kind") == "connection":
+        raise APIConnectionError(message=error.get("message") or "Connection error.", request=None)
+    # A stand-in for the HTTP response; the SDK errors only read these fields.
+    response = SimpleNamespace(request=None, status_code=error["status"], headers={})
+    error_class = RateLimitError if error["status"] == 429 else APIStatusError
+    raise error_class(error["message"], response=response, body=None)
+
+
+class Cassette:
+    """Thread-safe store of recorded interactions, saved as gzip JSON."""
+
+    def __init__(self, mode: str = "off", path: Optional[str] = None, latency_scale: float = 0.0):
+        self.mode = mode if mode in {"off", "record", "replay"} else "off"
+        self.path = path
+        self.latency_scale = latency_scale
+        self._lock = Lock()
+        self._write_lock = Lock()
+        self._pending: List[str] = []
+        self._turns: List[List[str]] = []
+        self._interactions: Dict[str, List[Dict[str, Any]]] = {}
+        self._bodies: Dict[str, Dict[str, Any]] = {}
+        self._cursor: Dict[str, int] = {}
+        self._unsaved = 0
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+        if self.mode != "off" and not path:
+            raise ValueError("CASSETTE_PATH is required when CASSETTE_MODE is set.")
+        if self.mode != "off":
+            self.load()
+
+    @classmethod
+    def from_env(cls) -> "Cassette":
+        cassette = cls(
+            mode=os.getenv("CASSETTE_MODE", "off").strip().lower(),
+            path=os.getenv("CASSETTE_PATH", "").strip() or None,
+            latency_scale=float(os.getenv("CASSETTE_LATENCY_SCALE", "0")),
+        )
+        if cassette.recording:
+            atexit.register(cassette.save)
+        return cassette
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def wrap(self, client: Any) -> Any:
+        """Return ``client`` routed through the cassette (unchanged when off)."""
+        if self.mode == "off":
+            return client
+        if self.recording and client is None:
+            return None
+        return CassetteClient(client, self)
+
+    # -- storage ------------------------------------------------------------
+    def load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        turns: List[List[str]] = []
+        interactions: Dict[str, List[Dict[str, Any]]] = {}
+        bodies: Dict[str, Dict[str, Any]] = {}
+        with gzip.open(self.path, "rt", encoding="utf-8") as handle:
+            for line in handle:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if "interactions" in record:
+                    # Version 2: the whole cassette as one document.
+                    turns.extend(record.get("turns", []))
+                    for key, entries in record["interactions"].items():
+                        interactions.setdefault(key, []).extend(entries)
+                    bodies.update(record.get("bodies", {}))
+                elif "turn" in record:
+                    turns.append(record["turn"])
+                elif "body" in record:
+                    bodies[record["body"]] = record["data"]
+                elif "request" in record:
+                    interactions.setdefault(record["request"], []).append(record["entry"])
+        with self._lock:
+            self._turns = turns
+            self._interactions = interactions
+            self._bodies = bodies
+            self._cursor = {}
+
+    def save(self) -> None:
+        """Append everything recorded since the last save to the journal."""
+        if not self.path or not self.recording:
+            return
+        # Held across the write so batches land in the order they were taken.
+        with self._write_lock:
+            with self._lock:
+                lines, self._pending = self._pending, []
+                self._unsaved = 0
+            if not lines:
+                return
+            if not os.path.exists(self.path):
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                lines.insert(0, json.dumps({"version": CASSETTE_VERSION}))
+            # The leading newline ends a version 2 document this journal extends.
+            with gzip.open(self.path, "at", encoding="utf-8") as handle:
+                handle.write("\n" + "\n".join(lines) + "\n")
+
+    # -- record / replay ----------------------------------------------------
+    def record_turn(self, session_id: str, message: str) -> None:
+        """Log an incoming user turn so the traffic itself can be replayed."""
+        if not self.recording:
+            return
+        with self._lock:
+            self._turns.append([session_id, message])
+            self._pending.append(json.dumps({"turn": [session_id, message]}, separators=(",", ":")))
+
+    def turns(self) -> List[List[str]]:
+        with self._lock:
+            return [list(turn) for turn in self._turns]
+
+    def record(self, key: str, model: Optional[str], latency: float, response: Any = None, error=None) -> None:
+        entry: Dict[str, Any] = {"model": model, "latency": round(latency, 4)}
+        if error is not None:
+            entry["error"] = error
+        else:
+            body = compact_response(response)
+            body_key = request_key(body)
+            entry["body"] = body_key
+        with self._lock:
+            if error is None and body_key not in self._bodies:
+                self._bodies[body_key] = body
+                self._pending.append(json.dumps({"body": body_key, "data": body}, separators=(",", ":")))
+            self._interactions.setdefault(key, []).append(entry)
+            self._pending.append(json.dumps({"request": key, "entry": entry}, separators=(",", ":")))
+            self.recorded += 1
+            self._unsaved += 1
+            due = self._unsaved >= SAVE_EVERY
+        if due:
+            self.save()
+
+    def replay(self, key: str) -> SimpleNamespace:
+        with self._lock:
+            entries = self._interactions.get(key)
+            if not entries:
+                self.misses += 1
+                raise CassetteMiss(f"No recorded response for request {key[:12]}.")
+            index = self._cursor.get(key, 0)
+            self._cursor[key] = index + 1
+            entry = entries[min(index, len(entries) - 1)]
+            body = self._bodies.get(entry.get("body", ""))
+            self.replayed += 1
+        if self.latency_scale > 0:
+            time.sleep(entry.get("latency", 0.0) * self.latency_scale)
+        if "error" in entry:
+            _raise_recorded(entry["error"])
+        return restore_response(body or {})
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "turns": len(self._turns),
+                "requests": len(self._interactions),
+                "bodies": len(self._bodies),
+                "recorded": self.recorded,
+                "replayed": self.replayed,
+                "misses": self.misses,
+            }
+
+
+class _CassetteResponses:
+    def __init__(self, inner: Any, cassette: Cassette):
+        self._inner = inner
+        self._cassette = cassette
+
+    def create(self, **kwargs):
+        kwargs.pop("stream", None)
+        key = request_key(kwargs)
+        if self._cassette.replaying:
+            return self._cassette.replay(key)
+        started = time.perf_counter()
+        try:
+            response = self._inner.responses.create(**kwargs)
+        except Exception as exc:
+            error = _error_record(exc)
+            if error is not None:
+                self._cassette.record(key, kwargs.get("model"), time.perf_counter() - started, error=error)
+            raise
+        self._cassette.record(key, kwargs.get("model"), time.perf_counter() - started, response)
+        return response
+
+
+class CassetteClient:
+    """Client exposing ``responses.create`` through a cassette."""
+
+    def __init__(self, inner: Any, cassette: Cassette):
+        self.responses = _CassetteResponses(inner, cassette)
+
+
+CASSETTE = Cassette.from_env()
@@ -0,0 +1,205 @@
+"""Stream a cohort CSV of new-student profiles into the profile store.
+
+The CSV has a ``student_id`` column plus any of the onboarding question keys
+(``name``, ``age_range``, ``stay_length``, ``postcode``, ...). Rows are read
+one at a time and validated in batches with the onboarding rules
+(``profiles.build_profile``), on a process pool when ``workers > 1``. Valid
+batches are written to ``PROFILE_STORE``. Only ``workers * 2`` batches are in
+flight at once, so memory stays flat however long the file is.
+
+Run from ``backend/``::
+
+    python cohort_import.py cohort.csv --workers 4 --errors cohort_errors.csv --claim-tokens tokens.csv
+
+With ``--claim-tokens`` (and ``PROFILE_CLAIM_SECRET`` set) the CLI writes each
+imported student's claim token, which student support sends to the student.
+The same import is exposed as ``POST /api/profiles/import`` (CSV request body,
+admin token required).
+"""
+
+import argparse
+import csv
+import json
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from config import ONBOARDING_QUESTIONS
+from profiles import PROFILE_CLAIM_SECRET, PROFILE_STORE, ProfileStore, build_profile, claim_token
+
+ID_COLUMN = "student_id"
+PROFILE_COLUMNS = {str(question["key"]) for question in ONBOARDING_QUESTIONS}
+MAX_REPORTED_ERRORS = 1000
+
+Row = Tuple[int, Dict[str, str]]
+RowError = Dict[str, Any]
+
+
+class ImportReport:
+    """Counts, throughput and the first ``MAX_REPORTED_ERRORS`` row errors."""
+
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.failed = 0
+        self.seconds = 0.0
+        self.errors: List[RowError] = []
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "rows": self.rows,
+            "imported": self.imported,
+            "failed": self.failed,
+            "seconds": round(self.seconds, 3),
+            "rows_per_sec": round(self.rows_per_sec, 1),
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+def validate_rows(rows: List[Row]) -> Tuple[List[Tuple[str, Dict[str, Any]]], List[RowError]]:
+    """Validate one batch; returns (valid (id, profile) pairs, row errors)."""
+    valid = []
+    errors = []
+    for line, row in rows:
+        student_id = (row.get(ID_COLUMN) or "").strip()
+        answers = {key: value for key, value in row.items() if key in PROFILE_COLUMNS}
+        profile, field_errors = build_profile(answers)
+        if not student_id:
+            field_errors = {ID_COLUMN: "student_id is required.", **field_errors}
+        if field_errors:
+            errors.append({"line": line, ID_COLUMN: student_id, "errors": field_errors})
+        else:
+            valid.append((student_id, profile))
+    return valid, errors
+
+
+def _batches(reader: "csv.DictReader", size: int) -> Iterator[List[Row]]:
+    rows = ((reader.line_num, row) for row in reader)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def import_csv(
+    lines: Iterable[str],
+    store: ProfileStore = PROFILE_STORE,
+    batch_size: int = 1000,
+    workers: int = 1,
+    on_error: Optional[Callable[[RowError], None]] = None,
+    on_imported: Optional[Callable[[str], None]] = None,
+) -> ImportReport:
+    """
+    Import profiles from CSV text lines. Raises ValueError for an unusable
+    header; row problems are reported, not raised.
+    """
+    reader = csv.DictReader(lines)
+    header = reader.fieldnames or []
+    if ID_COLUMN not in header:
+        raise ValueError(f"CSV header must include {ID_COLUMN!r}.")
+    unknown = [column for column in header if column != ID_COLUMN and column not in PROFILE_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown CSV columns: {', '.join(unknown)}.")
+
+    report = ImportReport()
+    started = time.perf_counter()
+
+    def apply(result: Tuple[List[Tuple[str, Dict[str, Any]]], List[RowError]]) -> None:
+        valid, errors = result
+        store.put_many(valid)
+        if on_imported is not None:
+            for student_id, _profile in valid:
+                on_imported(student_id)
+        report.rows += len(valid) + len(errors)
+        report.imported += len(valid)
+        report.failed += len(errors)
+        for error in errors:
+            if len(report.errors) < MAX_REPORTED_ERRORS:
+                report.errors.append(error)
+            if on_error is not None:
+                on_error(error)
+
+    if workers <= 1:
+        for batch in _batches(reader, batch_size):
+            apply(validate_rows(batch))
+    else:
+        # Spawned workers only import the validators; forking would copy the
+        # server's threads and in-memory sessions.
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            pending: Deque[Future] = deque()
+            for batch in _batches(reader, batch_size):
+                pending.append(pool.submit(validate_rows, batch))
+                if len(pending) >= workers * 2:
+                    apply(pending.popleft().result())
+            while pending:
+                apply(pending.popleft().result())
+
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="cohort CSV with a student_id column")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=1, help="validation processes")
+    parser.add_argument("--errors", help="write every row error to this CSV")
+    parser.add_argument("--claim-tokens", help="write student_id,claim_token for imported rows to this CSV")
+    args = parser.parse_args()
+    if args.claim_tokens and not PROFILE_CLAIM_SECRET:
+        parser.error("--claim-tokens needs PROFILE_CLAIM_SECRET.")
+
+    error_handle = open(args.errors, "w", newline="", encoding="utf-8") if args.errors else None
+    error_writer = csv.writer(error_handle) if error_handle else None
+    if error_writer:
+        error_writer.writerow(["line", ID_COLUMN, "errors"])
+
+    token_handle = open(args.claim_tokens, "w", newline="", encoding="utf-8") if args.claim_tokens else None
+    token_writer = csv.writer(token_handle) if token_handle else None
+    if token_writer:
+        token_writer.writerow([ID_COLUMN, "claim_token"])
+
+    def write_error(error: RowError) -> None:
+        if error_writer:
+            error_writer.writerow([error["line"], error[ID_COLUMN], json.dumps(error["errors"])])
+
+    def write_token(student_id: str) -> None:
+        if token_writer:
+            token_writer.writerow([student_id, claim_token(student_id, PROFILE_CLAIM_SECRET)])
+
+    try:
+        with open(args.path, "r", newline="", encoding="utf-8-sig") as handle:
+            report = import_csv(
+                handle,
+                batch_size=args.batch_size,
+                workers=args.workers,
+                on_error=write_error,
+                on_imported=write_token,
+            )
+    finally:
+        for output in (error_handle, token_handle):
+            if output:
+                output.close()
+
+    print(
+        f"{report.rows} rows in {report.seconds:.2f} s ({report.rows_per_sec:.0f} rows/sec): "
+        f"{report.imported} imported, {report.failed} failed"
+    )
+    for error in report.errors[:20]:
+        print(f"  line {error['line']} {error[ID_COLUMN] or '-'}: {error['errors']}")
+    if not PROFILE_STORE.path:
+        print("PROFILE_STORE_PATH is not set, so nothing was persisted.")
+
+
+if __name__ == "__main__":
+    main()
@@ -17,24 +17,6 @@ ONBOARDING_QUESTIONS: List[Dict[str, object]] = [
 ]
 
 
-CANONICAL_LINKS = [
-    {"title": "Find a GP", "url": "https://www.nhs.uk/service-search/find-a-gp", "tags": ["gp", "register"]},
-    {
-        "title": "Register with a GP",
-        "url": "https://www.nhs.uk/nhs-services/gps/how-to-register-with-a-gp-surgery/",
-        "tags": ["gp", "register"],
-    },
-    {"title": "Use NHS 111 online", "url": "https://111.nhs.uk/", "tags": ["111", "urgent", "triage"]},
-    {"title": "NHS services guide", "url": "https://www.nhs.uk/using-the-nhs/nhs-services/", "tags": ["nhs", "services", "eligibility"]},
-    {"title": "LBS health and wellbeing", "url": "https://www.london.edu/masters-experience/student-support", "tags": ["lbs", "wellbeing"]},
-    {
-        "title": "LBS mental wellbeing support",
-        "url": "https://www.london.edu/masters-experience/student-support/mental-health",
-        "tags": ["mental", "wellbeing", "lbs"],
-    },
-]
-
-
 ONBOARDING_TRIGGER_PHRASES = {
     "onboarding",
     "on board me",
@@ -61,3 +43,81 @@ ACTION_KEYWORDS = [
     "contact your gp",
     "contact gp",
 ]
+
+
+RED_FLAG_KEYWORDS = [
+    "chest pain",
+    "severe bleeding",
+    "not breathing",
+    "can't breathe",
+    "suicidal",
+    "harm myself",
+    "overdose",
+    "unconscious",
+    "collapse",
+    "stroke",
+    "heart attack",
+    "seizure",
+    "very high fever",
+    "severe allergic",
+    "anaphylaxis",
+]
+
+
+SEARCH_KEYWORDS = ["search", "find info", "find information"]
+
+
+ELIGIBILITY_KEYWORDS = ["eligible", "eligibility"]
+
+
+# Conversation keywords that select link catalog tags (data/links.json), keyed by rule name.
+LINK_TAG_RULES: Dict[str, Dict[str, List[str]]] = {
+    "gp": {"keywords": ["gp", "register"], "tags": ["gp", "register"]},
+    "urgent": {"keywords": ["111", "urgent", "triage"], "tags": ["111"]},
+    "emergency": {"keywords": ["a&e", "a and e", "emergency"], "tags": ["111", "services"]},
+    "mental": {"keywords": ["mental", "wellbeing"], "tags": ["mental", "wellbeing", "lbs"]},
+    "eligibility": {"keywords": ["eligib", "visa"], "tags": ["eligibility", "services"]},
+    "nhs": {"keywords": ["nhs"], "tags": ["services"]},
+}
+
+
+# USD per million tokens (input, cached input, output), used for cost accounting.
+MODEL_PRICING: Dict[str, Dict[str, float]] = {
+    "gpt-4o": {"input": 2.50, "cached": 1.25, "output": 10.00},
+    "gpt-4o-mini": {"input": 0.15, "cached": 0.075, "output": 0.60},
+}
+
+
+# Model each model is swapped for once a token budget is exceeded.
+CHEAPER_MODEL: Dict[str, str] = {"gpt-4o": "gpt-4o-mini"}
+
+
+# Call sites with a deterministic fallback; skipped once a token budget is exceeded.
+OPTIONAL_CALL_SITES = {
+    "triage.questions",
+    "triage.summary",
+    "profile.followups",
+    "prompt_suggestions",
+}
+
+
+# Model routing per call site: model, fallback (used on timeouts / server errors
+# and when a token budget is exceeded), request timeout in seconds, output
+# token budget (None = no cap) and priority when calls queue (triage > qa >
+# best_effort, see scheduler.py). Override any entry without a code change
+# with a JSON file at CALL_SITE_CONFIG_PATH (see call_sites.py).
+CALL_SITES: Dict[str, Dict[str, object]] = {
+    "step.first": {"model": "gpt-4o-mini", "fallback": None, "timeout": 30.0, "max_output_tokens": 250, "priority": "qa"},
+    "step.tool_round": {"model": "gpt-4o-mini", "fallback": None, "timeout": 30.0, "max_output_tokens": 250, "priority": "qa"},
+    "step.forced_reply": {"model": "gpt-4o-mini", "fallback": None, "timeout": 30.0, "max_output_tokens": 200, "priority": "qa"},
+    "step.blank_reply": {"model": "gpt-4o-mini", "fallback": None, "timeout": 30.0, "max_output_tokens": 200, "priority": "qa"},
+    "triage.questions": {"model": "gpt-4o-mini", "fallback": None, "timeout": 15.0, "max_output_tokens": 160, "priority": "triage"},
+    "triage.summary": {"model": "gpt-4o-mini", "fallback": None, "timeout": 20.0, "max_output_tokens": 200, "priority": "triage"},
+    "profile.followups": {"model": "gpt-4o-mini", "fallback": None, "timeout": 15.0, "max_output_tokens": 220, "priority": "best_effort"},
+    "prompt_suggestions": {"model": "gpt-4o-mini", "fallback": None, "timeout": 10.0, "max_output_tokens": 120, "priority": "best_effort"},
+    "tool.guided_search.restricted": {"model": "gpt-4o-mini", "fallback": None, "timeout": 60.0, "max_output_tokens": 1200, "priority": "qa"},
+    "tool.guided_search.broad": {"model": "gpt-4o-mini", "fallback": None, "timeout": 60.0, "max_output_tokens": 1200, "priority": "qa"},
+    "tool.nearest_nhs_services": {"model": "gpt-4o", "fallback": "gpt-4o-mini", "timeout": 60.0, "max_output_tokens": None, "priority": "qa"},
+    "tool.nhs_111_live_triage": {"model": "gpt-4o", "fallback": "gpt-4o-mini", "timeout": 60.0, "max_output_tokens": 700, "priority": "triage"},
+    "tool.nhs_111_live_triage.strict": {"model": "gpt-4o-mini", "fallback": None, "timeout": 20.0, "max_output_tokens": 500, "priority": "triage"},
+}
@@ -0,0 +1,107 @@
+"""Bounded conversation history with optional cold archival.
+
+``ConversationHistory`` keeps the most recent messages in a fixed-capacity
+ring of slotted records, so per-session memory stays flat however long a
+conversation runs. Messages pushed out of the ring are dropped, or appended
+to a gzip-compressed JSONL archive when an archive path is set, and
+``transcript`` replays archived and in-memory messages in order.
+"""
+
+import gzip
+import json
+import os
+from typing import Dict, Iterator, List, Optional, Union
+
+ARCHIVE_BATCH_SIZE = 16
+
+
+class HistoryMessage:
+    __slots__ = ("role", "content")
+
+    def __init__(self, role: str, content: str):
+        self.role = role
+        self.content = content
+
+    def as_dict(self) -> Dict[str, str]:
+        return {"role": self.role, "content": self.content}
+
+
+class ConversationHistory:
+    """
+    Ring buffer of the last ``capacity`` messages.
+    Supports the list operations the agent uses (append, len, iteration,
+    indexing and slicing); reads return plain ``{"role", "content"}`` dicts.
+    """
+
+    __slots__ = ("capacity", "archive_path", "total", "_slots", "_start", "_size", "_evicted")
+
+    def __init__(self, capacity: int, archive_path: Optional[str] = None):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self.archive_path = archive_path
+        self.total = 0
+        self._slots: List[Optional[HistoryMessage]] = [None] * capacity
+        self._start = 0
+        self._size = 0
+        self._evicted: List[HistoryMessage] = []
+
+    def append(self, message: Dict[str, str]) -> None:
+        record = HistoryMessage(str(message.get("role", "")), str(message.get("content", "")))
+        if self._size < self.capacity:
+            self._slots[(self._start + self._size) % self.capacity] = record
+            self._size += 1
+        else:
+            oldest = self._slots[self._start]
+            self._slots[self._start] = record
+            self._start = (self._start + 1) % self.capacity
+            if self.archive_path and oldest is not None:
+                self._evicted.append(oldest)
+                if len(self._evicted) >= ARCHIVE_BATCH_SIZE:
+                    self.flush()
+        self.total += 1
+
+    def _records(self) -> Iterator[HistoryMessage]:
+        for offset in range(self._size):
+            yield self._slots[(self._start + offset) % self.capacity]
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[Dict[str, str]]:
+        return (record.as_dict() for record in self._records())
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            return [record.as_dict() for record in list(self._records())[index]]
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("history index out of range")
+        return self._slots[(self._start + index) % self.capacity].as_dict()
+
+    def window(self, count: int) -> List[Dict[str, str]]:
+        """Return the last ``count`` messages, oldest first."""
+        return self[-count:] if count > 0 else []
+
+    def flush(self) -> None:
+        """Append evicted messages to the archive as one gzip member."""
+        if not self._evicted or not self.archive_path:
+            return
+        directory = os.path.dirname(self.archive_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        lines = "".join(json.dumps(record.as_dict()) + "\n" for record in self._evicted)
+        with gzip.open(self.archive_path, "at", encoding="utf-8") as handle:
+            handle.write(lines)
+        self._evicted = []
+
+    def transcript(self) -> Iterator[Dict[str, str]]:
+        """Yield every message of the conversation, archived ones first."""
+        self.flush()
+        if self.archive_path and os.path.exists(self.archive_path):
+            with gzip.open(self.archive_path, "rt", encoding="utf-8") as handle:
+                for line in handle:
+                    if line.strip():
+                        yield json.loads(line)
+        yield from self
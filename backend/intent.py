@@ -0,0 +1,368 @@
+"""Local intent classifier that predicts a turn's route before the first model call.
+
+A TF-IDF nearest-centroid model (pure Python, sparse dict vectors) predicts
+one of ``ROUTES`` from the user message. ``IntentRouter`` wraps it with a
+mode read from the environment:
+
+- ``off`` (default): the classifier is never consulted.
+- ``shadow``: predictions are scored against the route the model actually took.
+- ``active``: confident predictions narrow the toolset, or start triage directly.
+
+Turns can be logged as JSONL (``INTENT_LOG_PATH``) and used to retrain::
+
+    python intent.py train --log turns.jsonl --out intent_model.json
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+from collections import Counter
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+ROUTES = ("triage", "nearby_services", "search", "qa")
+
+# Tools each route may use when the router narrows the first model call.
+# The safety tool is always kept.
+ROUTE_TOOLS: Dict[str, Tuple[str, ...]] = {
+    "nearby_services": ("nearest_nhs_services", "trigger_safety_protocol"),
+    "search": ("guided_search", "trigger_safety_protocol"),
+    "qa": ("trigger_safety_protocol",),
+}
+
+SEED_EXAMPLES: List[Tuple[str, str]] = [
+    ("I have a sore throat and a temperature", "triage"),
+    ("my ankle is swollen after football, what should I do?", "triage"),
+    ("I've had a headache for three days", "triage"),
+    ("I feel really anxious and can't sleep", "triage"),
+    ("I cut my finger and it keeps bleeding a bit", "triage"),
+    ("stomach ache and vomiting since last night", "triage"),
+    ("I have a rash on my arm that is itchy", "triage"),
+    ("is this serious? my back hurts when I bend", "triage"),
+    ("where should I go for an ear infection?", "triage"),
+    ("I think I sprained my wrist", "triage"),
+    ("my eye is red and painful", "triage"),
+    ("I'm feeling unwell with a cough and fever", "triage"),
+    ("find the nearest GP to NW1 2BU", "nearby_services"),
+    ("which A&E is closest to me?", "nearby_services"),
+    ("nearest GP practices near my postcode", "nearby_services"),
+    ("show me GP surgeries near NW8 9HU", "nearby_services"),
+    ("where is the nearest accident and emergency department", "nearby_services"),
+    ("list GPs close to my flat in E1 6AN", "nearby_services"),
+    ("can you look up local GP practices for me", "nearby_services"),
+    ("closest A&E to London Business School", "nearby_services"),
+    ("search for information about dentists for students", "search"),
+    ("can you search the NHS site for flu vaccine guidance", "search"),
+    ("find information on prescription charges", "search"),
+    ("search for LBS counselling services", "search"),
+    ("find info about the immigration health surcharge", "search"),
+    ("please search how to get a free eye test", "search"),
+    ("search for sexual health clinics guidance", "search"),
+    ("find information about NHS dental charges", "search"),
+    ("what is NHS 111?", "qa"),
+    ("how do I register with a GP?", "qa"),
+    ("what's the difference between a GP and A&E?", "qa"),
+    ("do I need to pay for prescriptions?", "qa"),
+    ("what does a pharmacist help with?", "qa"),
+    ("how does the NHS work for international students?", "qa"),
+    ("what documents do I need to see a GP?", "qa"),
+    ("can I get the flu jab at a pharmacy?", "qa"),
+    ("what wellbeing support does LBS offer?", "qa"),
+    ("when should I call 999 instead of 111?", "qa"),
+    ("how long does GP registration take?", "qa"),
+    ("what is a walk-in centre?", "qa"),
+]
+
+_TOKEN_RE = re.compile(r"[a-z0-9&']+")
+
+SparseVector = Dict[str, float]
+
+
+def _features(text: str) -> List[str]:
+    words = _TOKEN_RE.findall((text or "").lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def _normalize(vector: SparseVector) -> SparseVector:
+    norm = math.sqrt(sum(value * value for value in vector.values()))
+    if not norm:
+        return vector
+    return {key: value / norm for key, value in vector.items()}
+
+
+class IntentClassifier:
+    """TF-IDF nearest-centroid classifier with softmax confidences."""
+
+    def __init__(
+        self,
+        idf: Dict[str, float],
+        centroids: Dict[str, SparseVector],
+        temperature: float = 0.05,
+    ):
+        self.idf = idf
+        self.centroids = centroids
+        self.temperature = temperature
+
+    @classmethod
+    def fit(
+        cls, examples: Iterable[Tuple[str, str]], temperature: float = 0.05
+    ) -> "IntentClassifier":
+        examples = [(text, route) for text, route in examples if route in ROUTES]
+        if not examples:
+            raise ValueError("No labelled examples to train on.")
+        counts = [Counter(_features(text)) for text, _ in examples]
+        document_frequency: Counter = Counter()
+        for count in counts:
+            document_frequency.update(count.keys())
+        total = len(examples)
+        idf = {
+            term: math.log((1 + total) / (1 + df)) + 1.0
+            for term, df in document_frequency.items()
+        }
+
+        classifier = cls(idf, {}, temperature)
+        sums: Dict[str, SparseVector] = {}
+        for count, (_, route) in zip(counts, examples):
+            centroid = sums.setdefault(route, {})
+            for term, value in classifier._weigh(count).items():
+                centroid[term] = centroid.get(term, 0.0) + value
+        classifier.centroids = {
+            route: _normalize(vector) for route, vector in sums.items()
+        }
+        return classifier
+
+    def _weigh(self, count: Counter) -> SparseVector:
+        return _normalize(
+            {
+                term: (1.0 + math.log(tf)) * self.idf[term]
+                for term, tf in count.items()
+                if term in self.idf
+            }
+        )
+
+    def scores(self, text: str) -> Dict[str, float]:
+        """Return a probability per route."""
+        vector = self._weigh(Counter(_features(text)))
+        similarities = {
+            route: sum(value * centroid.get(term, 0.0) for term, value in vector.items())
+            for route, centroid in self.centroids.items()
+        }
+        top = max(similarities.values(), default=0.0)
+        exps = {
+            route: math.exp((similarity - top) / self.temperature)
+            for route, similarity in similarities.items()
+        }
+        total = sum(exps.values()) or 1.0
+        return {route: value / total for route, value in exps.items()}
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        scores = self.scores(text)
+        route = max(scores, key=scores.get)
+        return route, scores[route]
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "version": 1,
+            "temperature": self.temperature,
+            "idf": self.idf,
+            "centroids": self.centroids,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, object]) -> "IntentClassifier":
+        return cls(
+            idf=dict(data["idf"]),
+            centroids={route: dict(v) for route, v in dict(data["centroids"]).items()},
+            temperature=float(data.get("temperature", 0.05)),
+        )
+
+    def save(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as handle:
+            json.dump(self.to_dict(), handle)
+
+    @classmethod
+    def load(cls, path: str) -> "IntentClassifier":
+        with open(path, encoding="utf-8") as handle:
+            return cls.from_dict(json.load(handle))
+
+
+def load_turn_log(path: str) -> List[Tuple[str, str]]:
+    """Read ``{"message", "route"}`` JSONL rows written by ``IntentRouter``."""
+    examples = []
+    with open(path, encoding="utf-8") as handle:
+        for line in handle:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if row.get("routed_locally"):
+                continue
+            if row.get("message") and row.get("route") in ROUTES:
+                examples.append((row["message"], row["route"]))
+    return examples
+
+
+class IntentRouter:
+    """
+    Mode, threshold and shadow-evaluation bookkeeping around the classifier.
+    The classifier is trained from ``SEED_EXAMPLES`` on first use unless a
+    saved model path is configured.
+    """
+
+    def __init__(
+        self,
+        mode: str = "off",
+        threshold: float = 0.85,
+        model_path: Optional[str] = None,
+        log_path: Optional[str] = None,
+    ):
+        self.mode = mode if mode in {"off", "shadow", "active"} else "off"
+        self.threshold = threshold
+        self.model_path = model_path
+        self.log_path = log_path
+        self._classifier: Optional[IntentClassifier] = None
+        self._lock = Lock()
+        self.shadow_total = 0
+        self.shadow_agree = 0
+        self.confusion: Counter = Counter()
+
+    @classmethod
+    def from_env(cls) -> "IntentRouter":
+        return cls(
+            mode=os.getenv("INTENT_ROUTER_MODE", "off").strip().lower(),
+            threshold=float(os.getenv("INTENT_ROUTER_THRESHOLD", "0.85")),
+            model_path=os.getenv("INTENT_MODEL_PATH") or None,
+            log_path=os.getenv("INTENT_LOG_PATH") or None,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    @property
+    def classifier(self) -> IntentClassifier:
+        if self._classifier is None:
+            with self._lock:
+                if self._classifier is None:
+                    if self.model_path and os.path.exists(self.model_path):
+                        self._classifier = IntentClassifier.load(self.model_path)
+                    else:
+                        self._classifier = IntentClassifier.fit(SEED_EXAMPLES)
+        return self._classifier
+
+    def predict(self, text: str) -> Optional[Tuple[str, float]]:
+        if not self.enabled:
+            return None
+        return self.classifier.predict(text)
+
+    def confident(self, prediction: Optional[Tuple[str, float]]) -> Optional[str]:
+        """Return the route the caller may act on, or None."""
+        if self.mode != "active" or prediction is None:
+            return None
+        route, confidence = prediction
+        return route if confidence >= self.threshold else None
+
+    def narrow_tools(self, route: str, toolset: Sequence[Dict[str, object]]):
+        allowed = ROUTE_TOOLS.get(route)
+        if allowed is None:
+            return list(toolset)
+        return [tool for tool in toolset if tool.get("name") in allowed]
+
+    def record(
+        self,
+        message: str,
+        prediction: Optional[Tuple[str, float]],
+        actual: str,
+        acted: bool = False,
+    ) -> None:
+        """
+        Score a prediction against the route taken and append to the turn log.
+        Turns the router acted on are logged but not scored or used for
+        training, since the prediction decided the route.
+        """
+        if prediction is not None and not acted:
+            predicted = prediction[0]
+            with self._lock:
+                self.shadow_total += 1
+                self.shadow_agree += int(predicted == actual)
+                self.confusion[(predicted, actual)] += 1
+        if self.log_path:
+            row: Dict[str, object] = {"message": message, "route": actual}
+            if acted:
+                row["routed_locally"] = True
+            if prediction is not None:
+                row["predicted"] = prediction[0]
+                row["confidence"] = round(prediction[1], 4)
+            with self._lock, open(self.log_path, "a", encoding="utf-8") as handle:
+                handle.write(json.dumps(row) + "\n")
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "threshold": self.threshold,
+                "evaluated": self.shadow_total,
+                "agreement": (
+                    self.shadow_agree / self.shadow_total if self.shadow_total else None
+                ),
+                "confusion": {
+                    f"{predicted}->{actual}": count
+                    for (predicted, actual), count in sorted(self.confusion.items())
+                },
+            }
+
+
+INTENT_ROUTER = IntentRouter.from_env()
+
+
+def _evaluate(classifier: IntentClassifier, examples, threshold: float) -> None:
+    correct = covered = covered_correct = 0
+    for text, route in examples:
+        predicted, confidence = classifier.predict(text)
+        correct += int(predicted == route)
+        if confidence >= threshold:
+            covered += 1
+            covered_correct += int(predicted == route)
+    total = len(examples) or 1
+    print(f"accuracy: {correct / total:.3f} over {len(examples)} turns")
+    print(
+        f"at threshold {threshold}: coverage {covered / total:.3f}, "
+        f"precision {covered_correct / (covered or 1):.3f}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Train or evaluate the intent classifier.")
+    parser.add_argument("command", choices=["train", "eval"])
+    parser.add_argument("--log", action="append", default=[], help="JSONL turn log (repeatable).")
+    parser.add_argument("--model", help="Saved model to evaluate (eval only).")
+    parser.add_argument("--out", default="intent_model.json")
+    parser.add_argument("--no-seed", action="store_true", help="Train on logs only.")
+    parser.add_argument("--threshold", type=float, default=0.85)
+    args = parser.parse_args()
+
+    examples: List[Tuple[str, str]] = []
+    for path in args.log:
+        examples.extend(load_turn_log(path))
+
+    if args.command == "train":
+        training = examples if args.no_seed else SEED_EXAMPLES + examples
+        classifier = IntentClassifier.fit(training)
+        classifier.save(args.out)
+        print(f"trained on {len(training)} turns -> {args.out}")
+        _evaluate(classifier, training, args.threshold)
+        return
+
+    classifier = (
+        IntentClassifier.load(args.model) if args.model else IntentClassifier.fit(SEED_EXAMPLES)
+    )
+    _evaluate(classifier, examples or SEED_EXAMPLES, args.threshold)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+"""Single-pass keyword matching for safety, onboarding, search and link heuristics.
+
+Every keyword list in ``config`` is compiled once into a trie (Aho-Corasick
+style) and emitted as one regular expression, so a message is lowercased and
+scanned a single time and every matching category is reported together.
+Categories listed as fuzzy also match whole-word windows within one typo, so
+"chest pian" and "seizrue" still reach the safety path. The first word of a
+multi-word keyword must be typed exactly, and the kinds of typo allowed grow
+with word length: short words only tolerate swapped letters, because their
+other one-edit neighbours are often real words ("chest gain", "farm myself").
+"""
+
+import re
+from itertools import combinations
+from threading import local
+from types import MappingProxyType
+from typing import Dict, FrozenSet, Iterable, List, Mapping, Set, Tuple
+
+from config import (
+    ACTION_KEYWORDS,
+    ELIGIBILITY_KEYWORDS,
+    LINK_TAG_RULES,
+    ONBOARDING_TRIGGER_PHRASES,
+    RED_FLAG_KEYWORDS,
+    SEARCH_KEYWORDS,
+)
+
+_TERMINAL = ""
+_WORD_RE = re.compile(r"[a-z0-9&']+")
+_WORD_CACHE_SIZE = 4096
+
+Hits = Mapping[str, FrozenSet[str]]
+_Found = Dict[str, Set[str]]
+
+
+def _trie_pattern(node: Dict[str, dict]) -> str:
+    """Render a trie node as a regex; greedy optionals make matches longest-first."""
+    branches = [
+        re.escape(char) + _trie_pattern(child)
+        for char, child in sorted(node.items())
+        if char != _TERMINAL
+    ]
+    if not branches:
+        return ""
+    optional = _TERMINAL in node
+    if len(branches) == 1 and not optional:
+        return branches[0]
+    group = "(?:" + "|".join(branches) + ")"
+    return group + "?" if optional else group
+
+
+def _deletions(word: str, depth: int) -> Set[str]:
+    if depth == 1:
+        return {word, *(word[:i] + word[i + 1 :] for i in range(len(word)))}
+    variants = {word}
+    for count in range(1, depth + 1):
+        for positions in combinations(range(len(word)), count):
+            variants.add("".join(c for i, c in enumerate(word) if i not in positions))
+    return variants
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Optimal-string-alignment distance, returning ``limit + 1`` once exceeded."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev_prev: List[int] = []
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(prev[j] + 1, current[j - 1] + 1, prev[j - 1] + cost)
+            if (
+                i > 1
+                and j > 1
+                and a[i - 1] == b[j - 2]
+                and a[i - 2] == b[j - 1]
+            ):
+                current[j] = min(current[j], prev_prev[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        prev_prev, prev = prev, current
+    return prev[-1]
+
+
+def _fold(word: str) -> str:
+    """Drop apostrophes, so "cant breathe" is typed exactly."""
+    return word.replace("'", "")
+
+
+class KeywordMatcher:
+    """
+    Multi-category substring matcher built once from keyword lists.
+    ``scan`` reports the same categories as a plain ``keyword in text.lower()``
+    check per keyword, plus single-typo matches for fuzzy categories.
+    """
+
+    def __init__(
+        self,
+        categories: Dict[str, Iterable[str]],
+        fuzzy_categories: Iterable[str] = (),
+        max_distance: int = 1,
+        min_fuzzy_length: int = 6,
+        min_typo_word_length: int = 4,
+        min_indel_length: int = 7,
+        min_substitution_length: int = 9,
+    ):
+        self._categories: Dict[str, Set[str]] = {}
+        self._keywords: Dict[str, Tuple[str, ...]] = {}
+        for category, keywords in categories.items():
+            lowered = tuple(keyword.lower() for keyword in keywords if keyword)
+            self._keywords[category] = lowered
+            for keyword in lowered:
+                self._categories.setdefault(keyword, set()).add(category)
+
+        trie: Dict[str, dict] = {}
+        for keyword in self._categories:
+            node = trie
+            for char in keyword:
+                node = node.setdefault(char, {})
+            node[_TERMINAL] = {}
+        self._pattern = re.compile(_trie_pattern(trie)) if trie else None
+
+        # A longest match hides every keyword inside it, and any keyword that
+        # starts inside it and runs past its end (the automaton's failure
+        # links). Both are precomputed per keyword so scanning stays in C.
+        keywords = list(self._categories)
+        self._contained: Dict[str, Tuple[Tuple[str, str], ...]] = {}
+        self._resume_offsets: Dict[str, Tuple[int, ...]] = {}
+        for keyword in keywords:
+            self._contained[keyword] = tuple(
+                (category, other)
+                for other in keywords
+                if other in keyword
+                for category in self._categories[other]
+            )
+            self._resume_offsets[keyword] = tuple(
+                offset
+                for offset in range(1, len(keyword))
+                if any(
+                    len(other) > len(keyword) - offset
+                    and other.startswith(keyword[offset:])
+                    for other in keywords
+                )
+            )
+
+        # Typo tolerance works per word: each keyword word is indexed under its
+        # deletion variants (symmetric-delete lookup), and a keyword matches when
+        # consecutive message words are within ``max_distance`` edits in total
+        # and its first word, if it has several, is exact. Words shorter than
+        # ``min_typo_word_length`` ("not", "my") must match exactly; shorter than
+        # ``min_indel_length`` only a transposition is a typo, and shorter than
+        # ``min_substitution_length`` a substitution is not.
+        self.max_distance = max_distance
+        self.min_indel_length = min_indel_length
+        self.min_substitution_length = min_substitution_length
+        self._fuzzy_owners = set(fuzzy_categories)
+        self._fuzzy_keywords: Dict[str, List[Tuple[Tuple[str, ...], str, Set[str]]]] = {}
+        self._word_index: Dict[str, Set[str]] = {}
+        self._exact_words: Set[str] = set()
+        word_lengths: Set[int] = set()
+        for keyword, owners in self._categories.items():
+            owners = owners & self._fuzzy_owners
+            if not owners or len(keyword) < min_fuzzy_length:
+                continue
+            words = tuple(_fold(word) for word in keyword.split())
+            self._fuzzy_keywords.setdefault(words[0], []).append((words, keyword, owners))
+            for word in words:
+                self._exact_words.add(word)
+                if len(word) < min_typo_word_length:
+                    continue
+                word_lengths.add(len(word))
+                for variant in _deletions(word, max_distance):
+                    self._word_index.setdefault(variant, set()).add(word)
+        self._min_word = max(min_typo_word_length, min(word_lengths, default=0) - max_distance)
+        self._max_word = max(word_lengths, default=0) + max_distance
+        self._word_cache: Dict[str, Dict[str, int]] = {}
+
+        # One memo slot per thread: concurrent turns never see each other's text.
+        self._memo = local()
+
+    def scan(self, text: str, fuzzy: bool = True) -> Hits:
+        """
+        Return a read-only ``{category: matched keywords}`` for every category
+        present. The result for this thread's most recent text is reused, so
+        callers checking the same message for several categories pay for one scan.
+        """
+        text = text or ""
+        last = getattr(self._memo, "last", None)
+        if last is not None and last[0] == text and last[1] == fuzzy:
+            return last[2]
+
+        lowered = text.lower()
+        hits: _Found = {}
+        if self._pattern is not None:
+            match_at = self._pattern.match
+            for match in self._pattern.finditer(lowered):
+                keyword = match.group()
+                self._add(hits, keyword)
+                start = match.start()
+                for offset in self._resume_offsets[keyword]:
+                    crossing = match_at(lowered, start + offset)
+                    if crossing is not None:
+                        self._add(hits, crossing.group())
+
+        if fuzzy and self._fuzzy_keywords and not self._fuzzy_owners.issubset(hits):
+            self._scan_fuzzy(lowered, hits)
+
+        frozen: Hits = MappingProxyType(
+            {category: frozenset(keywords) for category, keywords in hits.items()}
+        )
+        self._memo.last = (text, fuzzy, frozen)
+        return frozen
+
+    def present(self, text: str, categories: Iterable[str]) -> Set[str]:
+        """
+        Exact check of selected categories, stopping at each category's first
+        hit. For long texts (model replies) where only a few categories matter,
+        C substring search with early exit beats a full scan.
+        """
+        found: Set[str] = set()
+        lowered = (text or "").lower()
+        if not lowered:
+            return found
+        for category in categories:
+            for keyword in self._keywords[category]:
+                if keyword in lowered:
+                    found.add(category)
+                    break
+        return found
+
+    def _add(self, hits: _Found, keyword: str) -> None:
+        for category, contained in self._contained[keyword]:
+            hits.setdefault(category, set()).add(contained)
+
+    def _scan_fuzzy(self, lowered: str, hits: _Found) -> None:
+        limit = self.max_distance
+        words = _WORD_RE.findall(_fold(lowered))
+        cache = self._word_cache
+        nearby = [
+            cache[word] if word in cache else self._close_words(word) for word in words
+        ]
+        if not any(nearby):
+            return
+
+        for start, close in enumerate(nearby):
+            if not close:
+                continue
+            for first_word, first_distance in close.items():
+                for keyword_words, keyword, owners in self._fuzzy_keywords.get(first_word, ()):
+                    if start + len(keyword_words) > len(words):
+                        continue
+                    if first_distance and len(keyword_words) > 1:
+                        continue
+                    distance = sum(
+                        nearby[start + offset].get(word, limit + 1)
+                        for offset, word in enumerate(keyword_words)
+                    )
+                    if distance <= limit:
+                        for category in owners:
+                            hits.setdefault(category, set()).add(keyword)
+
+    def _typo_allowed(self, typed: str, keyword_word: str) -> bool:
+        """Whether ``typed`` is a plausible typo of ``keyword_word`` for its length."""
+        if len(keyword_word) >= self.min_substitution_length:
+            return True
+        if len(typed) != len(keyword_word):
+            return len(keyword_word) >= self.min_indel_length
+        diffs = [i for i, (a, b) in enumerate(zip(typed, keyword_word)) if a != b]
+        return (
+            len(diffs) == 2
+            and diffs[1] == diffs[0] + 1
+            and typed[diffs[0]] == keyword_word[diffs[1]]
+            and typed[diffs[1]] == keyword_word[diffs[0]]
+        )
+
+    def _close_words(self, word: str) -> Dict[str, int]:
+        """Map a message word to nearby keyword words and their edit distances."""
+        close = self._word_cache.get(word)
+        if close is not None:
+            return close
+        close = {}
+        if word in self._exact_words:
+            close[word] = 0
+        if self._min_word <= len(word) <= self._max_word:
+            for variant in _deletions(word, self.max_distance):
+                for candidate in self._word_index.get(variant, ()):
+                    if candidate not in close and self._typo_allowed(word, candidate):
+                        close[candidate] = edit_distance(
+                            word, candidate, self.max_distance
+                        )
+        if len(self._word_cache) >= _WORD_CACHE_SIZE:
+            self._word_cache.clear()
+        self._word_cache[word] = close
+        return close
+
+
+def _default_categories() -> Dict[str, List[str]]:
+    categories: Dict[str, List[str]] = {
+        "red_flag": list(RED_FLAG_KEYWORDS),
+        "onboarding": sorted(ONBOARDING_TRIGGER_PHRASES),
+        "action": list(ACTION_KEYWORDS),
+        "search": list(SEARCH_KEYWORDS),
+        "eligibility": list(ELIGIBILITY_KEYWORDS),
+    }
+    for name, rule in LINK_TAG_RULES.items():
+        categories[f"link:{name}"] = list(rule["keywords"])
+    return categories
+
+
+KEYWORDS = KeywordMatcher(_default_categories(), fuzzy_categories=["red_flag"])
+
+
+def scan_keywords(text: str, fuzzy: bool = True) -> Hits:
+    """Scan text with the shared matcher built from the config keyword lists."""
+    return KEYWORDS.scan(text, fuzzy=fuzzy)
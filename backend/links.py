@@ -0,0 +1,200 @@
+"""Scored, indexed catalog of the resources offered as "useful links".
+
+The catalog is loaded from ``data/links.json`` (or ``LINK_CATALOG_PATH``).
+Links with the same normalised URL are merged. Each link has ``tags`` (picked
+by ``config.LINK_TAG_RULES``) and ``keywords`` (matched directly in the text;
+a trailing ``*`` makes a keyword a prefix). Both go into one inverted index
+of postings. All keywords compile into one trie-shaped regular expression,
+so ``top_k`` costs one scan per text plus dictionary lookups for the terms
+that matched, however large the catalog.
+
+Scores add up ``idf`` for each matching tag, twice that for each keyword in
+the user message, and once more for a keyword in the reply. The total is
+scaled by the link's ``weight``. ``LINK_CATALOG`` re-reads the file when its
+mtime changes (checked at most every ``LINK_CATALOG_RELOAD_SECONDS``), so
+edits go live without a restart.
+"""
+
+import heapq
+import json
+import math
+import os
+import re
+import time
+from threading import Lock
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+from keywords import _TERMINAL, _trie_pattern
+
+DEFAULT_LINKS_PATH = os.path.join(os.path.dirname(__file__), "data", "links.json")
+USER_KEYWORD_SCORE = 2.0
+REPLY_KEYWORD_SCORE = 1.0
+TAG_SCORE = 1.0
+
+Link = Dict[str, str]
+
+
+def normalize_url(url: str) -> str:
+    parts = urlsplit(url.strip())
+    path = parts.path.rstrip("/")
+    return f"{parts.scheme.lower()}://{parts.netloc.lower()}{path}"
+
+
+def _keyword_pattern(keyword: str) -> str:
+    if keyword.endswith("*"):
+        return r"\b" + re.escape(keyword[:-1])
+    return r"\b" + re.escape(keyword) + r"(?![a-z0-9])"
+
+
+class LinkCatalog:
+    """Deduplicated links plus tag and keyword postings for scoring."""
+
+    def __init__(self, data: Dict[str, Any]):
+        self.version = str(data.get("version") or "")
+        self.links: List[Link] = []
+        self.weights: List[float] = []
+        by_url: Dict[str, int] = {}
+        tag_postings: Dict[str, Set[int]] = {}
+        keyword_postings: Dict[str, Set[int]] = {}
+
+        for entry in data.get("links") or []:
+            title, url = entry.get("title"), entry.get("url")
+            if not title or not url:
+                raise ValueError(f"Link entries need a title and url: {entry!r}")
+            key = normalize_url(url)
+            idx = by_url.get(key)
+            if idx is None:
+                idx = by_url[key] = len(self.links)
+                self.links.append({"title": title, "url": url})
+                self.weights.append(float(entry.get("weight", 1.0)))
+            for tag in entry.get("tags") or []:
+                tag_postings.setdefault(tag.lower(), set()).add(idx)
+            for keyword in entry.get("keywords") or []:
+                keyword_postings.setdefault(keyword.lower(), set()).add(idx)
+
+        total = max(1, len(self.links))
+
+        def weighted(postings: Dict[str, Set[int]], score: float) -> Dict[str, Tuple[Tuple[int, float], ...]]:
+            return {
+                term: tuple((idx, score * (1.0 + math.log(total / len(ids)))) for idx in sorted(ids))
+                for term, ids in postings.items()
+            }
+
+        self._tag_index = weighted(tag_postings, TAG_SCORE)
+        self._keyword_index = weighted(keyword_postings, 1.0)
+
+        # Keyword stems go into one trie-shaped regex that finds the longest
+        # stem at each word start (overlapping, via lookahead). Shorter
+        # keywords at the same start, and word-end checks, are then confirmed
+        # with each keyword's own pattern.
+        by_stem: Dict[str, List[str]] = {}
+        for keyword in self._keyword_index:
+            by_stem.setdefault(keyword.rstrip("*"), []).append(keyword)
+        stems = list(by_stem)
+        self._keyword_patterns = {
+            keyword: re.compile(_keyword_pattern(keyword)) for keyword in self._keyword_index
+        }
+        self._candidates: Dict[str, Tuple[str, ...]] = {
+            stem: tuple(
+                keyword for end in range(len(stem), 0, -1) for keyword in by_stem.get(stem[:end], ())
+            )
+            for stem in stems
+        }
+        trie: Dict[str, dict] = {}
+        for stem in stems:
+            node = trie
+            for char in stem:
+                node = node.setdefault(char, {})
+            node[_TERMINAL] = {}
+        self._pattern = re.compile(r"\b(?=(" + _trie_pattern(trie) + "))") if trie else None
+
+        self.fallback: List[Link] = []
+        for url in data.get("fallback") or []:
+            idx = by_url.get(normalize_url(url))
+            if idx is None:
+                raise ValueError(f"Fallback link {url!r} is not in the catalog.")
+            self.fallback.append(self.links[idx])
+
+    @classmethod
+    def load(cls, path: str) -> "LinkCatalog":
+        with open(path, "r", encoding="utf-8") as handle:
+            return cls(json.load(handle))
+
+    def keywords_in(self, text: str) -> Set[str]:
+        if self._pattern is None or not text:
+            return set()
+        lowered = text.lower()
+        found: Set[str] = set()
+        for match in self._pattern.finditer(lowered):
+            start = match.start()
+            for keyword in self._candidates[match.group(1)]:
+                if keyword not in found and self._keyword_patterns[keyword].match(lowered, start):
+                    found.add(keyword)
+        return found
+
+    def top_k(
+        self,
+        tags: Iterable[str] = (),
+        user_text: str = "",
+        reply_text: str = "",
+        k: int = 4,
+    ) -> List[Link]:
+        """Best ``k`` links by score; ties keep catalog order. Empty if nothing matched."""
+        scores: Dict[int, float] = {}
+        for tag in tags:
+            for idx, score in self._tag_index.get(tag, ()):
+                scores[idx] = scores.get(idx, 0.0) + score
+        for text, factor in ((user_text, USER_KEYWORD_SCORE), (reply_text, REPLY_KEYWORD_SCORE)):
+            for keyword in self.keywords_in(text):
+                for idx, score in self._keyword_index[keyword]:
+                    scores[idx] = scores.get(idx, 0.0) + score * factor
+        best = heapq.nlargest(k, scores.items(), key=lambda item: (item[1] * self.weights[item[0]], -item[0]))
+        return [dict(self.links[idx]) for idx, _ in best]
+
+
+class ReloadingLinkCatalog:
+    """Serves a ``LinkCatalog`` and swaps in a new one when its file changes."""
+
+    def __init__(self, path: str = DEFAULT_LINKS_PATH, check_seconds: float = 5.0):
+        self.path = path
+        self.check_seconds = check_seconds
+        self._catalog: Optional[LinkCatalog] = None
+        self._mtime = 0.0
+        self._checked_at = 0.0
+        self._lock = Lock()
+        self.reload_errors = 0
+
+    @classmethod
+    def from_env(cls) -> "ReloadingLinkCatalog":
+        return cls(
+            path=os.getenv("LINK_CATALOG_PATH") or DEFAULT_LINKS_PATH,
+            check_seconds=float(os.getenv("LINK_CATALOG_RELOAD_SECONDS", "5")),
+        )
+
+    def current(self) -> LinkCatalog:
+        now = time.monotonic()
+        if self._catalog is not None and now - self._checked_at < self.check_seconds:
+            return self._catalog
+        with self._lock:
+            if self._catalog is None or now - self._checked_at >= self.check_seconds:
+                self._checked_at = now
+                self._reload_if_changed()
+        return self._catalog
+
+    def _reload_if_changed(self) -> None:
+        try:
+            mtime = os.path.getmtime(self.path)
+            if self._catalog is not None and mtime == self._mtime:
+                return
+            catalog = LinkCatalog.load(self.path)
+        except (OSError, ValueError):
+            # Keep serving the last good catalog while the file is fixed.
+            if self._catalog is None:
+                raise
+            self.reload_errors += 1
+            return
+        self._catalog, self._mtime = catalog, mtime
+
+
+LINK_CATALOG = ReloadingLinkCatalog.from_env()
@@ -0,0 +1,218 @@
+"""Single entry point for Responses API calls made by the agent and tools.
+
+Every call site names itself (``"step.first"``, ``"tool.guided_search"``, ...)
+so traces and the usage ledger can attribute latency, tokens and cost to the
+code that made the call. Token budgets are enforced here as well.
+
+The model, fallback model, timeout and output budget of each call site come
+from ``call_sites.CALL_SITE_REGISTRY`` unless the caller passes them. A call
+that times out or hits a server error is retried once on the fallback model.
+Calls queue by priority in ``scheduler.SCHEDULER`` when too many are in flight.
+
+A turn can be made cancellable with ``cancellable(event)``. Once the event is
+set, the next call raises ``TurnCancelled`` and so does any call that is
+still in flight when it returns. Its usage is still recorded, but the agent
+does nothing more with it.
+
+Passing ``on_text`` streams the call: output text deltas are handed to it as
+they arrive and the completed response is returned as usual. Streamed calls
+get their call site's full output cap, since text already shown cannot be
+retried at a larger budget.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Event
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from openai import APIConnectionError, InternalServerError
+
+from call_sites import CALL_SITE_REGISTRY
+from config import CHEAPER_MODEL, OPTIONAL_CALL_SITES
+from scheduler import SCHEDULER, effective_priority
+from tracing import span
+from usage import LEDGER, BudgetExceeded
+
+_cancel_event: ContextVar[Optional[Event]] = ContextVar("evi_cancel_event", default=None)
+
+
+class TurnCancelled(BaseException):
+    """
+    The turn's cancel event was set. A BaseException, like
+    asyncio.CancelledError, so the agent's ``except Exception`` fallbacks
+    do not swallow it and carry on making calls.
+    """
+
+
+@contextmanager
+def cancellable(event: Event) -> Iterator[Event]:
+    """Model calls made inside the block (and in tool threads it starts) stop once ``event`` is set."""
+    token = _cancel_event.set(event)
+    try:
+        yield event
+    finally:
+        _cancel_event.reset(token)
+
+
+def raise_if_cancelled() -> None:
+    event = _cancel_event.get()
+    if event is not None and event.is_set():
+        raise TurnCancelled()
+
+
+def usage_of(response: Any) -> Dict[str, int]:
+    """Input, cached and output token counts from a response (zeros if absent)."""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return {"input_tokens": 0, "cached_tokens": 0, "output_tokens": 0}
+    details = getattr(usage, "input_tokens_details", None)
+    return {
+        "input_tokens": int(getattr(usage, "input_tokens", 0) or 0),
+        "cached_tokens": int(getattr(details, "cached_tokens", 0) or 0),
+        "output_tokens": int(getattr(usage, "output_tokens", 0) or 0),
+    }
+
+
+def _truncated(response: Any) -> bool:
+    details = getattr(response, "incomplete_details", None)
+    return getattr(response, "status", None) == "incomplete" and (
+        getattr(details, "reason", None) == "max_output_tokens"
+    )
+
+
+def _collect_stream(events: Any, on_text: Callable[[str], None]) -> Any:
+    """
+    Hand a streamed response's text deltas to ``on_text`` and return the final
+    response. Clients that answer ``stream=True`` with a whole response (test
+    stubs, cassette replays) deliver its text as a single delta.
+    """
+    if hasattr(events, "output"):
+        if events.output_text:
+            on_text(events.output_text)
+        return events
+    response = None
+    try:
+        for event in events:
+            raise_if_cancelled()
+            kind = getattr(event, "type", None)
+            if kind == "response.output_text.delta":
+                on_text(event.delta)
+            elif kind in {"response.completed", "response.incomplete", "response.failed"}:
+                response = event.response
+    finally:
+        close = getattr(events, "close", None)
+        if close is not None:
+            close()
+    if response is None:
+        raise APIConnectionError(message="Response stream ended early.", request=None)
+    return response
+
+
+def _send(client: Any, kwargs: Dict[str, Any], on_text: Optional[Callable[[str], None]]) -> Any:
+    if on_text is None:
+        return client.responses.create(**kwargs)
+    return _collect_stream(client.responses.create(stream=True, **kwargs), on_text)
+
+
+def _output_kind(response: Any) -> str:
+    items = getattr(response, "output", None) or []
+    return "tool_call" if any(getattr(item, "type", None) == "function_call" for item in items) else "text"
+
+
+def create_response(
+    client: Any,
+    call_site: str,
+    attempt: int = 0,
+    on_text: Optional[Callable[[str], None]] = None,
+    **kwargs: Any,
+):
+    """
+    Call ``client.responses.create`` inside a span for ``call_site`` and record
+    its usage. Over budget, optional call sites raise ``BudgetExceeded`` and
+    other calls move to their fallback (or cheaper) model. With ``on_text``
+    the call is streamed and its text deltas are passed on as they arrive.
+    """
+    raise_if_cancelled()
+    site = CALL_SITE_REGISTRY.get(call_site)
+    retry_cap: Optional[int] = None
+    if site is not None:
+        kwargs.setdefault("model", site.model)
+        if site.timeout:
+            kwargs.setdefault("timeout", site.timeout)
+        if on_text is not None and site.max_output_tokens:
+            kwargs.setdefault("max_output_tokens", site.max_output_tokens)
+        budget = CALL_SITE_REGISTRY.output_budget(call_site)
+        if budget and "max_output_tokens" not in kwargs:
+            kwargs["max_output_tokens"] = budget
+            # An adaptive budget below the cap gets one retry at the cap if it cuts a reply off.
+            if site.max_output_tokens and budget < site.max_output_tokens:
+                retry_cap = site.max_output_tokens
+    model = kwargs.get("model", "")
+    fallback = site.fallback if site is not None and site.fallback != model else None
+    fallback = fallback or CHEAPER_MODEL.get(model)
+    downgraded = False
+    if LEDGER.over_budget():
+        if call_site in OPTIONAL_CALL_SITES:
+            LEDGER.note_degraded(skipped=True)
+            raise BudgetExceeded(f"Token budget exceeded; skipped {call_site}.")
+        if fallback:
+            model = kwargs["model"] = fallback
+            fallback = None
+            downgraded = True
+            LEDGER.note_degraded(skipped=False)
+
+    priority = effective_priority(site.priority if site is not None else None)
+    attributes = {
+        "llm.model": model,
+        "llm.attempt": attempt,
+        "llm.downgraded": downgraded,
+        "llm.priority": priority,
+        "llm.streamed": on_text is not None,
+    }
+    with span(f"llm.{call_site}", **attributes) as current:
+        with SCHEDULER.slot(priority) as waited:
+            if current is not None:
+                current.set(**{"llm.queue_ms": round(waited * 1000, 2)})
+            raise_if_cancelled()
+            try:
+                response = _send(client, kwargs, on_text)
+            except (APIConnectionError, InternalServerError) as exc:
+                if not fallback:
+                    raise
+                raise_if_cancelled()
+                if current is not None:
+                    current.set(
+                        **{
+                            "llm.model": fallback,
+                            "llm.fallback_from": model,
+                            "llm.fallback_error": type(exc).__name__,
+                        }
+                    )
+                model = kwargs["model"] = fallback
+                response = _send(client, kwargs, on_text)
+        usage = usage_of(response)
+        cost = LEDGER.record(call_site, model, **usage)
+        truncated = _truncated(response)
+        CALL_SITE_REGISTRY.observe(
+            call_site, usage["output_tokens"], truncated=truncated, kind=_output_kind(response)
+        )
+        if truncated and retry_cap:
+            raise_if_cancelled()
+            kwargs["max_output_tokens"] = retry_cap
+            if current is not None:
+                current.set(**{"llm.truncated_retry": True})
+            with SCHEDULER.slot(priority):
+                response = client.responses.create(**kwargs)
+            retried = usage_of(response)
+            cost += LEDGER.record(call_site, model, **retried)
+            CALL_SITE_REGISTRY.observe(
+                call_site, retried["output_tokens"], truncated=_truncated(response), kind=_output_kind(response)
+            )
+            usage = {key: usage[key] + retried[key] for key in usage}
+        if current is not None:
+            current.set(**{f"llm.{key}": value for key, value in usage.items()})
+            current.set(**{"llm.cost_usd": round(cost, 6)})
+            if kwargs.get("max_output_tokens"):
+                current.set(**{"llm.max_output_tokens": kwargs["max_output_tokens"]})
+        raise_if_cancelled()
+        return response
@@ -1,33 +1,92 @@
 """FastAPI service exposing the Evi agent for the frontend."""
 
+import asyncio
+import copy
+import hashlib
+import io
+import itertools
+import json
 import os
+import re
+import secrets
+import tempfile
+import time
 import uuid
-from threading import Lock
-from typing import Any, Dict, List, Optional
+from contextlib import asynccontextmanager
+from threading import Event, Lock
+from typing import Any, Callable, Dict, List, Optional
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
 
+import agent
 from agent import AgentSession
+from call_sites import CALL_SITE_REGISTRY
+from cassettes import CASSETTE
+from cohort_import import import_csv
+from llm import TurnCancelled, cancellable
+from profiles import PROFILE_CLAIM_SECRET, PROFILE_STORE, build_profile, valid_claim
+from profiling import PROFILE_HEADER, PROFILE_ID_HEADER, PROFILER
+from ratelimit import RATE_LIMITER, RateLimited
+from scheduler import SCHEDULER
+from streaming import streaming_reply
+from tool_registry import TOOL_REGISTRY
+from tracing import (
+    DEBUG_HEADER,
+    annotate,
+    export,
+    span,
+    start_trace,
+    tracing_wanted,
+)
+from usage import LEDGER
 
 
 class ChatRequest(BaseModel):
     message: str
     session_id: Optional[str] = None
+    known_versions: Optional[Dict[str, int]] = None
 
 
 class ChatResponse(BaseModel):
     session_id: str
     reply: str
-    prompt_suggestions: List[str]
-    useful_links: List[Dict[str, str]]
-    user_profile: Dict[str, Any]
+    # Omitted when the request's known_versions already has the current version.
+    prompt_suggestions: Optional[List[str]] = None
+    useful_links: Optional[List[Dict[str, str]]] = None
+    user_profile: Optional[Dict[str, Any]] = None
     triage_active: bool
     triage_notice: str
+    versions: Dict[str, int]
+    trace: Optional[Dict[str, Any]] = None
+
+
+class ProfileRequest(BaseModel):
+    profile: Dict[str, Any]
+
+
+class ProfileResponse(BaseModel):
+    session_id: str
+    user_profile: Dict[str, Any]
+    summary: str
+
 
+class ClaimRequest(BaseModel):
+    student_id: str
+    claim_token: str
 
-app = FastAPI(title="Evi Healthcare Companion API")
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    yield
+    _flush_histories()
+    CASSETTE.save()
+
+
+app = FastAPI(title="Evi Healthcare Companion API", lifespan=lifespan)
 
 TRIAGE_NOTICE = (
     "Note: This triage is experimental and not medical advice. "
@@ -40,6 +99,10 @@ allowed_origins = [
     if origin.strip()
 ]
 
+RESPONSE_GZIP_MIN_BYTES = int(os.getenv("RESPONSE_GZIP_MIN_BYTES", "1000"))
+if RESPONSE_GZIP_MIN_BYTES > 0:
+    app.add_middleware(GZipMiddleware, minimum_size=RESPONSE_GZIP_MIN_BYTES)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=allowed_origins,
@@ -51,14 +114,60 @@ app.add_middleware(
 _sessions: Dict[str, AgentSession] = {}
 _session_lock = Lock()
 
+# Operator-only endpoints (cohort import) need ADMIN_TOKEN in this header, and
+# debug traces in theirs; with no ADMIN_TOKEN set they are refused.
+ADMIN_HEADER = "X-Evi-Admin-Token"
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "").strip()
+IMPORT_MAX_WORKERS = max(1, min(4, os.cpu_count() or 1))
+IMPORT_MAX_BATCH_SIZE = 10_000
+
+
+HISTORY_ARCHIVE_DIR = os.getenv("HISTORY_ARCHIVE_DIR", "").strip()
+
+# Versions come from one clock-seeded counter, so a version a client holds
+# never matches a different value from another session or a restarted server.
+_version_counter = itertools.count(time.time_ns() // 1000)
+
+
+def _history_archive_path(session_id: str) -> Optional[str]:
+    if not HISTORY_ARCHIVE_DIR:
+        return None
+    safe_id = re.sub(r"[^A-Za-z0-9_-]", "_", session_id)
+    # The hash keeps ids that sanitise alike ("a.b", "a_b") in separate files.
+    digest = hashlib.sha256(session_id.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(HISTORY_ARCHIVE_DIR, f"{safe_id}-{digest}.jsonl.gz")
+
+
+def _flush_histories() -> None:
+    """Archive every session's last partial batch of evicted messages."""
+    with _session_lock:
+        sessions = list(_sessions.values())
+    for session in sessions:
+        session.conversation_history.flush()
+
+
+def _find_session(session_id: Optional[str]) -> Optional[AgentSession]:
+    with _session_lock:
+        return _sessions.get(session_id) if session_id else None
+
 
 def _get_or_create_session(session_id: Optional[str]) -> (str, AgentSession):
     with _session_lock:
         if session_id and session_id in _sessions:
             return session_id, _sessions[session_id]
         new_id = session_id or str(uuid.uuid4())
-        _sessions[new_id] = AgentSession()
-        return new_id, _sessions[new_id]
+        session = AgentSession(history_archive_path=_history_archive_path(new_id))
+        _sessions[new_id] = session
+        return new_id, session
+
+
+def _is_admin(token: Optional[str]) -> bool:
+    return bool(ADMIN_TOKEN and token and secrets.compare_digest(token.strip(), ADMIN_TOKEN))
+
+
+def _require_admin(token: Optional[str]) -> None:
+    if not _is_admin(token):
+        raise HTTPException(status_code=403, detail="Admin token required.")
 
 
 @app.get("/api/health")
@@ -66,30 +175,332 @@ def health_check() -> Dict[str, str]:
     return {"status": "ok"}
 
 
-@app.post("/api/chat", response_model=ChatResponse)
-def chat(payload: ChatRequest) -> ChatResponse:
-    if not os.getenv("OPENAI_API_KEY"):
+@app.get("/api/usage")
+def usage_report(
+    session_id: Optional[str] = None,
+    admin_token: Optional[str] = Header(default=None, alias=ADMIN_HEADER),
+) -> Dict[str, Any]:
+    if session_id:
+        # Per-session totals reveal a student's activity; aggregates stay open for monitoring.
+        _require_admin(admin_token)
+    report = LEDGER.snapshot()
+    report["call_sites"] = CALL_SITE_REGISTRY.snapshot()
+    report["scheduler"] = SCHEDULER.snapshot()
+    report["tools"] = TOOL_REGISTRY.snapshot()
+    if session_id:
+        with _session_lock:
+            session = _sessions.get(session_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail="Unknown session.")
+        report["session"] = {
+            "session_id": session_id,
+            **session.usage.as_dict(),
+            "over_budget": LEDGER.over_budget(session.usage),
+        }
+    return report
+
+
+def _client_ip(request: Request) -> Optional[str]:
+    return request.client.host if request.client else None
+
+
+def _check_rate_limit(turn_class: str, session_id: Optional[str], client_ip: Optional[str]) -> None:
+    """Raise a 429 with Retry-After when the session's or client's bucket is empty."""
+    try:
+        RATE_LIMITER.check(turn_class, session_id, client_ip)
+    except RateLimited as exc:
+        raise HTTPException(
+            status_code=429, detail=str(exc), headers={"Retry-After": str(exc.retry_after)}
+        ) from exc
+
+
+def _turn_class(session: Optional[AgentSession], message: str) -> str:
+    if session is None:
+        return "cheap" if agent.is_deterministic_message(message) else "llm"
+    return "cheap" if session.is_deterministic_turn(message) else "llm"
+
+
+@app.post("/api/chat", response_model=ChatResponse, response_model_exclude_none=True)
+def chat(
+    payload: ChatRequest,
+    request: Request,
+    response: Response,
+    debug_trace: Optional[str] = Header(default=None, alias=DEBUG_HEADER),
+    profile_token: Optional[str] = Header(default=None, alias=PROFILE_HEADER),
+) -> ChatResponse:
+    if agent.client is None:
+        raise HTTPException(status_code=500, detail="OPENAI_API_KEY is not configured.")
+
+    client_ip = _client_ip(request)
+    with PROFILER.turn(profile_token) as profile:
+        # The inline waterfall exposes internals, so the header must carry ADMIN_TOKEN.
+        chat_response = _traced_chat_turn(payload, client_ip, _is_admin(debug_trace))
+        if profile is not None:
+            profile.session_id = chat_response.session_id
+            response.headers[PROFILE_ID_HEADER] = profile.turn_id
+    return chat_response
+
+
+def _traced_chat_turn(payload: ChatRequest, client_ip: Optional[str], debug: bool) -> ChatResponse:
+    if not tracing_wanted(debug):
+        return _chat_turn(payload, client_ip)
+
+    trace = None
+    try:
+        with start_trace("POST /api/chat") as trace:
+            response = _chat_turn(payload, client_ip)
+    finally:
+        if trace is not None:
+            export(trace)
+    if debug:
+        response.trace = trace.waterfall()
+    return response
+
+
+@app.post("/api/sessions/{session_id}/profile", response_model=ProfileResponse)
+def submit_profile(session_id: str, payload: ProfileRequest, request: Request) -> ProfileResponse:
+    """Save a whole onboarding profile in one request instead of a chat per answer."""
+    if agent.client is None:
         raise HTTPException(status_code=500, detail="OPENAI_API_KEY is not configured.")
+    _check_rate_limit("cheap", session_id, _client_ip(request))
+    profile, errors = build_profile(payload.profile)
+    if errors:
+        raise HTTPException(status_code=422, detail={"errors": errors})
+    session_id, session = _get_or_create_session(session_id)
+    summary = session.submit_onboarding_profile(profile)
+    return ProfileResponse(session_id=session_id, user_profile=session.user_profile, summary=summary)
+
+
+@app.post("/api/sessions/{session_id}/claim", response_model=ProfileResponse)
+def claim_profile(session_id: str, payload: ClaimRequest, request: Request) -> ProfileResponse:
+    """Attach an imported cohort profile to this session, given the student's claim token."""
+    if agent.client is None:
+        raise HTTPException(status_code=500, detail="OPENAI_API_KEY is not configured.")
+    _check_rate_limit("cheap", session_id, _client_ip(request))
+    student_id = payload.student_id.strip()
+    profile = PROFILE_STORE.get(student_id) if valid_claim(student_id, payload.claim_token, PROFILE_CLAIM_SECRET) else None
+    if profile is None:
+        # One answer for a bad token and an unknown student, so ids cannot be probed.
+        raise HTTPException(status_code=403, detail="Invalid claim.")
+    session_id, session = _get_or_create_session(session_id)
+    summary = session.submit_onboarding_profile(profile)
+    return ProfileResponse(session_id=session_id, user_profile=session.user_profile, summary=summary)
+
+
+@app.post("/api/profiles/import")
+async def import_profiles(
+    request: Request,
+    workers: int = Query(1, ge=1, le=IMPORT_MAX_WORKERS),
+    batch_size: int = Query(1000, ge=1, le=IMPORT_MAX_BATCH_SIZE),
+    admin_token: Optional[str] = Header(default=None, alias=ADMIN_HEADER),
+) -> Dict[str, Any]:
+    """Import a cohort CSV (request body) into the profile store; see cohort_import."""
+    _require_admin(admin_token)
+    # Spool the upload (to disk past 1 MB) so rows are read back one at a time.
+    with tempfile.SpooledTemporaryFile(max_size=1 << 20) as spool:
+        async for chunk in request.stream():
+            spool.write(chunk)
+        spool.seek(0)
+        lines = io.TextIOWrapper(spool, encoding="utf-8-sig", newline="")
+        try:
+            report = await run_in_threadpool(
+                import_csv, lines, PROFILE_STORE, batch_size, workers
+            )
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc)) from exc
+    return report.as_dict()
+
+
+@app.websocket("/api/chat/ws")
+async def chat_socket(websocket: WebSocket, session_id: Optional[str] = None) -> None:
+    """
+    One connection per conversation. Clients send ``{"type": "message",
+    "message": ...}`` or ``{"type": "cancel"}``; the server pushes events.
+    A new message or a disconnect cancels the turn in flight.
+    """
+    await websocket.accept()
+    if agent.client is None:
+        await websocket.send_json({"type": "error", "detail": "OPENAI_API_KEY is not configured."})
+        await websocket.close(code=1011)
+        return
+    session_id, session = _get_or_create_session(session_id)
+    client_ip = websocket.client.host if websocket.client else None
+    await websocket.send_json({"type": "session", "session_id": session_id})
+
+    # Versions this connection has already delivered, so unchanged fields are not resent.
+    sent_versions: Dict[str, int] = {}
+    turn: Optional[asyncio.Task] = None
+    cancel = Event()
+    try:
+        while True:
+            try:
+                data = json.loads(await websocket.receive_text())
+            except ValueError:
+                data = None
+            if not isinstance(data, dict):
+                await websocket.send_json({"type": "error", "detail": "Expected a JSON object."})
+                continue
+            message = str(data.get("message") or "").strip()
+            if data.get("type", "message") != "cancel" and message:
+                # Checked before cancelling, so a refused message leaves the turn running.
+                try:
+                    RATE_LIMITER.check(_turn_class(session, message), session_id, client_ip)
+                except RateLimited as exc:
+                    await websocket.send_json(
+                        {"type": "error", "detail": str(exc), "retry_after": exc.retry_after}
+                    )
+                    continue
+            if turn is not None and not turn.done():
+                cancel.set()
+                await turn
+            if data.get("type", "message") == "cancel":
+                continue
+            if not message:
+                await websocket.send_json({"type": "error", "detail": "Message cannot be empty."})
+                continue
+            known_versions = data.get("known_versions")
+            if isinstance(known_versions, dict):
+                sent_versions.update(known_versions)
+            cancel = Event()
+            turn = asyncio.create_task(
+                _socket_turn(websocket, session_id, session, message, sent_versions, cancel)
+            )
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # However the loop ends, the turn in flight must not outlive the connection.
+        cancel.set()
+
+
+def _cancellable_step(
+    session: AgentSession,
+    message: str,
+    cancel: Event,
+    sink: Optional[Callable[[str], None]] = None,
+) -> str:
+    with cancellable(cancel), streaming_reply(sink):
+        return session.step(message)
+
+
+async def _socket_turn(
+    websocket: WebSocket,
+    session_id: str,
+    session: AgentSession,
+    message: str,
+    sent_versions: Dict[str, int],
+    cancel: Event,
+) -> None:
+    CASSETTE.record_turn(session_id, message)
+    await websocket.send_json({"type": "turn.started"})
+
+    # The step thread hands clean reply text to the loop; None marks its end.
+    loop = asyncio.get_running_loop()
+    deltas: asyncio.Queue = asyncio.Queue()
+
+    def sink(text: Optional[str]) -> None:
+        loop.call_soon_threadsafe(deltas.put_nowait, text)
+
+    def run_step() -> str:
+        try:
+            return _cancellable_step(session, message, cancel, sink)
+        finally:
+            sink(None)
+
+    step = asyncio.ensure_future(run_in_threadpool(run_step))
+    try:
+        while (text := await deltas.get()) is not None:
+            if not cancel.is_set():
+                await websocket.send_json({"type": "reply.delta", "text": text})
+    except (WebSocketDisconnect, RuntimeError):
+        cancel.set()
+    try:
+        reply = await step
+    except TurnCancelled:
+        events = [{"type": "turn.cancelled"}]
+    except Exception as exc:
+        events = [{"type": "error", "detail": f"Agent error: {exc}"}]
+    else:
+        fields = {
+            "prompt_suggestions": session.prompt_suggestions,
+            "useful_links": session.last_useful_links,
+            "user_profile": session.user_profile,
+        }
+        versions = _versioned_fields(session, fields, sent_versions)
+        sent_versions.update(versions)
+        events = [{"type": "reply", "text": reply}]
+        events += [
+            {"type": field, "value": value, "version": versions[field]}
+            for field, value in fields.items()
+            if value is not None
+        ]
+        events.append(
+            {
+                "type": "triage",
+                "active": session.triage_active,
+                "notice": TRIAGE_NOTICE if session.triage_active else "",
+            }
+        )
+        events.append({"type": "turn.done", "versions": versions})
+    if cancel.is_set() and events[0]["type"] != "turn.cancelled":
+        # Finished just as it was cancelled; the client has moved on.
+        return
+    try:
+        for event in events:
+            await websocket.send_json(event)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
 
-    session_id, session = _get_or_create_session(payload.session_id)
 
+def _versioned_fields(
+    session: AgentSession, values: Dict[str, Any], known_versions: Optional[Dict[str, int]]
+) -> Dict[str, int]:
+    """
+    Bump each field's version when its value changed since the last response
+    and drop (set to None) the fields the client already holds at that version.
+    """
+    versions = {}
+    with _session_lock:
+        for field, value in list(values.items()):
+            version, last_sent = session.response_versions.get(field, (0, None))
+            if not version or last_sent != value:
+                version = next(_version_counter)
+                session.response_versions[field] = (version, copy.deepcopy(value))
+            versions[field] = version
+            if known_versions and known_versions.get(field) == version:
+                values[field] = None
+    return versions
+
+
+def _chat_turn(payload: ChatRequest, client_ip: Optional[str] = None) -> ChatResponse:
     message = payload.message.strip()
     if not message:
         raise HTTPException(status_code=400, detail="Message cannot be empty.")
+    # Checked before a session is created, so refused requests leave none behind.
+    # Without a session_id only the client's IP bucket applies.
+    existing = _find_session(payload.session_id)
+    _check_rate_limit(_turn_class(existing, message), payload.session_id, client_ip)
+    with span("session.lookup"):
+        session_id, session = _get_or_create_session(payload.session_id)
+    annotate(session_id=session_id)
 
+    CASSETTE.record_turn(session_id, message)
     try:
-        reply = session.step(message)
+        with span("agent.step"):
+            reply = session.step(message)
     except Exception as exc:
         raise HTTPException(status_code=500, detail=f"Agent error: {exc}") from exc
 
+    fields = {
+        "prompt_suggestions": session.prompt_suggestions,
+        "useful_links": session.last_useful_links,
+        "user_profile": session.user_profile,
+    }
+    versions = _versioned_fields(session, fields, payload.known_versions)
     return ChatResponse(
         session_id=session_id,
         reply=reply,
-        prompt_suggestions=session.prompt_suggestions,
-        useful_links=session.last_useful_links,
-        user_profile=session.user_profile,
         triage_active=session.triage_active,
         triage_notice=TRIAGE_NOTICE if session.triage_active else "",
+        versions=versions,
+        **fields,
     )
-
-
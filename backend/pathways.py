@@ -0,0 +1,274 @@
+"""Local NHS 111 style decision graphs that route common presentations offline.
+
+Pathways are versioned JSON (``data/nhs111_pathways.json`` by default). Each
+pathway has entry phrases, question nodes with answer-driven branches, and
+outcome nodes carrying a ``severity_level`` and ``suggested_service``. Global
+red flags are checked first and route straight to an emergency outcome.
+
+``PathwayGraph.evaluate`` returns the same FORM A / FORM B dicts as
+``tools.nhs_111_live_triage``. It returns None when no pathway covers the
+presentation, and the caller falls back to the model. The answers come from
+the model's own triage questions, so an answered node with no matching branch
+says nothing about that node's question: the walk goes on through ``default``
+to find a later branch that does match, but an outcome reached through
+``default`` is never returned (None instead).
+
+Red flags, and branch phrases that carry their own negation ("not healing",
+"can't put weight"), are matched against the whole text. Other phrases are
+matched after negated clauses ("no fever", "not dizzy") are removed. Entry
+phrases must match whole words, so "uti" does not enter on "routine"; branch
+phrases must start on a word boundary, so "wheez" still matches "wheezing".
+
+``TRIAGE_PATHWAYS_MODE`` is ``off`` (default) or ``on``; ``TRIAGE_PATHWAYS_PATH``
+points at another pathway file.
+"""
+
+import json
+import os
+import re
+from threading import Lock
+from typing import Any, Dict, List, Optional, Pattern, Set, Tuple
+
+from keywords import KeywordMatcher
+
+DEFAULT_PATHWAYS_PATH = os.path.join(os.path.dirname(__file__), "data", "nhs111_pathways.json")
+SEVERITY_LEVELS = ("low", "medium", "high", "emergency")
+SERVICES = ("A&E", "GP", "NHS_111", "PHARMACY_SELFCARE", "MENTAL_HEALTH_CRISIS")
+LOOKUP_SERVICES = {"GP", "A&E"}
+
+# "no fever", "not dizzy", "haven't been sick": drop the clause up to the next
+# punctuation or conjunction so its symptom words do not take a branch.
+_NEGATED_RE = re.compile(
+    r"\b(?:no|not|never|without|haven't|hasn't|isn't|don't|doesn't|didn't)\b"
+    r"(?:(?!\b(?:and|but)\b)[^,.;!?\n])*"
+)
+_NEGATION_WORD_RE = re.compile(r"\b(?:no|not|never|without|\w+n't)\b")
+# "can not" and "cannot" are folded into "can't" for phrases and text alike.
+_CANNOT_RE = re.compile(r"\bcan ?not\b")
+_SEVERITY_RE = re.compile(r"\b(10|[0-9])\s*(?:/\s*10|out of (?:10|ten))\b")
+
+
+def _normalise(text: str) -> str:
+    return _CANNOT_RE.sub("can't", text.lower().replace("’", "'"))
+
+
+def _alternation(phrases: List[str], whole_word: bool) -> Optional[Pattern]:
+    if not phrases:
+        return None
+    end = r"\b" if whole_word else ""
+    return re.compile(r"\b(?:" + "|".join(map(re.escape, phrases)) + ")" + end)
+
+
+def _phrase_patterns(phrases: List[str], whole_word: bool) -> Tuple[Optional[Pattern], Optional[Pattern]]:
+    """Compile ``(negated, plain)`` patterns: phrases carrying a negation, and the rest."""
+    negated: List[str] = []
+    plain: List[str] = []
+    for phrase in dict.fromkeys(_normalise(phrase) for phrase in phrases if phrase):
+        (negated if _NEGATION_WORD_RE.search(phrase) else plain).append(phrase)
+    return _alternation(negated, whole_word), _alternation(plain, whole_word)
+
+
+def _outcome_fields(node: Dict[str, Any]) -> Dict[str, str]:
+    return {
+        "severity_level": node["severity_level"],
+        "suggested_service": node["suggested_service"],
+        "rationale": node["rationale"],
+    }
+
+
+class PathwayGraph:
+    """Validated pathways plus one matcher over every phrase they use."""
+
+    def __init__(self, data: Dict[str, Any]):
+        self.version = str(data.get("version") or "")
+        if not self.version:
+            raise ValueError("Pathway file needs a version.")
+        self.red_flags: List[Dict[str, str]] = []
+        self.pathways: List[Dict[str, Any]] = []
+        red_categories: Dict[str, List[str]] = {}
+        self._phrases: Dict[str, Tuple[Optional[Pattern], Optional[Pattern]]] = {}
+
+        for idx, rule in enumerate(data.get("red_flags") or []):
+            self._check_outcome(rule, f"red_flags[{idx}]")
+            red_categories[f"red:{idx}"] = [_normalise(phrase) for phrase in rule["match"]]
+            self.red_flags.append(_outcome_fields(rule))
+
+        seen: Set[str] = set()
+        for pathway in data.get("pathways") or []:
+            pathway_id = pathway.get("id")
+            if not pathway_id or pathway_id in seen:
+                raise ValueError(f"Pathway id missing or duplicated: {pathway_id!r}")
+            seen.add(pathway_id)
+            nodes = pathway.get("nodes") or {}
+            if pathway.get("start") not in nodes:
+                raise ValueError(f"Pathway {pathway_id}: start node {pathway.get('start')!r} not found.")
+            self._phrases[f"entry:{pathway_id}"] = _phrase_patterns(list(pathway.get("entry") or []), whole_word=True)
+            for node_id, node in nodes.items():
+                where = f"{pathway_id}.{node_id}"
+                if "question" not in node:
+                    self._check_outcome(node, where)
+                    continue
+                if node.get("default") not in nodes:
+                    raise ValueError(f"{where}: default must name a node.")
+                for idx, branch in enumerate(node.get("branches") or []):
+                    if branch.get("next") not in nodes:
+                        raise ValueError(f"{where}: branch {idx} points at unknown node {branch.get('next')!r}.")
+                    if branch.get("match"):
+                        self._phrases[f"branch:{where}:{idx}"] = _phrase_patterns(list(branch["match"]), whole_word=False)
+                    elif not isinstance(branch.get("severity_at_least"), int):
+                        raise ValueError(f"{where}: branch {idx} needs match phrases or severity_at_least.")
+            self._check_acyclic(pathway_id, pathway["start"], nodes)
+            self.pathways.append(pathway)
+
+        self._red_matcher = KeywordMatcher(red_categories, fuzzy_categories=list(red_categories))
+
+    @staticmethod
+    def _check_outcome(node: Dict[str, Any], where: str) -> None:
+        if node.get("severity_level") not in SEVERITY_LEVELS:
+            raise ValueError(f"{where}: severity_level must be one of {SEVERITY_LEVELS}.")
+        if node.get("suggested_service") not in SERVICES:
+            raise ValueError(f"{where}: suggested_service must be one of {SERVICES}.")
+        if not node.get("rationale"):
+            raise ValueError(f"{where}: rationale is required.")
+
+    @staticmethod
+    def _check_acyclic(pathway_id: str, start: str, nodes: Dict[str, Any]) -> None:
+        def visit(node_id: str, path: Tuple[str, ...]) -> None:
+            if node_id in path:
+                raise ValueError(f"Pathway {pathway_id}: cycle through {node_id!r}.")
+            node = nodes[node_id]
+            if "question" in node:
+                for target in [b["next"] for b in node.get("branches") or []] + [node["default"]]:
+                    visit(target, path + (node_id,))
+
+        visit(start, ())
+
+    @classmethod
+    def load(cls, path: str) -> "PathwayGraph":
+        with open(path, "r", encoding="utf-8") as handle:
+            return cls(json.load(handle))
+
+    def evaluate(
+        self,
+        presenting_issue: str,
+        known_answers: Optional[Dict[str, Any]] = None,
+        postcode_full: str = "",
+    ) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """
+        Route a presentation as ``(pathway_id, FORM A or FORM B)``, or None when
+        no pathway covers it. Red flags report the pathway id ``"red_flags"``.
+        """
+        known_answers = known_answers or {}
+        followups = [str(note) for note in known_answers.get("user_followups") or [] if str(note).strip()]
+        answers = [
+            str(value)
+            for key, value in known_answers.items()
+            if key not in {"user_followups", "asked_questions"} and value not in (None, "")
+        ]
+        text = _normalise(" ".join([presenting_issue or ""] + followups + answers))
+        # Red flags see the whole text: "not breathing" must never be stripped.
+        red_hits = self._red_matcher.scan(text)
+        for idx, outcome in enumerate(self.red_flags):
+            if f"red:{idx}" in red_hits:
+                return "red_flags", self._final(outcome, postcode_full)
+
+        affirmed = _NEGATED_RE.sub(" ", text)
+
+        def matches(category: str) -> bool:
+            negated, plain = self._phrases[category]
+            return bool((negated and negated.search(text)) or (plain and plain.search(affirmed)))
+
+        pathway = next((p for p in self.pathways if matches(f"entry:{p['id']}")), None)
+        if pathway is None:
+            return None
+
+        severity = self._severity(text, known_answers)
+        answered = bool(followups or answers)
+        nodes = pathway["nodes"]
+        node_id = pathway["start"]
+        while "question" in nodes[node_id]:
+            node = nodes[node_id]
+            where = f"{pathway['id']}.{node_id}"
+            next_id = None
+            for idx, branch in enumerate(node.get("branches") or []):
+                if branch.get("match") and matches(f"branch:{where}:{idx}"):
+                    next_id = branch["next"]
+                elif "severity_at_least" in branch and severity is not None and severity >= branch["severity_at_least"]:
+                    next_id = branch["next"]
+                if next_id:
+                    break
+            reached_by_default = next_id is None
+            if reached_by_default:
+                if not answered:
+                    return pathway["id"], {
+                        "status": "need_more_info",
+                        "follow_up_questions": [node["question"]],
+                        "known_answers_update": {},
+                    }
+                # Keep walking in case a later node's branch matches the answers.
+                next_id = node["default"]
+            node_id = next_id
+        if reached_by_default:
+            # The answers were to the model's questions, not this node's, so no
+            # match says nothing; let the model route instead of the default.
+            return None
+        return pathway["id"], self._final(_outcome_fields(nodes[node_id]), postcode_full)
+
+    @staticmethod
+    def _severity(text: str, known_answers: Dict[str, Any]) -> Optional[int]:
+        scores = [int(match) for match in _SEVERITY_RE.findall(text)]
+        stated = str(known_answers.get("severity", "")).strip()
+        if stated.isdigit():
+            scores.append(int(stated))
+        return max(scores) if scores else None
+
+    @staticmethod
+    def _final(outcome: Dict[str, str], postcode_full: str) -> Dict[str, Any]:
+        return {
+            "status": "final",
+            **outcome,
+            "postcode_full": postcode_full or "",
+            "should_lookup": bool(postcode_full) and outcome["suggested_service"] in LOOKUP_SERVICES,
+        }
+
+
+class TriagePathways:
+    """Lazily loaded pathway graph behind an on/off switch."""
+
+    def __init__(self, mode: str = "off", path: str = DEFAULT_PATHWAYS_PATH):
+        self.mode = mode
+        self.path = path
+        self._graph: Optional[PathwayGraph] = None
+        self._lock = Lock()
+
+    @classmethod
+    def from_env(cls) -> "TriagePathways":
+        return cls(
+            mode=os.getenv("TRIAGE_PATHWAYS_MODE", "off").strip().lower(),
+            path=os.getenv("TRIAGE_PATHWAYS_PATH") or DEFAULT_PATHWAYS_PATH,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    @property
+    def graph(self) -> PathwayGraph:
+        if self._graph is None:
+            with self._lock:
+                if self._graph is None:
+                    self._graph = PathwayGraph.load(self.path)
+        return self._graph
+
+    def evaluate(
+        self,
+        presenting_issue: str,
+        known_answers: Optional[Dict[str, Any]] = None,
+        postcode_full: str = "",
+    ) -> Optional[Tuple[str, Dict[str, Any]]]:
+        if not self.enabled:
+            return None
+        return self.graph.evaluate(presenting_issue, known_answers, postcode_full)
+
+
+TRIAGE_PATHWAYS = TriagePathways.from_env()
@@ -0,0 +1,235 @@
+"""Onboarding answer validation shared by the chat flow and the profile APIs.
+
+``validate_answer`` checks one answer the way the onboarding state machine
+always has. ``build_profile`` applies the same rules to a whole submitted
+profile at once and reports errors per field. ``derive_postcode_fields``
+splits a postcode into ``postcode_full`` and ``postcode_area``.
+
+``PROFILE_STORE`` holds profiles imported ahead of a student's first chat
+(see ``cohort_import``), keyed by student id. With ``PROFILE_STORE_PATH`` set,
+the store is also kept as a JSONL file. A profile is only attached to a
+session through ``POST /api/sessions/{session_id}/claim`` with the student's
+claim token: ``claim_token`` is an HMAC of the student id under
+``PROFILE_CLAIM_SECRET``, handed to each student by student support, so
+knowing a student id is not enough to read the profile.
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import re
+from threading import Lock
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from config import ONBOARDING_QUESTIONS
+
+_FULL_POSTCODE_RE = re.compile(r"^[A-Z]{1,2}\d[A-Z\d]?\d[A-Z]{2}$")
+_AREA_POSTCODE_RE = re.compile(r"^[A-Z]{1,2}\d[A-Z\d]?$")
+DERIVED_FIELDS = ("postcode_full", "postcode_area")
+
+
+def normalize_answer(raw: str) -> Tuple[str, bool]:
+    """Strip input and blank out skip tokens; returns (text, was_empty)."""
+    text = (raw or "").strip()
+    if text == "":
+        return "", True
+    if text.lower() in {"skip", "prefer not to say", "n/a", "na"}:
+        return "", False
+    return text, False
+
+
+def validate_age_range(text: str) -> Optional[str]:
+    if re.match(r"^\d{1,3}$", text):
+        return text
+    if re.match(r"^\d{1,2}\s*-\s*\d{1,2}$", text):
+        return text.replace(" ", "")
+    if re.match(r"^\d{1,2}\+$", text):
+        return text
+    return None
+
+
+def validate_yes_no(text: str) -> Optional[str]:
+    lowered = text.lower()
+    if lowered in {"yes", "y"}:
+        return "Yes"
+    if lowered in {"no", "n"}:
+        return "No"
+    return None
+
+
+def validate_postcode(text: str) -> Optional[str]:
+    cleaned = re.sub(r"\s+", "", text.upper())
+    if _FULL_POSTCODE_RE.match(cleaned):
+        return f"{cleaned[:-3]} {cleaned[-3:]}"
+    if _AREA_POSTCODE_RE.match(cleaned):
+        return cleaned
+    return None
+
+
+def validate_text(text: str) -> Optional[str]:
+    return text.strip() or None
+
+
+VALIDATORS: Dict[str, Callable[[str], Optional[str]]] = {
+    "name": validate_text,
+    "age_range": validate_age_range,
+    "stay_length": validate_text,
+    "postcode": validate_postcode,
+    "visa_status": validate_text,
+    "gp_registered": validate_yes_no,
+    "conditions": validate_text,
+    "medications": validate_text,
+    "lifestyle_focus": validate_text,
+    "mental_wellbeing": validate_text,
+}
+
+ERROR_MESSAGES = {
+    "gp_registered": "Please answer with yes or no.",
+    "age_range": "Please enter your age or an age range like 18-24 or 25+.",
+    "postcode": "Please enter a UK postcode or area (e.g., NW8 or NW8 9HU).",
+}
+
+
+def validate_answer(question: Dict[str, Any], raw: str) -> Tuple[Optional[str], Optional[str]]:
+    """Validate a single onboarding answer and return (value, error_message)."""
+    key = str(question.get("key", "")).strip()
+    optional = bool(question.get("optional", False))
+    text, was_empty = normalize_answer(raw)
+
+    if was_empty:
+        return None, "Please enter a response."
+
+    if text == "":
+        if optional:
+            return None, None
+        return None, "This question is required."
+
+    normalized = VALIDATORS.get(key, validate_text)(text)
+    if normalized is None and not optional:
+        return None, ERROR_MESSAGES.get(key, "Please enter a valid response.")
+    return normalized, None
+
+
+def derive_postcode_fields(postcode_raw: str) -> Tuple[Optional[str], Optional[str]]:
+    text = (postcode_raw or "").strip().upper()
+    if not text:
+        return None, None
+
+    compact = text.replace(" ", "")
+    if _FULL_POSTCODE_RE.match(compact):
+        full = f"{compact[:-3]} {compact[-3:]}"
+        return full, full.split(" ")[0]
+    return None, text.split(" ")[0]
+
+
+def with_postcode_fields(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """Add ``postcode_full``/``postcode_area`` derived from ``postcode`` in place."""
+    postcode_full, postcode_area = derive_postcode_fields(str(profile.get("postcode") or ""))
+    if postcode_full:
+        profile["postcode_full"] = postcode_full
+    if postcode_area:
+        profile["postcode_area"] = postcode_area
+    return profile
+
+
+def build_profile(
+    answers: Dict[str, Any],
+    questions: Iterable[Dict[str, Any]] = ONBOARDING_QUESTIONS,
+) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """
+    Validate every onboarding answer in one pass. Returns the profile (with
+    postcode fields) and a ``{field: error}`` dict that is empty when valid.
+    Missing optional answers are stored as None, as if skipped.
+    """
+    profile: Dict[str, Any] = {}
+    errors: Dict[str, str] = {}
+    known = set()
+    for question in questions:
+        key = str(question.get("key"))
+        known.add(key)
+        raw = answers.get(key)
+        if raw is None or str(raw).strip() == "":
+            if question.get("optional"):
+                profile[key] = None
+            else:
+                errors[key] = "This question is required."
+            continue
+        value, error = validate_answer(question, str(raw))
+        if error:
+            errors[key] = error
+        profile[key] = value
+    for key in answers:
+        if key not in known and key not in DERIVED_FIELDS:
+            errors[key] = "Unknown profile field."
+    return with_postcode_fields(profile), errors
+
+
+def claim_token(student_id: str, secret: str) -> str:
+    return hmac.new(secret.encode("utf-8"), student_id.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def valid_claim(student_id: str, token: str, secret: str) -> bool:
+    """True when ``token`` is the student's claim token; always False without a secret."""
+    if not secret or not student_id or not token:
+        return False
+    return hmac.compare_digest(claim_token(student_id, secret), token.strip().lower())
+
+
+class ProfileStore:
+    """Profiles by student id, appended to an optional JSONL file in batches."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._profiles: Dict[str, Dict[str, Any]] = {}
+        self._loaded = False
+        self._lock = Lock()
+
+    @classmethod
+    def from_env(cls) -> "ProfileStore":
+        return cls(path=os.getenv("PROFILE_STORE_PATH") or None)
+
+    def _load(self) -> None:
+        """Read the JSONL file on first use; callers hold the lock."""
+        self._loaded = True
+        if not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as handle:
+            for line in handle:
+                if line.strip():
+                    record = json.loads(line)
+                    self._profiles[record["id"]] = record["profile"]
+
+    def put_many(self, items: List[Tuple[str, Dict[str, Any]]]) -> None:
+        """Store a batch; later entries for the same id replace earlier ones."""
+        if not items:
+            return
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            for student_id, profile in items:
+                self._profiles[student_id] = profile
+            if self.path:
+                lines = "".join(
+                    json.dumps({"id": student_id, "profile": profile}) + "\n"
+                    for student_id, profile in items
+                )
+                with open(self.path, "a", encoding="utf-8") as handle:
+                    handle.write(lines)
+
+    def get(self, student_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            profile = self._profiles.get(student_id)
+        return dict(profile) if profile is not None else None
+
+    def __len__(self) -> int:
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            return len(self._profiles)
+
+
+PROFILE_STORE = ProfileStore.from_env()
+PROFILE_CLAIM_SECRET = os.getenv("PROFILE_CLAIM_SECRET", "").strip()
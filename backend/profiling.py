@@ -0,0 +1,240 @@
+"""On-demand CPU and memory profiles of single ``/api/chat`` turns.
+
+Profiling is off unless ``PROFILE_OUTPUT_DIR`` is set. A turn is then
+profiled when the request carries ``X-Evi-Profile`` equal to
+``PROFILE_ADMIN_TOKEN``, or at random with probability
+``PROFILE_SAMPLE_RATE`` (default 0). Only one turn is profiled at a time;
+other turns run as normal.
+
+The CPU profiler is statistical. A background thread samples the stacks of
+the request thread and of the tool threads the turn starts (see ``follow``)
+every ``PROFILE_INTERVAL_MS`` (default 5). Memory is traced with
+``tracemalloc`` for the turn. It is started for the turn if it is not already
+running, and it slows the process while it runs. Each turn writes, under
+``<session_id>-<turn_id>``:
+
+- ``.cpu.folded``: collapsed stacks, one ``frame;frame;... count`` per line,
+  for ``flamegraph.pl``, speedscope or inferno.
+- ``.mem.txt``: peak traced memory and the allocation sites that grew most.
+- ``.json``: metadata plus the top frames by self samples.
+
+The response carries the turn id in ``X-Evi-Profile-Id``.
+"""
+
+import json
+import os
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+PROFILE_HEADER = "X-Evi-Profile"
+PROFILE_ID_HEADER = "X-Evi-Profile-Id"
+TRACEMALLOC_FRAMES = 10
+TOP_N = 30
+
+_active: ContextVar[Optional["TurnProfile"]] = ContextVar("evi_turn_profile", default=None)
+
+
+def _code_label(code: Any) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _code_stack(frame: Any) -> Tuple[Any, ...]:
+    # Code objects only while sampling; labels are formatted once when written.
+    codes = []
+    while frame is not None:
+        codes.append(frame.f_code)
+        frame = frame.f_back
+    return tuple(reversed(codes))
+
+
+class TurnProfile:
+    """Samples of one turn; written out by ``Profiler`` when the turn ends."""
+
+    def __init__(self, interval: float, trace_memory: bool):
+        self.turn_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{secrets.token_hex(3)}"
+        self.session_id: Optional[str] = None
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+        self._threads: Set[int] = {threading.get_ident()}
+        self._threads_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._owns_tracemalloc = trace_memory and not tracemalloc.is_tracing()
+        if self._owns_tracemalloc:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        self._memory_before = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        self._sampler = threading.Thread(target=self._sample, name="evi-profiler", daemon=True)
+        self._sampler.start()
+
+    def add_thread(self, ident: int) -> None:
+        with self._threads_lock:
+            self._threads.add(ident)
+
+    def remove_thread(self, ident: int) -> None:
+        with self._threads_lock:
+            self._threads.discard(ident)
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._threads_lock:
+                idents = list(self._threads)
+            for ident in idents:
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.stacks[_code_stack(frame)] += 1
+            self.samples += 1
+
+    def stop(self) -> Dict[str, Any]:
+        """Stop sampling; returns the memory report (empty without tracemalloc)."""
+        self._stop.set()
+        self._sampler.join()
+        self.seconds = time.perf_counter() - self.started
+        if self._memory_before is None:
+            return {}
+        after = tracemalloc.take_snapshot()
+        _current, peak = tracemalloc.get_traced_memory()
+        if self._owns_tracemalloc:
+            tracemalloc.stop()
+        # Leave out tracemalloc's own bookkeeping and this profiler's samples.
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        growth = after.filter_traces(filters).compare_to(
+            self._memory_before.filter_traces(filters), "traceback"
+        )
+        return {"peak_bytes": peak, "growth": growth[:TOP_N]}
+
+    def folded(self) -> List[str]:
+        """Collapsed-stack lines, most sampled first."""
+        labels: Dict[Any, str] = {}
+        lines = []
+        for stack, count in self.stacks.most_common():
+            names = [labels.get(code) or labels.setdefault(code, _code_label(code)) for code in stack]
+            lines.append(f"{';'.join(names)} {count}")
+        return lines
+
+    def top_frames(self, n: int = TOP_N) -> List[Dict[str, Any]]:
+        self_samples: Counter = Counter()
+        for stack, count in self.stacks.items():
+            self_samples[_code_label(stack[-1])] += count
+        total = sum(self_samples.values()) or 1
+        return [
+            {"frame": frame, "samples": count, "share": round(count / total, 4)}
+            for frame, count in self_samples.most_common(n)
+        ]
+
+
+class Profiler:
+    """Decides which turns to profile and writes their output files."""
+
+    def __init__(
+        self,
+        output_dir: str = "",
+        admin_token: str = "",
+        sample_rate: float = 0.0,
+        interval_ms: float = 5.0,
+        trace_memory: bool = True,
+    ):
+        self.output_dir = output_dir
+        self.admin_token = admin_token
+        self.sample_rate = sample_rate
+        self.interval = interval_ms / 1000
+        self.trace_memory = trace_memory
+        self._busy = threading.Lock()
+        self.profiled = 0
+
+    @classmethod
+    def from_env(cls) -> "Profiler":
+        return cls(
+            output_dir=os.getenv("PROFILE_OUTPUT_DIR", "").strip(),
+            admin_token=os.getenv("PROFILE_ADMIN_TOKEN", "").strip(),
+            sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0")),
+            interval_ms=float(os.getenv("PROFILE_INTERVAL_MS", "5")),
+            trace_memory=os.getenv("PROFILE_TRACE_MEMORY", "1").strip().lower() not in {"0", "off", "false"},
+        )
+
+    def wanted(self, header_value: Optional[str]) -> bool:
+        if not self.output_dir:
+            return False
+        if self.admin_token and header_value:
+            return secrets.compare_digest(header_value.strip(), self.admin_token)
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    @contextmanager
+    def turn(self, header_value: Optional[str]) -> Iterator[Optional[TurnProfile]]:
+        """Profile the block if this request qualifies and no other turn is being profiled."""
+        if not self.wanted(header_value) or not self._busy.acquire(blocking=False):
+            yield None
+            return
+        try:
+            profile = TurnProfile(self.interval, self.trace_memory)
+            token = _active.set(profile)
+            try:
+                yield profile
+            finally:
+                _active.reset(token)
+                memory = profile.stop()
+                self.write(profile, memory)
+        finally:
+            self._busy.release()
+
+    def write(self, profile: TurnProfile, memory: Dict[str, Any]) -> str:
+        os.makedirs(self.output_dir, exist_ok=True)
+        session = re.sub(r"[^A-Za-z0-9_-]", "_", profile.session_id or "unknown")
+        base = os.path.join(self.output_dir, f"{session}-{profile.turn_id}")
+        with open(base + ".cpu.folded", "w", encoding="utf-8") as handle:
+            for line in profile.folded():
+                handle.write(line + "\n")
+        if memory:
+            with open(base + ".mem.txt", "w", encoding="utf-8") as handle:
+                handle.write(f"peak traced memory: {memory['peak_bytes']} bytes\n\n")
+                for stat in memory["growth"]:
+                    handle.write(f"{stat.size_diff:+d} B ({stat.count_diff:+d} blocks)\n")
+                    for line in stat.traceback.format(most_recent_first=True)[:12]:
+                        handle.write(f"    {line}\n")
+        meta = {
+            "session_id": profile.session_id,
+            "turn_id": profile.turn_id,
+            "wall_ms": round(profile.seconds * 1000, 2),
+            "interval_ms": profile.interval * 1000,
+            "samples": profile.samples,
+            "peak_memory_bytes": memory.get("peak_bytes"),
+            "top_self_frames": profile.top_frames(),
+        }
+        with open(base + ".json", "w", encoding="utf-8") as handle:
+            json.dump(meta, handle, indent=2)
+            handle.write("\n")
+        self.profiled += 1
+        return base
+
+
+def follow(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """Wrap a function run on a worker thread so the active turn profile samples that thread."""
+
+    def run(*args: Any, **kwargs: Any) -> Any:
+        profile = _active.get()
+        if profile is None:
+            return fn(*args, **kwargs)
+        ident = threading.get_ident()
+        profile.add_thread(ident)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profile.remove_thread(ident)
+
+    return run
+
+
+PROFILER = Profiler.from_env()
@@ -1,5 +1,14 @@
+from functools import lru_cache
+
+
 # --- System Prompt for the Agent (LLM chooses tools) ---
 def build_system_prompt(profile):
+    # Sessions with identical profiles (most often the empty one) share one string.
+    return _system_prompt_for(str(profile))
+
+
+@lru_cache(maxsize=1024)
+def _system_prompt_for(profile):
     return f"""
 You are NHS 101, a healthcare navigation assistant for London Business School students.
 
@@ -0,0 +1,126 @@
+"""Token-bucket rate limits per session and per client IP at the API edge.
+
+Each turn is checked against two buckets, one for its session and one for the
+client's IP, and both must have a token. Turns are classed as ``llm`` (routed
+to the model) or ``cheap`` (deterministic: onboarding answers, the safety
+notice), and each class has its own limits, so a student filling in the
+onboarding form does not spend the allowance that protects the shared
+OpenAI TPM. A limit is written ``"<turns>/<seconds>"``: the bucket holds
+``turns`` tokens and refills at ``turns / seconds`` per second.
+
+Buckets are held in process, least recently used first, up to ``max_keys``;
+an evicted bucket comes back full. Limits come from the environment:
+
+- ``RATE_LIMITS``: ``on`` (default) or ``off``.
+- ``RATE_LIMIT_LLM_SESSION`` (default ``10/60``), ``RATE_LIMIT_LLM_IP``
+  (``60/60``), ``RATE_LIMIT_CHEAP_SESSION`` (``60/60``) and
+  ``RATE_LIMIT_CHEAP_IP`` (``300/60``).
+"""
+
+import math
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Dict, Optional, Tuple
+
+TURN_CLASSES = ("llm", "cheap")
+DEFAULT_LIMITS = {
+    ("llm", "session"): "10/60",
+    ("llm", "ip"): "60/60",
+    ("cheap", "session"): "60/60",
+    ("cheap", "ip"): "300/60",
+}
+
+Limit = Tuple[float, float]  # (capacity, tokens per second)
+
+
+def parse_limit(text: str) -> Limit:
+    """``"10/60"`` -> (10.0, 10/60). Raises ValueError when malformed."""
+    turns, _, seconds = text.partition("/")
+    capacity, period = float(turns), float(seconds or 1)
+    if capacity <= 0 or period <= 0:
+        raise ValueError(f"Rate limit {text!r} must be '<turns>/<seconds>' with positive numbers.")
+    return capacity, capacity / period
+
+
+class RateLimited(Exception):
+    """The turn was refused; ``retry_after`` is the wait in whole seconds."""
+
+    def __init__(self, scope: str, retry_after: int):
+        super().__init__(f"Too many requests for this {scope}. Try again in {retry_after} s.")
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class RateLimiter:
+    """Per-session and per-IP token buckets for each turn class."""
+
+    def __init__(
+        self,
+        limits: Dict[Tuple[str, str], Limit],
+        enabled: bool = True,
+        max_keys: int = 100_000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.limits = limits
+        self.enabled = enabled
+        self.max_keys = max_keys
+        self._clock = clock
+        self._buckets: "OrderedDict[Tuple[str, str, str], _Bucket]" = OrderedDict()
+        self._lock = Lock()
+        self.limited = 0
+
+    @classmethod
+    def from_env(cls) -> "RateLimiter":
+        limits = {
+            (turn_class, scope): parse_limit(
+                os.getenv(f"RATE_LIMIT_{turn_class.upper()}_{scope.upper()}", default)
+            )
+            for (turn_class, scope), default in DEFAULT_LIMITS.items()
+        }
+        enabled = os.getenv("RATE_LIMITS", "on").strip().lower() not in {"off", "0", "false"}
+        return cls(limits, enabled=enabled)
+
+    def _bucket(self, key: Tuple[str, str, str], capacity: float, now: float) -> _Bucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(capacity, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def check(self, turn_class: str, session_id: Optional[str], client_ip: Optional[str]) -> None:
+        """Take one token from each applicable bucket, or raise ``RateLimited`` and take none."""
+        if not self.enabled:
+            return
+        now = self._clock()
+        with self._lock:
+            taken = []
+            for scope, key in (("session", session_id), ("ip", client_ip)):
+                limit = self.limits.get((turn_class, scope))
+                if not key or limit is None:
+                    continue
+                capacity, rate = limit
+                bucket = self._bucket((turn_class, scope, key), capacity, now)
+                bucket.tokens = min(capacity, bucket.tokens + (now - bucket.updated) * rate)
+                bucket.updated = now
+                if bucket.tokens < 1:
+                    self.limited += 1
+                    raise RateLimited(scope, max(1, math.ceil((1 - bucket.tokens) / rate)))
+                taken.append(bucket)
+            for bucket in taken:
+                bucket.tokens -= 1
+
+
+RATE_LIMITER = RateLimiter.from_env()
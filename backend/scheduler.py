@@ -0,0 +1,154 @@
+"""Priority queue in front of OpenAI calls once too many are in flight.
+
+At most ``LLM_MAX_CONCURRENT`` calls (default 16; 0 turns the queue off) run
+at once. Further calls wait, ordered by priority class and then by arrival:
+
+- ``triage``: triage questions, summaries and ``nhs_111_live_triage``, plus
+  every call made during a turn of an active triage (``turn_priority``).
+- ``qa``: the agent's own replies, search and service lookups.
+- ``best_effort``: prompt suggestions and profile follow-ups, which have
+  deterministic fallbacks.
+
+Each call site's class comes from its ``priority`` in ``config.CALL_SITES``.
+Waiting calls age: every ``LLM_QUEUE_AGING_SECONDS`` (default 5) spent
+waiting counts as one class higher, so a best-effort call waits behind a
+stream of triage calls for at most two aging periods. Wait times are kept
+per class and reported by ``GET /api/usage``.
+"""
+
+import heapq
+import itertools
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Event, Lock
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+PRIORITY_CLASSES = ("triage", "qa", "best_effort")
+_RANK = {name: rank for rank, name in enumerate(PRIORITY_CLASSES)}
+
+_turn_priority: ContextVar[Optional[str]] = ContextVar("evi_turn_priority", default=None)
+
+
+@contextmanager
+def turn_priority(priority: Optional[str]) -> Iterator[None]:
+    """Raise ``qa`` calls made inside the block (and in its tool threads) to ``priority``."""
+    token = _turn_priority.set(priority)
+    try:
+        yield
+    finally:
+        _turn_priority.reset(token)
+
+
+def effective_priority(site_priority: Optional[str]) -> str:
+    priority = site_priority if site_priority in _RANK else "qa"
+    boost = _turn_priority.get()
+    if priority == "qa" and boost in _RANK and _RANK[boost] < _RANK[priority]:
+        return boost
+    return priority
+
+
+class _WaitStats:
+    __slots__ = ("calls", "queued", "total", "max", "recent")
+
+    def __init__(self):
+        self.calls = 0
+        self.queued = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent: Deque[float] = deque(maxlen=1000)
+
+    def add(self, waited: float, queued: bool) -> None:
+        self.calls += 1
+        self.queued += int(queued)
+        self.total += waited
+        self.max = max(self.max, waited)
+        self.recent.append(waited)
+
+    def as_dict(self) -> Dict[str, Any]:
+        recent = sorted(self.recent)
+        p95 = recent[min(len(recent) - 1, int(0.95 * len(recent)))] if recent else 0.0
+        return {
+            "calls": self.calls,
+            "queued": self.queued,
+            "mean_wait_ms": round(self.total / self.calls * 1000, 2) if self.calls else 0.0,
+            "p95_wait_ms": round(p95 * 1000, 2),
+            "max_wait_ms": round(self.max * 1000, 2),
+        }
+
+
+class CallScheduler:
+    """Caps concurrent model calls and hands free slots out by aged priority."""
+
+    def __init__(self, max_concurrent: int = 16, aging_seconds: float = 5.0):
+        self.max_concurrent = max_concurrent
+        self.aging_seconds = aging_seconds
+        self._active = 0
+        self._waiting: List[Tuple[float, int, Event]] = []
+        self._seq = itertools.count()
+        self._lock = Lock()
+        self._stats = {name: _WaitStats() for name in PRIORITY_CLASSES}
+
+    @classmethod
+    def from_env(cls) -> "CallScheduler":
+        return cls(
+            max_concurrent=int(os.getenv("LLM_MAX_CONCURRENT", "16")),
+            aging_seconds=float(os.getenv("LLM_QUEUE_AGING_SECONDS", "5")),
+        )
+
+    @contextmanager
+    def slot(self, priority: str) -> Iterator[float]:
+        """Hold one call slot for the block; yields the seconds spent queueing."""
+        waited = self._acquire(priority)
+        try:
+            yield waited
+        finally:
+            self._release()
+
+    def _acquire(self, priority: str) -> float:
+        if self.max_concurrent <= 0:
+            self._record(priority, 0.0, queued=False)
+            return 0.0
+        started = time.monotonic()
+        with self._lock:
+            if self._active < self.max_concurrent and not self._waiting:
+                self._active += 1
+                self._stats[priority].add(0.0, queued=False)
+                return 0.0
+            # Aging keeps the order fixed: waiting longer by ``aging_seconds``
+            # is worth one class, so the key is rank * aging + arrival time.
+            ticket = Event()
+            key = _RANK[priority] * self.aging_seconds + started
+            heapq.heappush(self._waiting, (key, next(self._seq), ticket))
+        ticket.wait()
+        waited = time.monotonic() - started
+        self._record(priority, waited, queued=True)
+        return waited
+
+    def _release(self) -> None:
+        if self.max_concurrent <= 0:
+            return
+        with self._lock:
+            if self._waiting:
+                # The slot passes straight to the next caller; _active is unchanged.
+                heapq.heappop(self._waiting)[2].set()
+            else:
+                self._active -= 1
+
+    def _record(self, priority: str, waited: float, queued: bool) -> None:
+        with self._lock:
+            self._stats[priority].add(waited, queued)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "active": self._active,
+                "waiting": len(self._waiting),
+                "classes": {name: stats.as_dict() for name, stats in self._stats.items()},
+            }
+
+
+SCHEDULER = CallScheduler.from_env()
@@ -0,0 +1,195 @@
+"""Incremental post-processing of streamed agent replies.
+
+``ReplyStreamProcessor`` takes reply chunks as they arrive and returns the
+text that is safe to show. It gives the same result as the batch path
+``AgentSession._strip_useful_links(strip_profile_tag(reply))``, byte for byte:
+
+- ``<USER_PROFILE>...</USER_PROFILE>`` blocks are held back until closed and
+  removed, even when the tags are split across chunks.
+- A line is held only until it is known not to start a "Useful links" section.
+  Sections are dropped up to the next blank line.
+- Leading and trailing whitespace of the whole reply is trimmed, so a
+  whitespace run is held until more text follows it.
+
+The profile (and links, via ``select_links``) are produced by ``finish``.
+
+Turns stepped inside ``streaming_reply(sink)`` stream their final model reply:
+the agent feeds the model's text deltas through a processor and hands the
+clean text to ``sink`` as it becomes safe to show.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from extract import extract_profile
+
+PROFILE_OPEN = "<USER_PROFILE>"
+PROFILE_CLOSE = "</USER_PROFILE>"
+LINKS_HEADER = "useful links"
+
+# Characters str.splitlines() treats as line boundaries.
+_LINE_BREAKS = frozenset("\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029")
+
+_reply_sink: ContextVar[Optional[Callable[[str], None]]] = ContextVar(
+    "evi_reply_sink", default=None
+)
+
+
+@contextmanager
+def streaming_reply(sink: Optional[Callable[[str], None]]) -> Iterator[None]:
+    """Final replies of turns stepped inside the block stream their clean text to ``sink`` (None: off)."""
+    token = _reply_sink.set(sink)
+    try:
+        yield
+    finally:
+        _reply_sink.reset(token)
+
+
+def reply_sink() -> Optional[Callable[[str], None]]:
+    return _reply_sink.get()
+
+
+class ReplyStreamProcessor:
+    """Stream-safe equivalent of the profile-tag and useful-links stripping."""
+
+    def __init__(
+        self, select_links: Optional[Callable[[str], List[Dict[str, str]]]] = None
+    ):
+        self._select_links = select_links
+        self._chunks: List[str] = []
+        self._pending = ""  # raw text not yet cleared of profile tags
+        self._line = ""  # current, unterminated line of tag-free text
+        self._line_state: Optional[str] = None  # None (undecided), "keep", "drop"
+        self._line_emitted = 0
+        self._in_links = False
+        self._kept_lines = 0
+        self._started = False
+        self._held_ws = ""
+        self.finished = False
+        self.profile: Optional[Dict[str, Any]] = None
+        self.links: List[Dict[str, str]] = []
+
+    @property
+    def raw(self) -> str:
+        return "".join(self._chunks)
+
+    def feed(self, chunk: str) -> str:
+        """Consume a chunk and return the clean text that can be flushed now."""
+        if self.finished:
+            raise RuntimeError("Stream already finished.")
+        if not chunk:
+            return ""
+        self._chunks.append(chunk)
+        self._pending += chunk
+        out: List[str] = []
+        self._drain_tags(out, final=False)
+        return "".join(out)
+
+    def finish(self) -> str:
+        """Flush held text and compute the profile and links from the full reply."""
+        if self.finished:
+            return ""
+        out: List[str] = []
+        self._drain_tags(out, final=True)
+        if self._line:
+            self._end_line(out)
+        self._held_ws = ""
+        self.finished = True
+        raw = self.raw
+        self.profile = extract_profile(raw)
+        if self._select_links is not None:
+            self.links = self._select_links(raw)
+        return "".join(out)
+
+    # -- profile tags -----------------------------------------------------
+    def _drain_tags(self, out: List[str], final: bool) -> None:
+        while self._pending:
+            start = self._pending.find(PROFILE_OPEN)
+            if start == -1:
+                hold = 0 if final else _partial_suffix(self._pending, PROFILE_OPEN)
+                cut = len(self._pending) - hold
+                self._text(self._pending[:cut], out)
+                self._pending = self._pending[cut:]
+                return
+            end = self._pending.find(PROFILE_CLOSE, start + len(PROFILE_OPEN))
+            if end == -1:
+                # An unclosed tag stays literal text, like the batch regex.
+                self._text(self._pending[:start], out)
+                self._pending = self._pending[start:]
+                if final:
+                    self._text(self._pending, out)
+                    self._pending = ""
+                return
+            self._text(self._pending[:start], out)
+            self._pending = self._pending[end + len(PROFILE_CLOSE) :]
+
+    # -- lines ------------------------------------------------------------
+    def _text(self, text: str, out: List[str]) -> None:
+        for char in text:
+            if self._line.endswith("\r") and char != "\n":
+                self._end_line(out)
+            self._line += char
+            if char in _LINE_BREAKS and char != "\r":
+                self._end_line(out)
+        if self._line and not self._line.endswith("\r"):
+            self._decide(out, complete=False)
+
+    def _content(self) -> str:
+        line = self._line
+        while line and line[-1] in _LINE_BREAKS:
+            line = line[:-1]
+        return line
+
+    def _decide(self, out: List[str], complete: bool) -> None:
+        content = self._content()
+        if self._line_state is None:
+            if self._in_links:
+                if content.strip():
+                    self._line_state = "drop"
+                elif complete:
+                    self._in_links = False
+                    self._line_state = "keep"
+            else:
+                head = content.lstrip().lower()
+                if head.startswith(LINKS_HEADER):
+                    self._line_state = "drop"
+                    self._in_links = True
+                elif complete or (head and not LINKS_HEADER.startswith(head)):
+                    self._line_state = "keep"
+            if self._line_state == "keep":
+                self._emit("\n" if self._kept_lines else "", out)
+                self._kept_lines += 1
+        if self._line_state == "keep":
+            self._emit(content[self._line_emitted :], out)
+            self._line_emitted = len(content)
+
+    def _end_line(self, out: List[str]) -> None:
+        self._decide(out, complete=True)
+        self._line = ""
+        self._line_state = None
+        self._line_emitted = 0
+
+    # -- outer strip --------------------------------------------------------
+    def _emit(self, text: str, out: List[str]) -> None:
+        if not text:
+            return
+        text = self._held_ws + text
+        if not self._started:
+            text = text.lstrip()
+            if not text:
+                self._held_ws = ""
+                return
+            self._started = True
+        body = text.rstrip()
+        self._held_ws = text[len(body) :]
+        if body:
+            out.append(body)
+
+
+def _partial_suffix(text: str, token: str) -> int:
+    """Length of the longest suffix of text that is a proper prefix of token."""
+    for size in range(min(len(token) - 1, len(text)), 0, -1):
+        if text.endswith(token[:size]):
+            return size
+    return 0
@@ -1,13 +1,54 @@
+import asyncio
+import contextvars
+import gzip
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from types import SimpleNamespace
 
+import openai
+import pytest
+
+import agent
+import llm
+import main
+import tools
 from agent import AgentSession
 from extract import extract_profile, strip_profile_tag
+from history import ConversationHistory
+from answer_cache import SemanticAnswerCache
+from call_sites import CallSiteRegistry
+from cassettes import Cassette, CassetteMiss
+from intent import IntentRouter
+from keywords import KeywordMatcher, scan_keywords
+from links import ReloadingLinkCatalog
+from pathways import DEFAULT_PATHWAYS_PATH, PathwayGraph, TriagePathways
+from cohort_import import import_csv
+from profiles import ProfileStore, build_profile, claim_token
+from profiling import Profiler, follow
+from ratelimit import RateLimited, RateLimiter, parse_limit
+from scheduler import CallScheduler, effective_priority, turn_priority
+from streaming import ReplyStreamProcessor
+from tool_registry import ToolRegistry, ToolSpec
 from tools import safety_check
+from tracing import span, start_trace
+from usage import UsageLedger, session_usage
 
 
 class StubResponses:
-    def create(self, **_kwargs):
-        return SimpleNamespace(output_text="[]", output=[], id="stub-response")
+    def __init__(self):
+        self.calls = 0
+        self.models = []
+
+    def create(self, **kwargs):
+        self.calls += 1
+        self.models.append(kwargs.get("model"))
+        usage = SimpleNamespace(
+            input_tokens=100, output_tokens=20, input_tokens_details=SimpleNamespace(cached_tokens=40)
+        )
+        return SimpleNamespace(output_text="[]", output=[], id="stub-response", usage=usage)
 
 
 class StubClient:
@@ -52,6 +93,80 @@ def test_onboarding_review_flow_and_validation():
     assert session.user_profile["postcode_area"] == "NW8"
 
 
+def test_one_shot_profile_uses_onboarding_rules():
+    answers = {
+        "name": "skip",
+        "age_range": "25 - 34",
+        "stay_length": "1 year",
+        "postcode": "nw89hu",
+        "visa_status": "student visa",
+        "gp_registered": "maybe",
+        "lifestyle_focus": "sleep",
+        "favourite_colour": "blue",
+    }
+    _, errors = build_profile(answers)
+    assert errors == {"gp_registered": "Please answer with yes or no.", "favourite_colour": "Unknown profile field."}
+
+    del answers["favourite_colour"]
+    answers["gp_registered"] = "y"
+    profile, errors = build_profile(answers)
+    assert not errors
+    assert profile["age_range"] == "25-34" and profile["name"] is None and profile["conditions"] is None
+
+    session = AgentSession(client_override=StubClient())
+    session.step("onboarding")
+    summary = session.submit_onboarding_profile(profile)
+    assert "GP" in summary and "NW8 9HU" in summary
+    assert session.onboarding_active is False
+    assert session.user_profile["postcode_area"] == "NW8"
+    assert session.user_profile["gp_registered"] == "Yes"
+
+
+def test_cohort_import_streams_rows_into_store_with_row_errors(tmp_path):
+    def rows():
+        yield "student_id,name,age_range,stay_length,postcode,visa_status,gp_registered,lifestyle_focus\n"
+        for idx in range(250):
+            gp = "maybe" if idx % 50 == 0 else "yes"
+            yield f"s{idx},Student {idx},22,1 year,nw1 2bu,student,{gp},sleep\n"
+        yield ",Nobody,22,1 year,NW1,student,no,sleep\n"
+
+    store = ProfileStore(path=str(tmp_path / "profiles.jsonl"))
+    report = import_csv(rows(), store=store, batch_size=64)
+    assert (report.rows, report.imported, report.failed) == (251, 245, 6)
+    assert report.errors[0] == {"line": 2, "student_id": "s0", "errors": {"gp_registered": "Please answer with yes or no."}}
+    assert "student_id" in report.errors[-1]["errors"]
+    assert store.get("s1")["postcode_full"] == "NW1 2BU"
+
+    reloaded = ProfileStore(path=store.path)
+    assert len(reloaded) == 245 and reloaded.get("s249")["gp_registered"] == "Yes"
+
+
+def test_imported_profile_needs_claim_token(monkeypatch):
+    store = ProfileStore()
+    profile, _ = build_profile({"age_range": "22", "postcode": "NW1 2BU", "gp_registered": "yes"})
+    store.put_many([("s1", profile)])
+    monkeypatch.setattr(main, "PROFILE_STORE", store)
+    monkeypatch.setattr(main, "PROFILE_CLAIM_SECRET", "secret")
+    monkeypatch.setattr(main, "_sessions", {})
+    monkeypatch.setattr(agent, "client", StubClient())
+    request = SimpleNamespace(client=SimpleNamespace(host="127.0.0.1"), headers={})
+
+    _, session = main._get_or_create_session("s1")
+    assert session.user_profile == {}
+
+    with pytest.raises(main.HTTPException) as denied:
+        main.claim_profile("s1", main.ClaimRequest(student_id="s1", claim_token="guess"), request)
+    assert denied.value.status_code == 403
+
+    token = claim_token("s1", "secret")
+    claimed = main.claim_profile("s1", main.ClaimRequest(student_id="s1", claim_token=token), request)
+    assert claimed.user_profile["postcode_area"] == "NW1"
+
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "")
+    with pytest.raises(main.HTTPException):
+        main._require_admin("anything")
+
+
 def test_routing_response_structure():
     session = AgentSession(client_override=StubClient())
     triage_result = {
@@ -74,3 +189,796 @@ def test_routing_response_structure():
 def test_safety_check_keywords():
     assert safety_check("I have chest pain and feel dizzy") is True
     assert safety_check("I have a mild cough") is False
+
+
+def test_keyword_scan_reports_every_category_and_typos():
+    hits = scan_keywords("Please start onboarding, then search for a GP to register with")
+    assert {"onboarding", "search", "action", "link:gp"} <= set(hits)
+    assert hits["link:gp"] == {"gp", "register"}
+    assert safety_check("I have chest pian since this morning") is True
+    assert safety_check("I think I overdone it at the gym") is False
+    assert safety_check("I feel suicidl") is True and safety_check("had a seizrue") is True
+    assert safety_check("cant breathe properly") is True
+    # One-edit neighbours that are real words, or a typo'd first word, are not red flags.
+    for text in ("I have chest plain", "chest gain at the gym", "I work on a farm myself", "a strike on campus"):
+        assert safety_check(text) is False, text
+
+
+def test_keyword_scan_result_is_read_only_and_memoised_per_thread():
+    matcher = KeywordMatcher({"red_flag": ["chest pain"], "link:gp": ["gp"]})
+    hits = matcher.scan("chest pain, call my gp")
+    with pytest.raises(TypeError):
+        hits["red_flag"] = {"injected"}
+    with pytest.raises(AttributeError):
+        hits["link:gp"].add("injected")
+
+    other = {}
+    thread = threading.Thread(target=lambda: other.update(matcher.scan("nothing here")))
+    thread.start()
+    thread.join()
+    assert other == {}
+    assert matcher.scan("chest pain, call my gp") is hits
+    assert dict(hits) == {"red_flag": {"chest pain"}, "link:gp": {"gp"}}
+
+
+def test_intent_router_shadow_and_active_modes(monkeypatch):
+    shadow = IntentRouter(mode="shadow")
+    monkeypatch.setattr(agent, "INTENT_ROUTER", shadow)
+    session = AgentSession(client_override=StubClient())
+    session.step("what is NHS 111?")
+    assert shadow.stats()["evaluated"] == 1
+    assert shadow.stats()["agreement"] == 1.0
+    assert not session.triage_active
+
+    monkeypatch.setattr(agent, "INTENT_ROUTER", IntentRouter(mode="active", threshold=0.8))
+    session = AgentSession(client_override=StubClient())
+    reply = session.step("I have a sore throat and a temperature")
+    assert session.triage_active
+    assert reply.splitlines()[1].startswith("1. ")
+
+
+def test_answer_cache_serves_similar_questions_without_profile(monkeypatch):
+    cache = SemanticAnswerCache(enabled=True)
+    monkeypatch.setattr(agent, "ANSWER_CACHE", cache)
+
+    first = AgentSession(client_override=StubClient())
+    first.step("How do I see a GP?")
+    assert first.client.responses.calls > 0
+
+    second = AgentSession(client_override=StubClient())
+    reply = second.step("how do i see a gp")
+    assert second.client.responses.calls == 0
+    assert reply == "[]"
+    assert cache.stats()["hits"] == 1
+
+    personalised = AgentSession(client_override=StubClient())
+    personalised.set_user_profile({"postcode": "NW8 9HU"})
+    personalised.step("how do I see a GP?")
+    assert personalised.client.responses.calls > 0
+
+    # Follow-ups depend on the conversation, so only opening questions are cached.
+    second.step("tell me more")
+    third = AgentSession(client_override=StubClient())
+    third.step("How do I register with a dentist?")
+    calls = third.client.responses.calls
+    third.step("tell me more")
+    assert third.client.responses.calls > calls
+
+    # Near-identical wording with different numbers or negation is a miss.
+    cache.store("when should I call 111?", {"reply": "111", "prompt_suggestions": []})
+    cache.store("can I take ibuprofen with alcohol?", {"reply": "with", "prompt_suggestions": []})
+    assert cache.lookup("when should i call 111") is not None
+    assert cache.lookup("when should I call 999?") is None
+    assert cache.lookup("can I take ibuprofen without alcohol?") is None
+    # Long questions that differ in one key word score above the threshold but are different questions.
+    pairs = [
+        ("How do I register with a GP near my accommodation in London as a new student?",
+         "How do I register with a dentist near my accommodation in London as a new student?"),
+        ("Where can I get support for my mental health while studying at university?",
+         "Where can I get support for my sexual health while studying at university?"),
+        ("Can I use NHS services for free if I am in the UK on a student visa?",
+         "Can I use NHS services for free if I am in the UK on a visitor visa?"),
+        ("Should I book a GP appointment for a sore throat that has lasted a week?",
+         "Should I book a GP appointment for a sore back that has lasted a week?"),
+    ]
+    for stored, asked in pairs:
+        cache.store(stored, {"reply": stored, "prompt_suggestions": []})
+        assert cache.lookup(stored.lower()) is not None
+        assert cache.lookup(asked) is None, asked
+
+
+def test_stream_processor_matches_batch_post_processing():
+    session = AgentSession(client_override=StubClient())
+    reply = (
+        "  <USER_PROFILE>{\"name\": \"A\"}</USER_PROFILE>\nRegister with a GP soon.\r\n"
+        "Useful links:\n- https://www.nhs.uk/\n\nCall 111 if it gets worse.\n  "
+    )
+    expected = session._strip_useful_links(strip_profile_tag(reply))
+
+    for size in (1, 2, 5, 13, len(reply)):
+        processor = ReplyStreamProcessor()
+        chunks = [reply[i : i + size] for i in range(0, len(reply), size)]
+        streamed = "".join(processor.feed(chunk) for chunk in chunks) + processor.finish()
+        assert streamed == expected
+        assert processor.profile == {"name": "A"}
+
+    processor = ReplyStreamProcessor()
+    assert processor.feed("Register now. <USER_PRO") == "Register now."
+    assert "https://" not in processor.feed("FILE>{}</USER_PROFILE>\nUseful links\n- https://x")
+
+
+def test_conversation_history_ring_with_archive(tmp_path):
+    history = ConversationHistory(3, archive_path=str(tmp_path / "session.jsonl.gz"))
+    for idx in range(40):
+        history.append({"role": "user", "content": str(idx)})
+
+    assert len(history) == 3
+    assert history[-2:] == [
+        {"role": "user", "content": "38"},
+        {"role": "user", "content": "39"},
+    ]
+    assert [m["content"] for m in history.transcript()] == [str(i) for i in range(40)]
+
+
+def test_session_archives_are_distinct_and_flushed_at_shutdown(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "HISTORY_ARCHIVE_DIR", str(tmp_path))
+    monkeypatch.setattr(main, "_sessions", {})
+    monkeypatch.setattr(agent, "client", StubClient())
+    assert main._history_archive_path("a.b") != main._history_archive_path("a_b")
+
+    _, session = main._get_or_create_session("a.b")
+    history = session.conversation_history
+    for idx in range(history.capacity + 3):
+        history.append({"role": "user", "content": str(idx)})
+    assert not os.path.exists(history.archive_path)
+    main._flush_histories()
+    with gzip.open(history.archive_path, "rt", encoding="utf-8") as handle:
+        assert [json.loads(line)["content"] for line in handle] == ["0", "1", "2"]
+
+
+def test_cassette_record_then_replay_without_client(tmp_path):
+    path = str(tmp_path / "session.cassette.json.gz")
+    recorder = Cassette(mode="record", path=path)
+    stub = StubClient()
+    recorded = AgentSession(client_override=recorder.wrap(stub))
+    first = recorded.step("What is NHS 111?")
+    recorder.save()
+    assert stub.responses.calls == recorder.stats()["recorded"] > 0
+
+    player = Cassette(mode="replay", path=path)
+    replayed = AgentSession(client_override=player.wrap(None))
+    assert replayed.step("What is NHS 111?") == first
+    assert replayed.prompt_suggestions == recorded.prompt_suggestions
+    assert player.stats()["misses"] == 0
+
+    try:
+        player.wrap(None).responses.create(model="gpt-4o-mini", input="never recorded")
+    except CassetteMiss:
+        pass
+    else:
+        raise AssertionError("expected a cassette miss")
+
+    # Transport failures are journalled too, appended after the earlier batch.
+    class FlakyResponses:
+        def create(self, **kwargs):
+            raise openai.APITimeoutError(request=None)
+
+    flaky = recorder.wrap(SimpleNamespace(responses=FlakyResponses()))
+    with pytest.raises(openai.APITimeoutError):
+        flaky.responses.create(model="gpt-4o-mini", input="slow")
+    recorder.save()
+    player = Cassette(mode="replay", path=path)
+    assert player.stats()["recorded"] == 0 and player.stats()["requests"] == recorder.stats()["requests"]
+    with pytest.raises(openai.APITimeoutError):
+        player.wrap(None).responses.create(model="gpt-4o-mini", input="slow")
+
+
+def test_trace_waterfall_covers_step_branch_and_model_calls(monkeypatch):
+    # Inline waterfalls need the admin token in the debug header.
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(main, "_sessions", {})
+    monkeypatch.setattr(agent, "client", StubClient())
+    request = main.ChatRequest(message="What is NHS 111?")
+    assert main._traced_chat_turn(request, None, main._is_admin("1")).trace is None
+    assert main._traced_chat_turn(request, None, main._is_admin("secret")).trace["spans"]
+
+    with start_trace("POST /api/chat") as trace:
+        with span("agent.step"):
+            AgentSession(client_override=StubClient()).step("What is NHS 111?")
+
+    rows = trace.waterfall()["spans"]
+    assert [row["name"] for row in rows] == [
+        "POST /api/chat",
+        "agent.step",
+        "llm.step.first",
+        "postprocess",
+        "llm.prompt_suggestions",
+    ]
+    assert rows[1]["attributes"]["branch"] == "model"
+    assert rows[2]["depth"] == 2 and rows[2]["attributes"]["llm.model"] == "gpt-4o-mini"
+
+    spans = trace.to_otlp()["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert all(item["traceId"] == trace.trace_id for item in spans)
+    assert [("parentSpanId" in item) for item in spans] == [False, True, True, True, True]
+
+
+def test_usage_is_accounted_per_call_site_and_budget_degrades(monkeypatch):
+    ledger = UsageLedger(session_budget=150)
+    monkeypatch.setattr(llm, "LEDGER", ledger)
+
+    session = AgentSession(client_override=StubClient())
+    session.step("What is NHS 111?")
+    report = ledger.snapshot()
+    assert set(report["by_call_site"]) == {"step.first", "prompt_suggestions"}
+    assert report["by_call_site"]["step.first"]["cached_tokens"] == 40
+    assert session.usage.calls == 2 and session.usage.tokens == 240
+    assert report["total"]["cost_usd"] > 0
+
+    # Over budget: the optional suggestions call falls back without a model call.
+    calls_before = session.client.responses.calls
+    session.step("How do I register with a GP?")
+    assert session.client.responses.calls == calls_before + 1
+    assert session.prompt_suggestions[0] == "Find nearby GP or A&E"
+    assert ledger.snapshot()["budgets"]["skipped_calls"] == 1
+
+    # Required calls move to the cheaper model instead.
+    client = StubClient()
+    with session_usage(session.usage):
+        llm.create_response(client, "tool.nearest_nhs_services", model="gpt-4o", input="x")
+    assert client.responses.models == ["gpt-4o-mini"]
+
+    # A session's totals are only reported to an admin.
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(main, "_sessions", {"s1": session})
+    with pytest.raises(main.HTTPException) as denied:
+        main.usage_report("s1", None)
+    assert denied.value.status_code == 403
+    assert main.usage_report("s1", "secret")["session"]["calls"] == session.usage.calls
+    assert "session" not in main.usage_report(None, None)
+
+
+class ToolRoundResponses(StubResponses):
+    """First response asks for two tools at once; the follow-up answers in text."""
+
+    def create(self, **kwargs):
+        response = super().create(**kwargs)
+        if self.calls == 1:
+            response.output = [
+                SimpleNamespace(type="function_call", name="guided_search", call_id="a", arguments='{"query": "dentist"}'),
+                SimpleNamespace(type="function_call", name="nearest_nhs_services", call_id="b", arguments="{}"),
+            ]
+        elif kwargs.get("previous_response_id"):
+            self.tool_outputs = kwargs["input"][1:]
+            response.output_text = "Here is what I found."
+        return response
+
+
+def test_tool_calls_in_a_round_run_concurrently_and_fail_independently(monkeypatch):
+    def slow_tool(tool_name, _args):
+        time.sleep(0.3)
+        if tool_name == "nearest_nhs_services":
+            raise KeyError("postcode_full")
+        return {"context": "dentist info"}
+
+    monkeypatch.setattr(agent, "execute_tool", slow_tool)
+    client = StubClient()
+    client.responses = ToolRoundResponses()
+    session = AgentSession(client_override=client)
+
+    started = time.perf_counter()
+    reply = session.step("please search for an NHS dentist")
+    assert time.perf_counter() - started < 0.55
+    assert reply == "Here is what I found."
+    outputs = client.responses.tool_outputs
+    assert [item["call_id"] for item in outputs] == ["a", "b"]
+    assert json.loads(outputs[0]["output"]) == {"context": "dentist info"}
+    assert "nearest_nhs_services failed" in json.loads(outputs[1]["output"])["error"]
+
+
+def test_speculative_guided_search_overlaps_broad_and_prefers_restricted(monkeypatch):
+    class SearchResponses:
+        def __init__(self, restricted_text):
+            self.restricted_text = restricted_text
+            self.queries = []
+
+        def create(self, **kwargs):
+            self.queries.append(kwargs["input"])
+            time.sleep(0.3)
+            if "site:" in kwargs["input"]:
+                return SimpleNamespace(output_text=self.restricted_text, usage=None)
+            return SimpleNamespace(output_text="broad answer", usage=None)
+
+    monkeypatch.setattr(tools, "GUIDED_SEARCH_SPECULATIVE", True)
+    monkeypatch.setattr(tools, "GUIDED_SEARCH_HEDGE_SECONDS", "0.05")
+
+    qualifying = "See https://www.nhs.uk/conditions/ for details. " + "x" * 200
+    monkeypatch.setattr(tools, "client", SimpleNamespace(responses=SearchResponses(qualifying)))
+    result = tools.guided_search({"query": "hay fever"})
+    assert result["fallback_used"] is False
+    assert result["context"] == qualifying
+
+    responses = SearchResponses("too short")
+    monkeypatch.setattr(tools, "client", SimpleNamespace(responses=responses))
+    started = time.perf_counter()
+    result = tools.guided_search({"query": "hay fever"})
+    assert time.perf_counter() - started < 0.5
+    assert result == {"context": "broad answer", "sources": [], "fallback_used": True}
+    assert len(responses.queries) == 2
+
+
+def test_triage_pathways_route_locally_and_fall_back_for_uncovered(monkeypatch):
+    graph = PathwayGraph.load(DEFAULT_PATHWAYS_PATH)
+    assert graph.version
+
+    pathway, result = graph.evaluate("I twisted my ankle playing football")
+    assert pathway == "msk_injury" and result["status"] == "need_more_info"
+    assert len(result["follow_up_questions"]) == 1
+
+    pathway, result = graph.evaluate(
+        "I twisted my ankle", {"user_followups": ["no numbness, but I can not put weight on it"]}, "NW1 2BU"
+    )
+    assert result["suggested_service"] == "NHS_111" and result["should_lookup"] is False
+    _, result = graph.evaluate("I twisted my knee", {"user_followups": ["it is not healing"]})
+    assert result["suggested_service"] == "GP"
+
+    # Red flags see negated text; answers matching no branch go back to the model.
+    _, result = graph.evaluate("sore throat", {"user_followups": ["now she is not breathing properly"]})
+    assert result["suggested_service"] == "A&E" and result["severity_level"] == "emergency"
+    assert graph.evaluate("sore throat", {"user_followups": ["no difficulty breathing, 3/10"]}) is None
+    assert graph.evaluate("I twisted my ankle", {"user_followups": ["No"]}) is None
+    assert graph.evaluate("I need a routine check-up") is None
+
+    _, result = graph.evaluate("I have a sore throat and chest pian", {}, "NW1 2BU")
+    assert result["suggested_service"] == "A&E" and result["should_lookup"] is True
+    assert graph.evaluate("my ear hurts") is None
+
+    responses = StubResponses()
+    monkeypatch.setattr(tools, "client", SimpleNamespace(responses=responses))
+    monkeypatch.setattr(tools, "TRIAGE_PATHWAYS", TriagePathways(mode="on"))
+    covered = tools.nhs_111_live_triage(
+        {"presenting_issue": "sore throat", "known_answers": {"user_followups": ["I can't swallow"]}}
+    )
+    assert covered["status"] == "final" and not responses.calls
+    tools.nhs_111_live_triage({"presenting_issue": "my ear hurts", "known_answers": {}})
+    assert responses.calls
+
+
+def test_link_catalog_scores_dedupes_and_hot_reloads(tmp_path):
+    path = tmp_path / "links.json"
+    data = {
+        "version": "1",
+        "fallback": ["https://a.example/gp"],
+        "links": [
+            {"title": "GP", "url": "https://a.example/gp", "tags": ["gp"], "keywords": ["register"]},
+            {"title": "GP again", "url": "https://A.example/gp/", "tags": ["register"]},
+            {"title": "Dentists", "url": "https://a.example/dentist", "keywords": ["dentist*"]},
+            {"title": "STIs", "url": "https://a.example/sti", "keywords": ["sti"]},
+        ],
+    }
+    path.write_text(json.dumps(data))
+    catalog_store = ReloadingLinkCatalog(path=str(path), check_seconds=0)
+    catalog = catalog_store.current()
+    assert len(catalog.links) == 3
+    assert catalog.top_k(["gp"], "still looking for dentists") == [
+        {"title": "Dentists", "url": "https://a.example/dentist"},
+        {"title": "GP", "url": "https://a.example/gp"},
+    ]
+
+    data["links"].append({"title": "Pharmacy", "url": "https://a.example/pharmacy", "keywords": ["pharmacy"]})
+    data["version"] = "2"
+    path.write_text(json.dumps(data))
+    os.utime(path, (time.time() + 5, time.time() + 5))
+    assert catalog_store.current().version == "2"
+    assert catalog_store.current().top_k([], "nearest pharmacy?")[0]["title"] == "Pharmacy"
+
+    path.write_text("{broken")
+    os.utime(path, (time.time() + 10, time.time() + 10))
+    assert catalog_store.current().version == "2" and catalog_store.reload_errors == 1
+
+    session = AgentSession(client_override=StubClient())
+    links = session._select_useful_links("how do I register with a GP?", "Contact a local surgery.")
+    assert links and links[0]["title"] in {"Find a GP", "Register with a GP"}
+
+
+def test_chat_response_fields_are_versioned_and_omitted_when_known():
+    session = AgentSession(client_override=StubClient())
+    fields = {"prompt_suggestions": ["a"], "useful_links": [], "user_profile": {}}
+    versions = main._versioned_fields(session, dict(fields), None)
+
+    again = dict(fields)
+    assert main._versioned_fields(session, again, versions) == versions
+    assert again == {"prompt_suggestions": None, "useful_links": None, "user_profile": None}
+
+    session.user_profile["name"] = "A"
+    changed = dict(fields, user_profile=session.user_profile)
+    new_versions = main._versioned_fields(session, changed, versions)
+    assert new_versions["user_profile"] > versions["user_profile"]
+    assert changed["user_profile"] == {"name": "A"} and changed["useful_links"] is None
+
+
+def test_cancelled_turn_stops_after_the_in_flight_call():
+    cancel = main.Event()
+    client = StubClient()
+    create = client.responses.create
+
+    def create_then_cancel(**kwargs):
+        response = create(**kwargs)
+        cancel.set()
+        return response
+
+    client.responses.create = create_then_cancel
+    session = AgentSession(client_override=client)
+    try:
+        main._cancellable_step(session, "What is NHS 111?", cancel)
+    except llm.TurnCancelled:
+        pass
+    else:
+        raise AssertionError("turn was not cancelled")
+    assert client.responses.calls == 1
+
+
+def test_socket_rejects_bad_payloads_and_cancels_the_turn_when_the_loop_ends(monkeypatch):
+    class FakeSocket:
+        client = None
+
+        def __init__(self, frames):
+            self.frames = list(frames)
+            self.sent = []
+
+        async def accept(self):
+            pass
+
+        async def send_json(self, data):
+            self.sent.append(data)
+
+        async def receive_text(self):
+            await asyncio.sleep(0)
+            if not self.frames:
+                raise RuntimeError("connection reset")
+            return self.frames.pop(0)
+
+    started = []
+
+    async def hold_turn(websocket, session_id, session, message, sent_versions, cancel):
+        started.append(cancel)
+        while not cancel.is_set():
+            await asyncio.sleep(0.001)
+
+    monkeypatch.setattr(agent, "client", StubClient())
+    monkeypatch.setattr(main, "_sessions", {})
+    monkeypatch.setattr(main, "_socket_turn", hold_turn)
+    socket = FakeSocket(["not json", "[1]", '{"message": "hello", "known_versions": 3}'])
+    with pytest.raises(RuntimeError):
+        asyncio.run(main.chat_socket(socket))
+    assert [event["detail"] for event in socket.sent[1:]] == ["Expected a JSON object."] * 2
+    assert len(started) == 1 and started[0].is_set()
+
+
+def test_socket_turn_streams_the_final_reply_before_closing_it(monkeypatch):
+    reply = 'Register with a GP near you.\nUseful links\n- https://x\n\n<USER_PROFILE>{"name": "A"}</USER_PROFILE>'
+
+    class StreamingResponses(StubResponses):
+        def __init__(self):
+            super().__init__()
+            self.streams = []
+
+        def create(self, **kwargs):
+            response = super().create(**kwargs)
+            self.streams.append(bool(kwargs.get("stream")))
+            if not kwargs.get("tools"):
+                return response
+            final = SimpleNamespace(output_text=reply, output=[], id="stub-reply", usage=response.usage)
+            if not kwargs.get("stream"):
+                return final
+            events = [
+                SimpleNamespace(type="response.output_text.delta", delta=reply[i : i + 7])
+                for i in range(0, len(reply), 7)
+            ]
+            return iter(events + [SimpleNamespace(type="response.completed", response=final)])
+
+    class FakeSocket:
+        def __init__(self):
+            self.sent = []
+
+        async def send_json(self, data):
+            self.sent.append(data)
+
+    client = StubClient()
+    client.responses = StreamingResponses()
+    session = AgentSession(client_override=client)
+    socket = FakeSocket()
+    asyncio.run(main._socket_turn(socket, "s1", session, "What is NHS 111?", {}, main.Event()))
+
+    types = [event["type"] for event in socket.sent]
+    deltas = [event["text"] for event in socket.sent if event["type"] == "reply.delta"]
+    closing = socket.sent[types.index("reply")]
+    assert types[0] == "turn.started" and types[1] == "reply.delta" and types[-1] == "turn.done"
+    assert len(deltas) > 1 and types.index("reply") == len(deltas) + 1
+    assert "".join(deltas) == closing["text"]
+    assert client.responses.streams[0] is True and not any(client.responses.streams[1:])
+
+    # The same model reply through the batch path gives the same text.
+    batch_client = StubClient()
+    batch_client.responses = StreamingResponses()
+    assert closing["text"] == AgentSession(client_override=batch_client).step("What is NHS 111?")
+
+
+class TimeoutOnceResponses(StubResponses):
+    def create(self, **kwargs):
+        if self.calls == 0:
+            self.calls += 1
+            self.models.append(kwargs.get("model"))
+            raise openai.APITimeoutError(request=None)
+        return super().create(**kwargs)
+
+
+def test_call_site_registry_routes_models_and_adapts_output_budgets(monkeypatch, tmp_path):
+    overrides = tmp_path / "call_sites.json"
+    overrides.write_text(json.dumps({"prompt_suggestions": {"model": "gpt-4.1-nano"}}), encoding="utf-8")
+    monkeypatch.setenv("CALL_SITE_CONFIG_PATH", str(overrides))
+    registry = CallSiteRegistry.from_env()
+    monkeypatch.setattr(llm, "CALL_SITE_REGISTRY", registry)
+
+    client = StubClient()
+    llm.create_response(client, "prompt_suggestions", input="x")
+    assert client.responses.models == ["gpt-4.1-nano"]
+    assert registry.output_budget("prompt_suggestions") == 120
+
+    for _ in range(30):
+        registry.observe("prompt_suggestions", 40)
+    assert registry.output_budget("prompt_suggestions") == 52
+    for _ in range(10):
+        registry.observe("prompt_suggestions", 60, truncated=True)
+    assert registry.output_budget("prompt_suggestions") == 120
+
+    # Rare text replies keep their own sample, so tool-call decisions do not squeeze them.
+    for _ in range(194):
+        registry.observe("step.first", 20, kind="tool_call")
+    assert registry.output_budget("step.first") == 62
+    for _ in range(6):
+        registry.observe("step.first", 150, kind="text")
+    assert registry.output_budget("step.first") == 250
+    for _ in range(14):
+        registry.observe("step.first", 150, kind="text")
+    assert registry.output_budget("step.first") == 195
+
+    # A reply cut off by the adaptive budget is retried once at the cap.
+    class TruncateOnceResponses(StubResponses):
+        def create(self, **kwargs):
+            response = super().create(**kwargs)
+            self.models.append(kwargs["max_output_tokens"])
+            if self.calls == 1:
+                response.status = "incomplete"
+                response.incomplete_details = SimpleNamespace(reason="max_output_tokens")
+            return response
+
+    client.responses = TruncateOnceResponses()
+    llm.create_response(client, "step.first", input="x")
+    assert client.responses.models[1::2] == [195, 250]
+
+    # A timed-out call is retried once on the call site's fallback model.
+    client.responses = TimeoutOnceResponses()
+    llm.create_response(client, "tool.nhs_111_live_triage", input="x")
+    assert client.responses.models == ["gpt-4o", "gpt-4o-mini"]
+
+
+def test_offline_eval_scores_routing_calls_and_latency(monkeypatch):
+    from benchmarks import eval_triage
+
+    monkeypatch.setattr(tools, "client", None)
+    monkeypatch.setattr(tools, "TRIAGE_PATHWAYS", TriagePathways(mode="on"))
+    dataset = os.path.join(os.path.dirname(__file__), "..", eval_triage.DEFAULT_DATASET)
+    conversations = eval_triage.load_dataset(dataset)
+    conversations.append({"id": "mislabelled", "turns": ["I have chest pain"], "expected_service": "GP"})
+    results = eval_triage.evaluate(conversations, {"time_scale": 0, "seed": 7}, threads=4)
+    report = eval_triage.summarize(results, seconds=1.0)
+
+    # Self-care cases fall back to the simulated model, which always says GP.
+    routing = report["routing"]
+    assert routing["scored"] == len(conversations) and routing["under_triaged"] == 0
+    actual = {row["id"]: row["actual"] for row in results}
+    assert actual["sore-throat-not-breathing"] == "A&E" and actual["ankle-cannot-weight"] == "NHS_111"
+    assert actual["knee-not-healing"] == "GP" and actual["ankle-bare-no"] == "GP"
+    assert {"id": "mislabelled", "expected": "GP", "actual": "A&E"} in routing["mismatches"]
+    assert routing["confusion"]["GP"]["A&E"] == 1
+    assert report["model_calls"]["max"] >= 4 and report["errors"] == 0
+    assert report["turns"] == sum(len(item["turns"]) for item in conversations)
+
+
+def test_rate_limits_per_session_and_ip_with_retry_after(monkeypatch):
+    now = [0.0]
+    limiter = RateLimiter(
+        {
+            ("llm", "session"): parse_limit("2/60"),
+            ("llm", "ip"): parse_limit("3/60"),
+            ("cheap", "session"): parse_limit("10/60"),
+        },
+        clock=lambda: now[0],
+    )
+    limiter.check("llm", "a", "1.2.3.4")
+    limiter.check("llm", "a", "1.2.3.4")
+    try:
+        limiter.check("llm", "a", "1.2.3.4")
+    except RateLimited as exc:
+        assert exc.scope == "session" and exc.retry_after == 30
+    else:
+        raise AssertionError("session bucket was not enforced")
+    # Cheap turns have their own bucket; the IP bucket is shared across sessions.
+    limiter.check("cheap", "a", "1.2.3.4")
+    limiter.check("llm", "b", "1.2.3.4")
+    monkeypatch.setattr(main, "RATE_LIMITER", limiter)
+    try:
+        main._check_rate_limit("llm", "c", "1.2.3.4")
+    except main.HTTPException as exc:
+        assert exc.status_code == 429 and exc.headers == {"Retry-After": "20"}
+    else:
+        raise AssertionError("ip bucket was not enforced")
+
+    now[0] = 30.0
+    limiter.check("llm", "a", "1.2.3.4")
+    assert limiter.limited == 2
+
+    # A refused turn creates no session, and without a session_id only the IP bucket counts.
+    monkeypatch.setattr(main, "_sessions", {})
+    try:
+        main._chat_turn(main.ChatRequest(message="how do I see a GP?"), "1.2.3.4")
+    except main.HTTPException as exc:
+        assert exc.status_code == 429
+    else:
+        raise AssertionError("ip bucket was not enforced")
+    assert main._sessions == {}
+    assert AgentSession(client_override=StubClient()).is_deterministic_turn("onboard me")
+
+
+def _served_order(scheduler, arrivals):
+    import threading
+
+    order = []
+    with scheduler.slot("qa"):
+        threads = []
+        for priority, delay in arrivals:
+            def run(priority=priority):
+                with scheduler.slot(priority):
+                    order.append(priority)
+
+            thread = threading.Thread(target=run)
+            thread.start()
+            threads.append(thread)
+            time.sleep(delay)
+        while scheduler.snapshot()["waiting"] < len(arrivals):
+            time.sleep(0.001)
+    for thread in threads:
+        thread.join()
+    return order
+
+
+def test_scheduler_serves_by_priority_with_aging():
+    scheduler = CallScheduler(max_concurrent=1, aging_seconds=60)
+    assert _served_order(scheduler, [("best_effort", 0.01), ("qa", 0.01), ("triage", 0)]) == [
+        "triage",
+        "qa",
+        "best_effort",
+    ]
+    stats = scheduler.snapshot()["classes"]
+    assert stats["best_effort"]["queued"] == 1 and stats["best_effort"]["max_wait_ms"] > 0
+
+    # Waiting one aging period is worth one class.
+    aged = CallScheduler(max_concurrent=1, aging_seconds=0.05)
+    assert _served_order(aged, [("best_effort", 0.15), ("triage", 0)]) == ["best_effort", "triage"]
+
+    with turn_priority("triage"):
+        assert effective_priority("qa") == "triage" and effective_priority("best_effort") == "best_effort"
+
+
+def test_profiler_writes_folded_stacks_and_memory_for_admin_turns(tmp_path):
+    profiler = Profiler(output_dir=str(tmp_path), admin_token="secret", interval_ms=1)
+    with profiler.turn("wrong") as profile:
+        assert profile is None
+
+    def busy(seconds):
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            json.dumps({"spin": list(range(50))})
+
+    with profiler.turn("secret") as profile:
+        profile.session_id = "s/1"
+        AgentSession(client_override=StubClient()).step("What is NHS 111?")
+        agent._tool_executor.submit(contextvars.copy_context().run, follow(busy), 0.05).result()
+
+    base = tmp_path / f"s_1-{profile.turn_id}"
+    folded = (base.parent / (base.name + ".cpu.folded")).read_text().splitlines()
+    assert folded and all(line.rsplit(" ", 1)[1].isdigit() for line in folded)
+    assert any("busy (test_workflows.py" in line for line in folded)
+    meta = json.loads((base.parent / (base.name + ".json")).read_text())
+    assert meta["session_id"] == "s/1" and meta["samples"] > 0 and meta["top_self_frames"]
+    assert (base.parent / (base.name + ".mem.txt")).read_text().startswith("peak traced memory")
+
+
+def test_tool_registry_applies_cache_retry_and_timeout_policies(monkeypatch):
+    assert [tool["name"] for tool in tools.tools] == [
+        "nearest_nhs_services",
+        "trigger_safety_protocol",
+        "guided_search",
+        "nhs_111_live_triage",
+    ]
+    registry = ToolRegistry(default_timeout=5)
+    calls = []
+
+    def lookup(args):
+        calls.append(args)
+        time.sleep(0.05)
+        if len(calls) == 1:
+            raise ConnectionError("flaky")
+        return [{"name": "Camden GP", "n": args.get("n", 3)}]
+
+    parameters = {"type": "object", "properties": {"pc": {"type": "string"}, "n": {"type": "integer", "default": 3}}}
+    registry.register(
+        ToolSpec(
+            "lookup",
+            "",
+            parameters,
+            lookup,
+            retries=1,
+            retry_on=(ConnectionError,),
+            retry_backoff=0,
+            cache_ttl=60,
+            speculative=True,
+        )
+    )
+    registry.register(ToolSpec("stuck", "", {}, lambda _args: time.sleep(0.3), timeout=0.05))
+    monkeypatch.setattr(agent, "TOOL_REGISTRY", registry)
+
+    # One retried execution serves the prefetch, the joined call and the cached call.
+    agent.prefetch_tool("lookup", {"pc": "NW1 2BU"})
+    first, stuck = agent.run_tool_calls([("lookup", {"pc": "NW1 2BU", "n": 3}), ("stuck", {})])
+    assert agent.run_tool("lookup", {"pc": "NW1 2BU"}) == first == [{"name": "Camden GP", "n": 3}]
+    assert len(calls) == 2
+    assert stuck == {"error": "stuck failed: timed out after 0.05s"}
+
+    stats = registry.snapshot()
+    assert stats["lookup"]["calls"] == 3 and stats["lookup"]["cache_hits"] == 2 and stats["lookup"]["retries"] == 1
+    assert stats["stuck"]["timeouts"] == 1
+
+    # Lone calls run on the caller's thread, so concurrent sessions never queue behind each other.
+    registry.register(ToolSpec("nap", "", {}, lambda _args: (time.sleep(0.2), threading.current_thread().name)[1]))
+    with ThreadPoolExecutor(max_workers=12) as sessions:
+        started = time.perf_counter()
+        names = list(sessions.map(lambda _: agent.run_tool_calls([("nap", {})])[0], range(12)))
+    assert time.perf_counter() - started < 0.35
+    assert not any(name.startswith("evi-tool") for name in names)
+    # Parallel rounds share the one bounded pool.
+    assert all(name.startswith("evi-tool") for name in agent.run_tool_calls([("nap", {}), ("nap", {})]))
+
+
+def test_cancelled_owner_does_not_cancel_joined_calls_from_other_sessions():
+    registry = ToolRegistry(default_timeout=5)
+    calls = []
+
+    def lookup(args):
+        calls.append(threading.current_thread().name)
+        time.sleep(0.1)
+        if len(calls) == 1:
+            # The owning turn is cancelled mid-call.
+            raise llm.TurnCancelled()
+        return ["Camden GP"]
+
+    registry.register(ToolSpec("lookup", "", {}, lookup, cache_ttl=60))
+    outcomes = {}
+
+    def owner():
+        try:
+            registry.execute("lookup", {"pc": "NW1"})
+        except llm.TurnCancelled:
+            outcomes["owner"] = "cancelled"
+
+    def joiner():
+        time.sleep(0.03)
+        outcomes["joiner"] = registry.execute("lookup", {"pc": "NW1"})
+
+    threads = [threading.Thread(target=owner), threading.Thread(target=joiner)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert outcomes == {"owner": "cancelled", "joiner": ["Camden GP"]}
+    assert len(calls) == 2
@@ -0,0 +1,304 @@
+"""Declared tools and the policies the dispatcher applies to every call.
+
+Each tool is registered once with a ``ToolSpec``: its JSON schema (the
+``tools`` list offered to the model is generated from the registry), its
+handler and its execution policy:
+
+- ``timeout``: seconds a call may run (default ``TOOL_TIMEOUT_SECONDS``,
+  45). ``agent.run_tool_calls`` enforces it from when the call starts when a
+  round has several calls; a lone call on the request thread is only counted
+  as timed out.
+- ``max_concurrency``: calls of this tool running at once across all
+  sessions; further calls wait for a slot for up to ``timeout``. The shared
+  tool pool in ``agent`` is sized above the sum of these limits.
+- ``retries`` and ``retry_on``: extra attempts after one of the listed
+  exceptions, ``retry_backoff`` seconds apart, doubling each time.
+- ``cache_ttl``: seconds a successful result is reused for the same
+  arguments (0 never caches). Concurrent calls with the same arguments share
+  one execution. ``TOOL_CACHE=off`` turns caching off for every tool.
+- ``speculative``: the tool only reads, so it may be started before the
+  model asks for it and its result left in the cache.
+
+Arguments are keyed with the schema's defaults filled in, so ``{"n": 3}``
+and an omitted ``n`` share a cache entry. Calls, errors, cache hits,
+retries, timeouts and time spent are kept per tool and reported by
+``GET /api/usage``.
+"""
+
+import json
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import BoundedSemaphore, Lock
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Type
+
+from tracing import span
+
+CACHE_MAX_ENTRIES = 1024
+
+ArgsKey = Tuple[str, str]
+
+# Handed to callers joined to an execution whose owner was cancelled.
+_RETRY = object()
+
+
+class ToolTimeout(TimeoutError):
+    """A tool call did not finish within its timeout."""
+
+
+class ToolSpec:
+    __slots__ = (
+        "name",
+        "description",
+        "parameters",
+        "handler",
+        "timeout",
+        "max_concurrency",
+        "retries",
+        "retry_on",
+        "retry_backoff",
+        "cache_ttl",
+        "speculative",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        parameters: Dict[str, Any],
+        handler: Callable[[Dict[str, Any]], Any],
+        timeout: Optional[float] = None,
+        max_concurrency: Optional[int] = None,
+        retries: int = 0,
+        retry_on: Tuple[Type[BaseException], ...] = (),
+        retry_backoff: float = 1.0,
+        cache_ttl: float = 0.0,
+        speculative: bool = False,
+    ):
+        self.name = name
+        self.description = description
+        self.parameters = parameters
+        self.handler = handler
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.retry_on = retry_on
+        self.retry_backoff = retry_backoff
+        self.cache_ttl = cache_ttl
+        self.speculative = speculative
+
+    def schema(self) -> Dict[str, Any]:
+        return {
+            "type": "function",
+            "name": self.name,
+            "description": self.description,
+            "parameters": self.parameters,
+        }
+
+    def with_defaults(self, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        filled = {
+            key: prop["default"]
+            for key, prop in (self.parameters.get("properties") or {}).items()
+            if isinstance(prop, dict) and "default" in prop
+        }
+        filled.update(arguments or {})
+        return filled
+
+
+class _ToolStats:
+    __slots__ = ("calls", "errors", "cache_hits", "retries", "timeouts", "total")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.total = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        executed = self.calls - self.cache_hits
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "cache_hits": self.cache_hits,
+            "retries": self.retries,
+            "timeouts": self.timeouts,
+            "mean_ms": round(self.total / executed * 1000, 2) if executed else 0.0,
+        }
+
+
+class ToolRegistry:
+    """Registered tools; ``execute`` applies each tool's policy around its handler."""
+
+    def __init__(self, default_timeout: float = 45.0, cache_enabled: bool = True):
+        self.default_timeout = default_timeout
+        self.cache_enabled = cache_enabled
+        self._specs: Dict[str, ToolSpec] = {}
+        self._slots: Dict[str, BoundedSemaphore] = {}
+        self._stats: Dict[str, _ToolStats] = {}
+        self._cache: "OrderedDict[ArgsKey, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[ArgsKey, Future] = {}
+        self._lock = Lock()
+
+    @classmethod
+    def from_env(cls) -> "ToolRegistry":
+        return cls(
+            default_timeout=float(os.getenv("TOOL_TIMEOUT_SECONDS", "45")),
+            cache_enabled=os.getenv("TOOL_CACHE", "on").strip().lower() not in {"off", "0", "false"},
+        )
+
+    def register(self, spec: ToolSpec) -> ToolSpec:
+        if spec.name in self._specs:
+            raise ValueError(f"Tool {spec.name!r} is already registered.")
+        self._specs[spec.name] = spec
+        if spec.max_concurrency:
+            self._slots[spec.name] = BoundedSemaphore(spec.max_concurrency)
+        self._stats[spec.name] = _ToolStats()
+        return spec
+
+    def get(self, name: str) -> Optional[ToolSpec]:
+        return self._specs.get(name)
+
+    def schemas(self, exclude: Iterable[str] = ()) -> List[Dict[str, Any]]:
+        skipped = set(exclude)
+        return [spec.schema() for name, spec in self._specs.items() if name not in skipped]
+
+    def concurrency(self, unlimited: int) -> int:
+        """Sum of every tool's ``max_concurrency``, counting ``unlimited`` for tools without one."""
+        return sum(spec.max_concurrency or unlimited for spec in self._specs.values())
+
+    def timeout(self, name: str) -> float:
+        spec = self._specs.get(name)
+        if spec is None or spec.timeout is None:
+            return self.default_timeout
+        return spec.timeout
+
+    def can_prefetch(self, name: str) -> bool:
+        spec = self._specs.get(name)
+        return spec is not None and spec.speculative and spec.cache_ttl > 0 and self.cache_enabled
+
+    def record_timeout(self, name: str) -> None:
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is not None:
+                stats.timeouts += 1
+
+    def clear_cache(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def execute(self, name: str, arguments: Dict[str, Any]) -> Any:
+        """Run one call of ``name``; unknown tools return an error string."""
+        spec = self._specs.get(name)
+        if spec is None:
+            return f"[Error: Unknown tool '{name}']"
+        with span(f"tool.{name}") as current:
+            if not (spec.cache_ttl > 0 and self.cache_enabled):
+                return self._run(spec, arguments)
+            key = (name, json.dumps(spec.with_defaults(arguments), sort_keys=True, default=str))
+            while True:
+                now = time.monotonic()
+                with self._lock:
+                    stats = self._stats[name]
+                    cached = self._cache.get(key)
+                    if cached is not None and cached[0] > now:
+                        self._cache.move_to_end(key)
+                        stats.calls += 1
+                        stats.cache_hits += 1
+                        if current is not None:
+                            current.set(**{"tool.cache": "hit"})
+                        return cached[1]
+                    shared = self._inflight.get(key)
+                    if shared is None:
+                        owned: Future = Future()
+                        self._inflight[key] = owned
+                if shared is None:
+                    break
+                # The same call is already running (often a prefetch); wait for it.
+                if current is not None:
+                    current.set(**{"tool.cache": "joined"})
+                result = shared.result(timeout=self.timeout(name))
+                if result is not _RETRY:
+                    with self._lock:
+                        stats.calls += 1
+                        stats.cache_hits += 1
+                    return result
+                # The owner's turn was cancelled; run the call ourselves.
+            if current is not None:
+                current.set(**{"tool.cache": "miss"})
+            try:
+                result = self._run(spec, arguments)
+            except Exception as exc:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                owned.set_exception(exc)
+                raise
+            except BaseException:
+                # A cancelled turn (TurnCancelled) belongs to its own session only.
+                with self._lock:
+                    self._inflight.pop(key, None)
+                owned.set_result(_RETRY)
+                raise
+            with self._lock:
+                self._inflight.pop(key, None)
+                if not (isinstance(result, dict) and result.get("error")):
+                    self._cache[key] = (time.monotonic() + spec.cache_ttl, result)
+                    self._cache.move_to_end(key)
+                    while len(self._cache) > CACHE_MAX_ENTRIES:
+                        self._cache.popitem(last=False)
+            owned.set_result(result)
+            return result
+
+    def _run(self, spec: ToolSpec, arguments: Dict[str, Any]) -> Any:
+        slot = self._slots.get(spec.name)
+        timeout = self.timeout(spec.name)
+        if slot is not None and not slot.acquire(timeout=timeout):
+            self._record(spec.name, 0.0, error=True)
+            raise ToolTimeout(f"no free slot for {spec.name} within {timeout:g}s")
+        started = time.perf_counter()
+        attempt = 0
+        try:
+            while True:
+                try:
+                    result = spec.handler(arguments)
+                    break
+                except spec.retry_on:
+                    if attempt >= spec.retries:
+                        raise
+                    time.sleep(spec.retry_backoff * (2 ** attempt))
+                    attempt += 1
+        except Exception:
+            self._record(spec.name, time.perf_counter() - started, error=True, retries=attempt)
+            raise
+        finally:
+            if slot is not None:
+                slot.release()
+        self._record(spec.name, time.perf_counter() - started, error=False, retries=attempt)
+        return result
+
+    def _record(self, name: str, seconds: float, error: bool, retries: int = 0) -> None:
+        with self._lock:
+            stats = self._stats[name]
+            stats.calls += 1
+            stats.errors += int(error)
+            stats.retries += retries
+            stats.total += seconds
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                name: {
+                    "timeout": self.timeout(name),
+                    "max_concurrency": spec.max_concurrency,
+                    "max_retries": spec.retries,
+                    "cache_ttl": spec.cache_ttl if self.cache_enabled else 0,
+                    "speculative": spec.speculative,
+                    **self._stats[name].as_dict(),
+                }
+                for name, spec in self._specs.items()
+            }
+
+
+TOOL_REGISTRY = ToolRegistry.from_env()
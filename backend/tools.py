@@ -1,16 +1,30 @@
 """Tool implementations for onboarding, safety, triage, search, and lookups."""
 
+import contextvars
 import json
 import os
+import statistics
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Any, Deque, Dict, Optional
 from urllib.parse import quote_plus
 
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import APITimeoutError, OpenAI, RateLimitError
 
+from cassettes import CASSETTE
 from config import ONBOARDING_QUESTIONS
+from keywords import scan_keywords
+from llm import create_response
+from pathways import TRIAGE_PATHWAYS
+from profiling import follow
+from tool_registry import TOOL_REGISTRY, ToolSpec
+from tracing import span
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+client = CASSETTE.wrap(OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None)
 
 
 
@@ -48,28 +62,8 @@ Then briefly confirm onboarding is complete.
 # ---------------------------------------------------------
 # Safety Classifier (Red-Flag Detection)
 # ---------------------------------------------------------
-RED_FLAG_KEYWORDS = [
-    "chest pain",
-    "severe bleeding",
-    "not breathing",
-    "can't breathe",
-    "suicidal",
-    "harm myself",
-    "overdose",
-    "unconscious",
-    "collapse",
-    "stroke",
-    "heart attack",
-    "seizure",
-    "very high fever",
-    "severe allergic",
-    "anaphylaxis",
-]
-
-
 def safety_check(message):
-    msg = message.lower()
-    return any(k in msg for k in RED_FLAG_KEYWORDS)
+    return "red_flag" in scan_keywords(message)
 
 
 
@@ -121,8 +115,9 @@ Return STRICT JSON: a list of up to {n} objects with:
 The page is already nearest-first; take the top results.
 """
 
-    resp = client.responses.create(
-        model="gpt-4o",
+    resp = create_response(
+        client,
+        "tool.nearest_nhs_services",
         tools=[{"type": "web_search_preview"}],
         input=prompt,
     )
@@ -146,6 +141,85 @@ ALLOWED_DOMAINS = [
 ]
 
 
+# Speculative mode starts the broad search once the restricted one has run for
+# its typical (median) latency, instead of only after it has failed.
+GUIDED_SEARCH_SPECULATIVE = os.getenv("GUIDED_SEARCH_SPECULATIVE", "").strip().lower() in {"1", "true", "yes"}
+GUIDED_SEARCH_HEDGE_SECONDS = os.getenv("GUIDED_SEARCH_HEDGE_SECONDS", "").strip()
+DEFAULT_HEDGE_SECONDS = 4.0
+_restricted_latencies: Deque[float] = deque(maxlen=50)
+_search_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="evi-search")
+
+
+def _has_allowlisted_domain(text: str) -> bool:
+    lower_text = text.lower()
+    return any(d in lower_text for d in ALLOWED_DOMAINS)
+
+
+def _restricted_qualifies(text: str) -> bool:
+    return len(text.strip()) >= 200 and _has_allowlisted_domain(text)
+
+
+def _web_search(call_site: str, query: str):
+    return create_response(
+        client,
+        call_site,
+        input=query,
+        tools=[{"type": "web_search_preview"}],
+        tool_choice={"type": "web_search_preview"},
+    )
+
+
+def _hedge_delay() -> float:
+    if GUIDED_SEARCH_HEDGE_SECONDS:
+        return float(GUIDED_SEARCH_HEDGE_SECONDS)
+    if len(_restricted_latencies) >= 5:
+        return statistics.median(_restricted_latencies)
+    return DEFAULT_HEDGE_SECONDS
+
+
+def _submit_search(call_site: str, query: str) -> Future:
+    return _search_executor.submit(contextvars.copy_context().run, follow(_web_search), call_site, query)
+
+
+def _search_text(future: Future, timeout: Optional[float] = None) -> Optional[str]:
+    """Text of a finished search, or None if it failed; raises on timeout."""
+    try:
+        return future.result(timeout=timeout).output_text or ""
+    except FutureTimeout:
+        raise
+    except Exception:
+        return None
+
+
+def _speculative_search(restricted_query: str, broad_query: str) -> Dict[str, Any]:
+    started = time.monotonic()
+    restricted = _submit_search("tool.guided_search.restricted", restricted_query)
+
+    def _note_latency(done: Future) -> None:
+        if not done.cancelled() and done.exception() is None:
+            _restricted_latencies.append(time.monotonic() - started)
+
+    restricted.add_done_callback(_note_latency)
+    broad: Optional[Future] = None
+    try:
+        restricted_text = _search_text(restricted, timeout=_hedge_delay())
+    except FutureTimeout:
+        # Restricted search is slower than usual: start the broad one alongside it.
+        broad = _submit_search("tool.guided_search.broad", broad_query)
+        restricted_text = _search_text(restricted)
+
+    if restricted_text is not None and _restricted_qualifies(restricted_text):
+        if broad is not None:
+            # Only a queued search can be cancelled; the sync client cannot abort
+            # one already in flight, so its result is simply dropped.
+            broad.cancel()
+        return {"context": restricted_text, "sources": [], "fallback_used": False}
+
+    if broad is None:
+        broad = _submit_search("tool.guided_search.broad", broad_query)
+    return {"context": broad.result().output_text or "", "sources": [], "fallback_used": True}
+
+
 def guided_search(args, max_results_default: int = 5):
     """
     Allowlist-first retrieval using ONLY OpenAI web_search_preview.
@@ -163,46 +237,28 @@ def guided_search(args, max_results_default: int = 5):
     if not query:
         return {"context": "", "sources": [], "fallback_used": False}
 
-    def _has_allowlisted_domain(text: str) -> bool:
-        lower_text = text.lower()
-        return any(d in lower_text for d in ALLOWED_DOMAINS)
-
     site_filter = " OR ".join([f"site:{d}" for d in ALLOWED_DOMAINS])
     restricted_query = (
         f"({query}) ({site_filter}). "
         f"Prefer answers from these sites only. Return up to {max_results} relevant results with citations."
     )
+    broad_query = f"{query}. Return up to {max_results} relevant results with citations."
 
-    restricted_resp = client.responses.create(
-        model="gpt-4o-mini",
-        input=restricted_query,
-        tools=[{"type": "web_search_preview"}],
-        tool_choice={"type": "web_search_preview"},
-        max_output_tokens=1200,
-    )
+    if GUIDED_SEARCH_SPECULATIVE:
+        return _speculative_search(restricted_query, broad_query)
 
+    restricted_resp = _web_search("tool.guided_search.restricted", restricted_query)
     restricted_text = restricted_resp.output_text or ""
     restricted_sources = []
 
-    too_short = len(restricted_text.strip()) < 200
-    no_allowlisted_cites = not _has_allowlisted_domain(restricted_text)
-
-    if not (too_short or no_allowlisted_cites):
+    if _restricted_qualifies(restricted_text):
         return {
             "context": restricted_text,
             "sources": restricted_sources,
             "fallback_used": False,
         }
 
-    broad_query = f"{query}. Return up to {max_results} relevant results with citations."
-
-    broad_resp = client.responses.create(
-        model="gpt-4o-mini",
-        input=broad_query,
-        tools=[{"type": "web_search_preview"}],
-        tool_choice={"type": "web_search_preview"},
-        max_output_tokens=1200,
-    )
+    broad_resp = _web_search("tool.guided_search.broad", broad_query)
 
     return {
         "context": broad_resp.output_text or "",
@@ -211,8 +267,6 @@ def guided_search(args, max_results_default: int = 5):
     }
 
 
-
-
 def _parse_triage_json(raw: str):
     if not raw:
         return None
@@ -235,13 +289,24 @@ def nhs_111_live_triage(args):
     """
     Lightweight LLM-led triage + routing for NHS 111.
     Returns either follow-up questions (need_more_info) or a final routing decision.
+    Presentations covered by the local pathways never reach the model.
     """
-    if client is None:
-        return {"raw": "", "error": "OpenAI client not configured"}
     presenting_issue = args.get("presenting_issue")
     postcode_full = args.get("postcode_full")
     known_answers = args.get("known_answers", {}) or {}
 
+    with span("triage.pathways") as current:
+        routed = TRIAGE_PATHWAYS.evaluate(presenting_issue or "", known_answers, postcode_full or "")
+        if current is not None:
+            current.set(covered=routed is not None)
+            if routed is not None:
+                current.set(pathway=routed[0], pathway_version=TRIAGE_PATHWAYS.graph.version)
+    if routed is not None:
+        return routed[1]
+
+    if client is None:
+        return {"raw": "", "error": "OpenAI client not configured"}
+
     prompt = f"""
 You are NHS 101, a lightweight triage router for international students. NON-DIAGNOSTIC.
 
@@ -318,12 +383,12 @@ should_lookup = true ONLY if:
 - suggested_service is "GP" or "A&E"
 - AND postcode_full is provided in inputs.
 """
-    resp = client.responses.create(
-        model="gpt-4o",
+    resp = create_response(
+        client,
+        "tool.nhs_111_live_triage",
         input=prompt,
         tools=[{"type": "web_search_preview"}],
         tool_choice="auto",
-        max_output_tokens=700,
     )
 
     raw = resp.output_text or ""
@@ -336,11 +401,11 @@ should_lookup = true ONLY if:
         + "\nReturn ONLY valid JSON. No markdown, no commentary. "
         "If unsure, still choose the safest routing based on the rules."
     )
-    strict_resp = client.responses.create(
-        model="gpt-4o-mini",
+    strict_resp = create_response(
+        client,
+        "tool.nhs_111_live_triage.strict",
         input=strict_prompt,
         tool_choice="none",
-        max_output_tokens=500,
     )
     strict_raw = strict_resp.output_text or ""
     parsed = _parse_triage_json(strict_raw)
@@ -350,15 +415,36 @@ should_lookup = true ONLY if:
     return {"raw": raw or strict_raw, "error": "Could not parse triage result as JSON"}
 
 
-tools = [
-    {
-        "type": "function",
-        "name": "nearest_nhs_services",
-        "description": (
+def tool_nearest_nhs_services(args):
+    """Wrapper to expose nearest_nhs_services to the tool dispatcher."""
+    return nearest_nhs_services(
+        postcode_full=args["postcode_full"],
+        service_type=args["service_type"],
+        n=args.get("n", 3),
+    )
+
+
+def tool_safety(_args):
+    """Return the standard emergency safety response."""
+    return emergency_response()
+
+
+# ---------------------------------------------------------
+# Tool declarations: schema, handler and execution policy
+# ---------------------------------------------------------
+# Lookups are read-only and keyed by their arguments, so they are cached and
+# retried when the API pushes back; live triage depends on the conversation
+# and is never reused.
+TRANSIENT_ERRORS = (RateLimitError, APITimeoutError)
+
+TOOL_REGISTRY.register(
+    ToolSpec(
+        name="nearest_nhs_services",
+        description=(
             "Given a FULL UK postcode and service type, open the NHS service-search "
             "results page and return the nearest 2–3 options."
         ),
-        "parameters": {
+        parameters={
             "type": "object",
             "properties": {
                 "postcode_full": {
@@ -374,26 +460,39 @@ tools = [
             },
             "required": ["postcode_full", "service_type"],
         },
-    },
-    {
-        "type": "function",
-        "name": "trigger_safety_protocol",
-        "description": "Safety response for dangerous symptoms.",
-        "parameters": {
+        handler=tool_nearest_nhs_services,
+        timeout=60.0,
+        max_concurrency=8,
+        retries=1,
+        retry_on=TRANSIENT_ERRORS,
+        cache_ttl=3600.0,
+        speculative=True,
+    )
+)
+
+TOOL_REGISTRY.register(
+    ToolSpec(
+        name="trigger_safety_protocol",
+        description="Safety response for dangerous symptoms.",
+        parameters={
             "type": "object",
             "properties": {"message": {"type": "string"}},
             "required": ["message"],
         },
-    },
-    {
-        "type": "function",
-        "name": "guided_search",
-        "description": (
+        handler=tool_safety,
+        timeout=5.0,
+    )
+)
+
+TOOL_REGISTRY.register(
+    ToolSpec(
+        name="guided_search",
+        description=(
             "Search approved NHS/LBS sites first using OpenAI Web Search. "
             "If nothing relevant is found, run a general OpenAI Web Search fallback. "
             "Never scrape manually."
         ),
-        "parameters": {
+        parameters={
             "type": "object",
             "properties": {
                 "query": {"type": "string"},
@@ -401,17 +500,24 @@ tools = [
             },
             "required": ["query"],
         },
-    },
-    {
-        "type": "function",
-        "name": "nhs_111_live_triage",
-        "description": (
+        handler=guided_search,
+        max_concurrency=8,
+        retries=1,
+        retry_on=TRANSIENT_ERRORS,
+        cache_ttl=600.0,
+    )
+)
+
+TOOL_REGISTRY.register(
+    ToolSpec(
+        name="nhs_111_live_triage",
+        description=(
             "Lightweight triage + routing via live navigation of https://111.nhs.uk/ "
             "using OpenAI's web viewing/computer-use capability. "
             "Returns a structured routing result and a flag to chain to nearest_nhs_services "
             "when GP or A&E is recommended and full postcode is provided."
         ),
-        "parameters": {
+        parameters={
             "type": "object",
             "properties": {
                 "presenting_issue": {
@@ -438,19 +544,9 @@ tools = [
             },
             "required": ["presenting_issue"],
         },
-    },
-]
-
-
-def tool_nearest_nhs_services(args):
-    """Wrapper to expose nearest_nhs_services to the tool dispatcher."""
-    return nearest_nhs_services(
-        postcode_full=args["postcode_full"],
-        service_type=args["service_type"],
-        n=args.get("n", 3),
+        handler=nhs_111_live_triage,
+        timeout=80.0,
     )
+)
 
-
-def tool_safety(_args):
-    """Return the standard emergency safety response."""
-    return emergency_response()
+tools = TOOL_REGISTRY.schemas()
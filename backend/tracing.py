@@ -0,0 +1,199 @@
+"""Per-request span trees for ``/api/chat`` turns.
+
+A trace is started per request only when it will be used: the client sent
+the debug header, or ``TRACE_EXPORT_PATH`` is set. Code anywhere below the
+request opens child spans with ``span(name, **attributes)``. Each span records
+its start and end times and attributes such as the step branch, retry attempt
+or token usage. Outside a trace ``span`` is a no-op.
+
+``Trace.waterfall`` is the compact inline form returned to the client.
+``Trace.to_otlp`` is OTLP/JSON (``ExportTraceServiceRequest``) and is appended
+one line per trace to the ``TRACE_EXPORT_PATH`` file.
+"""
+
+import json
+import os
+import secrets
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from typing import Any, Dict, Iterator, List, Optional
+
+DEBUG_HEADER = "X-Evi-Debug-Trace"
+SERVICE_NAME = "evi-backend"
+
+_current: ContextVar[Optional["Span"]] = ContextVar("evi_trace_span", default=None)
+_export_lock = Lock()
+
+
+class Span:
+    __slots__ = ("trace", "name", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = dict(attributes)
+        self.error: Optional[str] = None
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+
+class Trace:
+    """Spans of one request, in start order."""
+
+    def __init__(self, name: str, **attributes: Any):
+        self.trace_id = secrets.token_hex(16)
+        self.spans: List[Span] = []
+        self._lock = Lock()
+        self.root = self._open(name, None, attributes)
+
+    def _open(self, name: str, parent_id: Optional[str], attributes: Dict[str, Any]) -> Span:
+        new_span = Span(self, name, parent_id, attributes)
+        with self._lock:
+            self.spans.append(new_span)
+        return new_span
+
+    def totals(self) -> Dict[str, int]:
+        totals: Dict[str, int] = {}
+        for item in self.spans:
+            for key in ("llm.input_tokens", "llm.cached_tokens", "llm.output_tokens"):
+                if key in item.attributes:
+                    short = key.split(".", 1)[1]
+                    totals[short] = totals.get(short, 0) + int(item.attributes[key] or 0)
+        return totals
+
+    def waterfall(self) -> Dict[str, Any]:
+        depths: Dict[Optional[str], int] = {None: -1}
+        rows = []
+        for item in self.spans:
+            depth = depths.get(item.parent_id, 0) + 1
+            depths[item.span_id] = depth
+            row = {
+                "name": item.name,
+                "depth": depth,
+                "start_ms": round((item.start_ns - self.root.start_ns) / 1e6, 2),
+                "duration_ms": round(item.duration_ms, 2),
+            }
+            if item.attributes:
+                row["attributes"] = item.attributes
+            if item.error:
+                row["error"] = item.error
+            rows.append(row)
+        return {
+            "trace_id": self.trace_id,
+            "duration_ms": round(self.root.duration_ms, 2),
+            "tokens": self.totals(),
+            "spans": rows,
+        }
+
+    def to_otlp(self) -> Dict[str, Any]:
+        spans = []
+        for item in self.spans:
+            record = {
+                "traceId": self.trace_id,
+                "spanId": item.span_id,
+                "name": item.name,
+                "kind": 2 if item is self.root else 1,
+                "startTimeUnixNano": str(item.start_ns),
+                "endTimeUnixNano": str(item.end_ns or item.start_ns),
+                "attributes": [_otlp_attribute(key, value) for key, value in item.attributes.items()],
+                "status": {"code": 2, "message": item.error} if item.error else {"code": 1},
+            }
+            if item.parent_id:
+                record["parentSpanId"] = item.parent_id
+            spans.append(record)
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {"attributes": [_otlp_attribute("service.name", SERVICE_NAME)]},
+                    "scopeSpans": [{"scope": {"name": "evi.tracing"}, "spans": spans}],
+                }
+            ]
+        }
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        wrapped = {"boolValue": value}
+    elif isinstance(value, int):
+        wrapped = {"intValue": str(value)}
+    elif isinstance(value, float):
+        wrapped = {"doubleValue": value}
+    else:
+        wrapped = {"stringValue": value if isinstance(value, str) else json.dumps(value, default=str)}
+    return {"key": key, "value": wrapped}
+
+
+def export_path() -> str:
+    return os.getenv("TRACE_EXPORT_PATH", "").strip()
+
+
+def tracing_wanted(debug: bool) -> bool:
+    """Trace when exporting, or when an admin asked for the waterfall inline."""
+    return bool(export_path()) or debug
+
+
+@contextmanager
+def start_trace(name: str, **attributes: Any) -> Iterator[Trace]:
+    """Open a trace with ``name`` as the root span and make it current."""
+    trace = Trace(name, **attributes)
+    token = _current.set(trace.root)
+    try:
+        yield trace
+    except BaseException as exc:
+        trace.root.error = repr(exc)
+        raise
+    finally:
+        trace.root.end_ns = time.time_ns()
+        _current.reset(token)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Child span of the current span; yields None when no trace is active."""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    child = parent.trace._open(name, parent.span_id, attributes)
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as exc:
+        child.error = repr(exc)
+        raise
+    finally:
+        child.end_ns = time.time_ns()
+        _current.reset(token)
+
+
+def annotate(**attributes: Any) -> None:
+    """Set attributes on the current span, if any."""
+    current = _current.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def export(trace: Trace) -> None:
+    """Append the trace as one OTLP/JSON line to ``TRACE_EXPORT_PATH``."""
+    path = export_path()
+    if not path:
+        return
+    line = json.dumps(trace.to_otlp(), separators=(",", ":")) + "\n"
+    with _export_lock:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "a", encoding="utf-8") as handle:
+            handle.write(line)
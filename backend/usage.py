@@ -0,0 +1,181 @@
+"""Token and cost accounting per call site, model, session and day, with budgets.
+
+``llm.create_response`` reports every response's usage here. Totals are kept
+per call site and model for the process and per UTC day. Each
+``AgentSession`` carries a ``SessionUsage`` that is made current for the
+duration of ``step()``, so tool calls count against the session that made
+them.
+
+Two optional budgets are read from the environment:
+
+- ``SESSION_TOKEN_BUDGET``: total tokens one session may use.
+- ``DAILY_TOKEN_BUDGET``: total tokens all sessions may use per UTC day.
+
+Once either is exceeded, calls switch to ``CHEAPER_MODEL`` and the call
+sites in ``OPTIONAL_CALL_SITES`` raise ``BudgetExceeded``. Their callers fall
+back to deterministic output.
+"""
+
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Any, Dict, Iterator, Optional
+
+from config import MODEL_PRICING
+
+_current_session: ContextVar[Optional["SessionUsage"]] = ContextVar("evi_session_usage", default=None)
+
+
+class BudgetExceeded(RuntimeError):
+    """Raised for optional model calls once a token budget is spent."""
+
+
+def cost_usd(model: str, input_tokens: int, cached_tokens: int, output_tokens: int) -> float:
+    prices = MODEL_PRICING.get(model)
+    if prices is None:
+        return 0.0
+    uncached = max(0, input_tokens - cached_tokens)
+    return (
+        uncached * prices["input"]
+        + cached_tokens * prices["cached"]
+        + output_tokens * prices["output"]
+    ) / 1_000_000
+
+
+class _Totals:
+    __slots__ = ("calls", "input_tokens", "cached_tokens", "output_tokens", "cost_usd")
+
+    def __init__(self):
+        self.calls = 0
+        self.input_tokens = 0
+        self.cached_tokens = 0
+        self.output_tokens = 0
+        self.cost_usd = 0.0
+
+    def add(self, input_tokens: int, cached_tokens: int, output_tokens: int, cost: float) -> None:
+        self.calls += 1
+        self.input_tokens += input_tokens
+        self.cached_tokens += cached_tokens
+        self.output_tokens += output_tokens
+        self.cost_usd += cost
+
+    @property
+    def tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "input_tokens": self.input_tokens,
+            "cached_tokens": self.cached_tokens,
+            "output_tokens": self.output_tokens,
+            "cost_usd": round(self.cost_usd, 6),
+        }
+
+
+class SessionUsage(_Totals):
+    """Running totals for one AgentSession."""
+
+    __slots__ = ()
+
+
+class UsageLedger:
+    """Process-wide, thread-safe usage aggregates and budget checks."""
+
+    def __init__(self, session_budget: int = 0, daily_budget: int = 0):
+        self.session_budget = session_budget
+        self.daily_budget = daily_budget
+        self._lock = Lock()
+        self._by_call_site: Dict[str, _Totals] = {}
+        self._by_model: Dict[str, _Totals] = {}
+        self._day = ""
+        self._today = _Totals()
+        self._total = _Totals()
+        self.downgraded_calls = 0
+        self.skipped_calls = 0
+
+    @classmethod
+    def from_env(cls) -> "UsageLedger":
+        return cls(
+            session_budget=int(os.getenv("SESSION_TOKEN_BUDGET", "0") or 0),
+            daily_budget=int(os.getenv("DAILY_TOKEN_BUDGET", "0") or 0),
+        )
+
+    def _roll_day(self) -> None:
+        day = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        if day != self._day:
+            self._day, self._today = day, _Totals()
+
+    def record(
+        self,
+        call_site: str,
+        model: str,
+        input_tokens: int,
+        cached_tokens: int,
+        output_tokens: int,
+    ) -> float:
+        """Add one response's usage everywhere it counts; returns its cost."""
+        cost = cost_usd(model, input_tokens, cached_tokens, output_tokens)
+        session = _current_session.get()
+        with self._lock:
+            self._roll_day()
+            for totals in (
+                self._by_call_site.setdefault(call_site, _Totals()),
+                self._by_model.setdefault(model, _Totals()),
+                self._today,
+                self._total,
+            ):
+                totals.add(input_tokens, cached_tokens, output_tokens, cost)
+            if session is not None:
+                session.add(input_tokens, cached_tokens, output_tokens, cost)
+        return cost
+
+    def over_budget(self, session: Optional[SessionUsage] = None) -> bool:
+        session = session if session is not None else _current_session.get()
+        if self.session_budget and session is not None and session.tokens >= self.session_budget:
+            return True
+        if self.daily_budget:
+            with self._lock:
+                self._roll_day()
+                return self._today.tokens >= self.daily_budget
+        return False
+
+    def note_degraded(self, skipped: bool) -> None:
+        with self._lock:
+            if skipped:
+                self.skipped_calls += 1
+            else:
+                self.downgraded_calls += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            self._roll_day()
+            return {
+                "total": self._total.as_dict(),
+                "today": {"date": self._day, **self._today.as_dict()},
+                "by_call_site": {
+                    name: totals.as_dict() for name, totals in sorted(self._by_call_site.items())
+                },
+                "by_model": {name: totals.as_dict() for name, totals in sorted(self._by_model.items())},
+                "budgets": {
+                    "session_tokens": self.session_budget or None,
+                    "daily_tokens": self.daily_budget or None,
+                    "downgraded_calls": self.downgraded_calls,
+                    "skipped_calls": self.skipped_calls,
+                },
+            }
+
+
+@contextmanager
+def session_usage(usage: SessionUsage) -> Iterator[SessionUsage]:
+    """Attribute model calls made inside the block to ``usage``."""
+    token = _current_session.set(usage)
+    try:
+        yield usage
+    finally:
+        _current_session.reset(token)
+
+
+LEDGER = UsageLedger.from_env()
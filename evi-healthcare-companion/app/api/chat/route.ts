@@ -9,17 +9,31 @@ export async function POST(request: Request) {
 
   const targetUrl = `${baseUrl.replace(/\/$/, "")}/api/chat`
 
+  // The backend rate-limits per client IP, so pass on the address the platform
+  // router saw; otherwise every student shares this proxy's bucket.
+  const headers: Record<string, string> = { "Content-Type": "application/json" }
+  const forwardedFor =
+    request.headers.get("x-forwarded-for") || request.headers.get("x-real-ip")
+  if (forwardedFor) {
+    headers["X-Forwarded-For"] = forwardedFor
+  }
+
   try {
     const response = await fetch(targetUrl, {
       method: "POST",
-      headers: { "Content-Type": "application/json" },
+      headers,
       body,
     })
 
     const text = await response.text()
+    const responseHeaders: Record<string, string> = { "Content-Type": "application/json" }
+    const retryAfter = response.headers.get("retry-after")
+    if (retryAfter) {
+      responseHeaders["Retry-After"] = retryAfter
+    }
     return new NextResponse(text, {
       status: response.status,
-      headers: { "Content-Type": "application/json" },
+      headers: responseHeaders,
     })
   } catch (error) {
     return NextResponse.json(
@@ -262,6 +262,8 @@ export default function Home() {
   const chatSectionRef = useRef<HTMLDivElement>(null)
   const inputRef = useRef<HTMLInputElement>(null)
   const chatScrollRef = useRef<HTMLDivElement>(null)
+  // Field versions from the last response; unchanged fields are then omitted.
+  const knownVersionsRef = useRef<Record<string, number>>({})
   const showRelatedLinks = isProfileComplete(savedProfile)
   const linksToShow = showRelatedLinks ? usefulLinks : onboardingLinks
 
@@ -434,6 +436,7 @@ export default function Home() {
         body: JSON.stringify({
           session_id: sessionId,
           message: trimmed,
+          known_versions: knownVersionsRef.current,
         }),
       })
 
@@ -444,6 +447,9 @@ export default function Home() {
 
       const payload = await response.json()
       setSessionId(payload.session_id)
+      if (payload.versions) {
+        knownVersionsRef.current = payload.versions
+      }
       setMessages((prev) => [...prev, { role: "assistant", message: payload.reply }])
       if (Array.isArray(payload.useful_links)) {
         setUsefulLinks(payload.useful_links)